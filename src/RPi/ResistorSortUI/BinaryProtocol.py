@@ -0,0 +1,231 @@
+import binascii
+import struct
+import SorterProtocol
+
+# The binary link mode, negotiated with BIN;<baud> after the RDY/ACK handshake.
+#
+# Every frame is COBS encoded and terminated by a single zero byte. Before encoding it is:
+#
+#   [seq u8][cmd, 3 ASCII bytes][format u8][body ...][crc16 hi][crc16 lo]
+#
+# seq counts frames in each direction so dropped frames can be detected. The mainboard reports a gap in the host's
+# frames with LOS;<frames missed>, which answers no request; the request that was lost times out and is retried as
+# usual. The CRC is CRC-16/CCITT-FALSE over everything before it. format says how the body holds the arguments:
+#
+#   0  no arguments
+#   1  text: the arguments joined by commas, exactly like the ASCII protocol
+#   2  a fixed little-endian layout for this command, from layouts below
+#
+# A command can have several fixed layouts. The sender uses the first one its arguments fit, and the receiver tells
+# them apart by the length of the body, so no two layouts for a command may be the same size. The compact layouts
+# carry sequence numbers in 16 bits, which covers any real sort; the wider ones are only used past 65535.
+#
+# The firmware (RS_Mainboard.ino) has matching tables. Keep them in step.
+
+fmtEmpty = 0
+fmtText = 1
+fmtFixed = 2
+
+# Fixed layouts, in the order they are tried.
+layouts = {
+    "NXT": [struct.Struct("<H"), struct.Struct("<L")],                  # seq
+    "RDY": [struct.Struct("<H"), struct.Struct("<L")],                  # seq
+    "ACK": [struct.Struct("<H"), struct.Struct("<L")],                  # seq
+    "MES": [struct.Struct("<BfHBHH"), struct.Struct("<BfLBHf")],        # cup, resistance, seq, range, samples, ADC counts
+    "SSR": [struct.Struct("<B9f")],                                     # precision, 9 cup nominals
+    "CUP": [struct.Struct("<BffB")],                                    # cup, min, max, reject
+    "PHS": [struct.Struct("<7L")],                                      # seq, then feed, contact, ranging, release, wheel, swing in micros
+}
+
+# Fields sent as fixed point when their layout gives them an integer, by (command, field index): the value times
+# the scale, rounded. The ADC counts are averaged readings of at most 4095, so sixteenths fit in 16 bits.
+fixedPoint = {
+    ("MES", 5): 16,
+}
+
+def crc16(data):
+    # CRC-16/CCITT-FALSE (poly 0x1021, init 0xFFFF). binascii implements the same polynomial in C.
+    return(binascii.crc_hqx(data, 0xFFFF))
+
+def cobsEncode(data):
+    # Consistent Overhead Byte Stuffing. The result contains no zero bytes.
+    output = bytearray()
+    codeIndex = 0
+    output.append(0)
+    code = 1
+
+    for byte in data:
+        if (byte == 0):
+            output[codeIndex] = code
+            codeIndex = len(output)
+            output.append(0)
+            code = 1
+        else:
+            output.append(byte)
+            code += 1
+            if (code == 0xFF):
+                output[codeIndex] = code
+                codeIndex = len(output)
+                output.append(0)
+                code = 1
+
+    output[codeIndex] = code
+    return(bytes(output))
+
+def cobsDecode(data):
+    # Reverses cobsEncode. Raises ValueError on a malformed block.
+    output = bytearray()
+    index = 0
+
+    while (index < len(data)):
+        code = data[index]
+        if (code == 0 or index + code > len(data)):
+            raise ValueError("Bad COBS block")
+
+        output.extend(data[index + 1:index + code])
+        index += code
+
+        if (code < 0xFF and index < len(data)):
+            output.append(0)
+
+    return(bytes(output))
+
+def fieldCodes(layout):
+    # Expands a struct format such as "<B9f" into one type code per field ("Bfffffffff").
+    codes = ""
+    count = ""
+
+    for code in layout.format[1:]:
+        if code.isdigit():
+            count = count + code
+        else:
+            codes = codes + code * int(count or "1")
+            count = ""
+
+    return(codes)
+
+def packValue(cmd, index, code, arg):
+    # Converts one argument for a struct field of type code.
+    if (code == "f"):
+        return(float(arg))
+
+    scale = fixedPoint.get((cmd, index))
+    if (scale is not None):
+        return(int(round(float(arg) * scale)))
+
+    return(int(arg))
+
+def packArgs(cmd, args):
+    # Returns (format, body) for a command, using the first fixed layout the arguments fit.
+    if (len(args) == 0):
+        return(fmtEmpty, b"")
+
+    for layout in layouts.get(cmd, []):
+        codes = fieldCodes(layout)
+
+        if (len(codes) == len(args)):
+            try:
+                values = [packValue(cmd, index, code, arg) for index, (code, arg) in enumerate(zip(codes, args))]
+                return(fmtFixed, layout.pack(*values))
+            except (ValueError, OverflowError, struct.error):
+                pass
+
+    return(fmtText, ",".join(args).encode("ascii"))
+
+def unpackArgs(cmd, fmt, body):
+    # Turns a frame body back into the list of string arguments the rest of the host expects.
+    if (fmt == fmtEmpty):
+        return([])
+
+    if (fmt == fmtText):
+        return(body.decode("ascii", "replace").split(","))
+
+    for layout in layouts[cmd]:
+        if (layout.size == len(body)):
+            break
+    else:
+        raise struct.error("No {} layout is {} bytes".format(cmd, len(body)))
+
+    output = []
+    for index, value in enumerate(layout.unpack(body)):
+        scale = fixedPoint.get((cmd, index))
+        if (scale is not None and not isinstance(value, float)):
+            value = value / float(scale)
+
+        output.append("{:.4f}".format(value) if isinstance(value, float) else str(value))
+
+    return(output)
+
+class BinaryEncoder:
+    """Builds outgoing binary frames, numbering them as it goes."""
+
+    def __init__(self):
+        self.seq = 0
+
+    def encode(self, cmd, args):
+        fmt, body = packArgs(cmd, args)
+        payload = bytes([self.seq]) + cmd.encode("ascii") + bytes([fmt]) + body
+        payload = payload + struct.pack(">H", crc16(payload))
+
+        self.seq = (self.seq + 1) & 0xFF
+
+        return(cobsEncode(payload) + b"\x00")
+
+class BinaryFrameDecoder:
+    """Splits a binary byte stream into commands, checking the CRC and sequence of each frame.
+
+    feed() returns Commands just like SorterProtocol.FrameDecoder, so everything downstream of the serial reader
+    works unchanged. Corrupt frames are dropped and counted in crcErrors; gaps in the sequence are counted
+    in lostFrames.
+    """
+
+    def __init__(self, log=None):
+        self.buffer = bytearray()
+        self.log = log
+        self.expectedSeq = None
+        self.crcErrors = 0
+        self.lostFrames = 0
+
+    def feed(self, data):
+        self.buffer.extend(data)
+        commands = []
+
+        while True:
+            end = self.buffer.find(b"\x00")
+            if (end == -1):
+                break
+
+            encoded = bytes(self.buffer[:end])
+            del self.buffer[:end + 1]
+
+            if (self.log is not None):
+                self.log(encoded)
+
+            try:
+                payload = cobsDecode(encoded)
+            except ValueError:
+                payload = b""
+
+            # Smallest valid payload: seq, 3 command bytes, format, 2 CRC bytes.
+            if (len(payload) < 7 or crc16(payload[:-2]) != struct.unpack(">H", payload[-2:])[0]):
+                self.crcErrors += 1
+                print("ERROR: Dropped corrupt frame ({} total).\n".format(self.crcErrors))
+                continue
+
+            seq = payload[0]
+            if (self.expectedSeq is not None and seq != self.expectedSeq):
+                self.lostFrames += (seq - self.expectedSeq) & 0xFF
+                print("WARNING: Frame sequence jumped from {} to {}.\n".format(self.expectedSeq, seq))
+            self.expectedSeq = (seq + 1) & 0xFF
+
+            cmd = payload[1:4].decode("ascii", "replace")
+            try:
+                args = unpackArgs(cmd, payload[4], payload[5:-2])
+            except (KeyError, struct.error):
+                self.crcErrors += 1
+                print("ERROR: Dropped frame with an unknown layout for {}.\n".format(cmd))
+                continue
+
+            commands.append(SorterProtocol.Command(cmd, args))
+
+        return(commands)
@@ -0,0 +1,267 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+import numpy as np
+import SorterClient
+import SorterDiscovery
+import RangePlanner  # parseResistance
+
+# Calibrates a mainboard's measurement ranges against reference resistors, without reflashing it.
+#
+# getResistance() turns averaged ADC counts m into ohms with one constant per range: the divider resistor on
+# ranges 1-6 (R = Rd * m / (maxAnalog - m)) and the current source on ranges 7-9 (R = m * avLow / maxAnalog / I).
+# Both are linear in m's transform, so with a few known resistors per range a least squares fit recovers the
+# constant, plus a series offset (leads and contacts) when a range has at least two different references.
+# Errors are weighted relative to each reference so the large and small values on a range count equally.
+#
+# The references are fed through in OHM mode, each MES carries the ADC counts behind it, and the fitted values
+# are pushed with CAL;range,value,offset. They are cached by board serial number, and ResistorSorter sends them
+# again at every session start.
+#
+#   python3 Calibrate.py 47k 100k 220k 4.7k 10k 22k 470 1k 2.2k 47 100 220 4.7 10 [--repeats 3] [--serial SN]
+#   python3 Calibrate.py ... --simulate 2 --verify
+
+# ADC full scale and the current source reference voltage, as in ProgmemData.cpp.
+maxAnalog = 4095
+avLow = 1.5
+
+# Ranges 1-6 are voltage dividers, 7-9 current sources.
+dividerRanges = 6
+
+cachePath = "./calibration.json"
+
+class CalibrationPoint:
+    """One reference reading: the range it was measured on, the ADC counts, the true value and what the
+    mainboard reported."""
+    __slots__ = ("range", "adc", "actual", "reported")
+
+    def __init__(self, measureRange, adc, actual, reported):
+        self.range = measureRange
+        self.adc = adc
+        self.actual = actual
+        self.reported = reported
+
+class RangeFit:
+    """The fitted constants for one range, and the percent errors of its references before and after."""
+
+    def __init__(self, measureRange, value, offset, count, before, after):
+        self.range = measureRange
+        self.value = value
+        self.offset = offset
+        self.count = count
+        self.before = before
+        self.after = after
+
+def transform(measureRange, adc):
+    # The part of getResistance() that depends only on the reading: R = slope * transform + offset.
+    adc = np.asarray(adc, dtype=np.float64)
+
+    if (measureRange <= dividerRanges):
+        return(adc / (maxAnalog - adc))
+
+    return(adc * avLow / maxAnalog)
+
+def fitRange(measureRange, adc, actual, fitOffset=True):
+    # Least squares fit of one range's constant and offset. Returns (value, offset), with value in the units CAL
+    # takes: ohms for the dividers, amps for the current sources.
+    x = transform(measureRange, adc)
+    actual = np.asarray(actual, dtype=np.float64)
+
+    # Dividing every row by its reference makes the residuals relative.
+    if (fitOffset and len(np.unique(actual)) > 1):
+        design = np.column_stack((x, np.ones(len(x)))) / actual[:, None]
+        (slope, offset), _, _, _ = np.linalg.lstsq(design, np.ones(len(x)), rcond=None)
+    else:
+        design = (x / actual)[:, None]
+        (slope,), _, _, _ = np.linalg.lstsq(design, np.ones(len(x)), rcond=None)
+        offset = 0.0
+
+    value = slope if measureRange <= dividerRanges else 1.0 / slope
+    return(float(value), float(offset))
+
+def resistance(measureRange, adc, value, offset):
+    # getResistance() with the given constants.
+    slope = value if measureRange <= dividerRanges else 1.0 / value
+    return(slope * transform(measureRange, adc) + offset)
+
+def percentErrors(measured, actual):
+    return((np.asarray(measured) / np.asarray(actual) - 1.0) * 100.0)
+
+def fitCalibration(points, fitOffsets=True):
+    # Fits every range that has readings. Returns {range: RangeFit}.
+    fits = {}
+
+    for measureRange in sorted(set(point.range for point in points)):
+        rangePoints = [point for point in points if point.range == measureRange]
+        adc = np.array([point.adc for point in rangePoints])
+        actual = np.array([point.actual for point in rangePoints])
+        reported = np.array([point.reported for point in rangePoints])
+
+        value, offset = fitRange(measureRange, adc, actual, fitOffsets)
+        after = percentErrors(resistance(measureRange, adc, value, offset), actual)
+        fits[measureRange] = RangeFit(measureRange, value, offset, len(rangePoints), percentErrors(reported, actual), after)
+
+    return(fits)
+
+def describe(fits):
+    # One line per range: the new constants and the worst error on its references before and after.
+    lines = ["{:<6} {:>14} {:>10} {:>6} {:>12} {:>12}".format("range", "value", "offset", "parts", "worst before", "worst after")]
+
+    for measureRange in sorted(fits):
+        fit = fits[measureRange]
+        lines.append("{:<6} {:>14.7g} {:>10.4f} {:>6} {:>11.3f}% {:>11.3f}%".format(
+            measureRange, fit.value, fit.offset, fit.count, np.abs(fit.before).max(), np.abs(fit.after).max()))
+
+    return("\n".join(lines))
+
+def calCommands(ranges):
+    # CAL commands for {range: (value, offset)}.
+    return([("CAL", [str(measureRange), "{:.9g}".format(value), "{:.6g}".format(offset)]) for measureRange, (value, offset) in sorted(ranges.items())])
+
+def readCache(path=cachePath):
+    # The whole cache: {serial: {"time": ..., "ranges": {range: [value, offset]}}}.
+    if not os.path.exists(path):
+        return({})
+
+    with open(path) as cacheFile:
+        return(json.load(cacheFile))
+
+def loadCalibration(serialNumber, path=cachePath):
+    # The cached calibration for a board as {range: (value, offset)}, or None. Boards without a serial number
+    # are never matched, so one board's calibration can't end up on another.
+    if (serialNumber is None):
+        return(None)
+
+    entry = readCache(path).get(serialNumber)
+    if (entry is None):
+        return(None)
+
+    return({int(measureRange): (value, offset) for measureRange, (value, offset) in entry["ranges"].items()})
+
+def saveCalibration(serialNumber, fits, path=cachePath):
+    # Adds fitted ranges to the cache for a board. Ranges not fitted this time keep their cached values.
+    cache = readCache(path)
+    entry = cache.setdefault(serialNumber, {"ranges": {}})
+    entry["time"] = time.strftime("%Y-%m-%d %H:%M:%S")
+
+    for measureRange, fit in fits.items():
+        entry["ranges"][str(measureRange)] = [fit.value, fit.offset]
+
+    # Write then rename, so a crash never leaves half a file.
+    with open(path + ".tmp", 'w') as cacheFile:
+        json.dump(cache, cacheFile, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+async def measureReferences(client, references, repeats, prompt=None, timeout=30.0):
+    # Feeds every reference repeats times in OHM mode. Returns a CalibrationPoint for every reading.
+    # prompt, if given, is awaited with (reference, index, total) before each part is fed.
+    readings = []
+    client.onMeasurement = readings.append
+
+    await client.request("OHM", timeout=timeout)
+    await client.request("PIP", ["1"], timeout=timeout)
+    await client.request("SRT", expect=["RDY"], timeout=timeout)
+
+    # Sequence numbers tie every MES back to the reference that was fed.
+    fed = {}
+    for reference in references:
+        for i in range(repeats):
+            fed[len(fed) + 1] = reference
+            if (prompt is not None):
+                await prompt(reference, len(fed), len(references) * repeats)
+
+            await client.request("NXT", [str(len(fed))], expect=["ACK", "RDY"], timeout=timeout)
+
+    await client.request("END", expect=["ACK", "DON"], timeout=timeout)
+
+    points = []
+    for mes in readings:
+        try:
+            actual = fed[int(mes.args[2])]
+            point = CalibrationPoint(int(mes.args[3]), float(mes.args[5]), actual, float(mes.args[1]))
+        except (ValueError, IndexError, KeyError):
+            continue
+
+        # Rejected readings carry no counts.
+        if (point.adc > 0):
+            points.append(point)
+
+    return(points)
+
+async def askOperator(reference, index, total):
+    # Waits for the operator to load the next reference.
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, input, "Load {:g} ohms ({} of {}) and press [Enter] ".format(reference, index, total))
+
+async def calibrate(path, serialNumber, references, options):
+    client = await SorterClient.openSorter(path)
+    await client.request("RDY", timeout=30.0)
+
+    prompt = None if options.simulate else askOperator
+    points = await measureReferences(client, references, options.repeats, prompt)
+    if (len(points) == 0):
+        print("No usable readings. Check the references are within the measurable range.")
+        client.close()
+        return
+
+    fits = fitCalibration(points, not options.no_offset)
+    print(describe(fits))
+
+    if not options.no_push:
+        ranges = {measureRange: (fit.value, fit.offset) for measureRange, fit in fits.items()}
+        for cmd, args in calCommands(ranges):
+            await client.request(cmd, args, timeout=30.0)
+        print("\nSent to the mainboard.")
+
+    if (serialNumber is not None):
+        saveCalibration(serialNumber, fits, options.cache)
+        print("Saved for board {} in {}.".format(serialNumber, options.cache))
+
+    if options.verify:
+        points = await measureReferences(client, references, options.repeats, prompt)
+        errors = np.abs(percentErrors([point.reported for point in points], [point.actual for point in points]))
+        print("\nVerification: worst error {:.3f}%, mean {:.3f}% over {} readings.".format(errors.max(), errors.mean(), len(errors)))
+
+    client.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit and push measurement calibration from reference resistors")
+    parser.add_argument("references", nargs="+", help="reference values, e.g. 4.7k; ideally two or more per range")
+    parser.add_argument("--repeats", type=int, default=3, help="readings of each reference")
+    parser.add_argument("--port", help="mainboard serial device")
+    parser.add_argument("--serial", help="USB serial number of the mainboard to use")
+    parser.add_argument("--cache", default=cachePath, help="calibration cache file")
+    parser.add_argument("--no-offset", action="store_true", help="fit only the range constants, not series offsets")
+    parser.add_argument("--no-push", action="store_true", help="fit and save, but don't send CAL")
+    parser.add_argument("--verify", action="store_true", help="measure the references again afterwards")
+    parser.add_argument("--simulate", type=float, metavar="ERROR", help="use a simulated mainboard whose circuit is off by up to ERROR percent")
+    options = parser.parse_args()
+
+    references = [RangePlanner.parseResistance(text) for text in options.references]
+
+    fake = None
+    if (options.simulate is not None):
+        import TeensySim
+
+        hardware = TeensySim.Hardware(options.simulate, contactResistance=0.05, noise=0.3, seed=1)
+        fake = TeensySim.FakeTeensy(TeensySim.cycleValues(np.repeat(references, options.repeats)), hardware=hardware)
+        fake.start()
+        path, serialNumber = fake.path, "SIM1"
+    elif (options.port is not None):
+        path, serialNumber = options.port, options.serial
+    else:
+        device = SorterDiscovery.waitForSorter(options.serial, timeout=10.0)
+        if (device is None):
+            print("No mainboard found.")
+            return
+        path, serialNumber = device.path, device.serialNumber
+
+    asyncio.run(calibrate(path, serialNumber, references, options))
+
+    if (fake is not None):
+        fake.close()
+
+if __name__ == "__main__":
+    main()
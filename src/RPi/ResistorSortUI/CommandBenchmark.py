@@ -0,0 +1,95 @@
+import argparse
+import json
+import time
+import timeit
+import SorterProtocol
+import BinaryProtocol
+
+# Micro-benchmarks for the host side of the Command protocol. Reports encode and decode operations per second and
+# compares them with how many frames the serial link can actually carry, so we can see the host is never the
+# bottleneck at higher baud rates.
+#
+#   python3 CommandBenchmark.py [--output results.json] [--seconds 0.5]
+
+# A typical MES frame as the mainboard sends it: cup, resistance, seq, range, samples, ADC counts.
+mesArgs = ["4", "4700.1234", "1234", "5", "31", "3378.52"]
+
+def opsPerSecond(func, seconds):
+    # Runs func repeatedly for roughly the given time and returns calls per second.
+    timer = timeit.Timer(func)
+    number, elapsed = timer.autorange()
+
+    # Scale up to the requested duration and take the best of three, which is what timeit recommends.
+    number = max(1, int(number * seconds / max(elapsed, 1e-9)))
+    best = min(timer.repeat(repeat=3, number=number))
+
+    return(number / best)
+
+def decodeOps(decoder, stream, framesPerFeed, seconds):
+    # Decode rate in frames per second for a decoder fed the same stream over and over.
+    return(opsPerSecond(lambda: decoder.feed(stream), seconds) * framesPerFeed)
+
+def linkFramesPerSecond(baudrate, frameBytes):
+    # 8N1: ten bits on the wire per byte.
+    return(baudrate / 10.0 / frameBytes)
+
+def runBenchmarks(seconds):
+    results = {}
+
+    # Encoding
+    mesCommand = SorterProtocol.Command("MES", mesArgs)
+    results["encode_ascii_mes"] = opsPerSecond(mesCommand.encode, seconds)
+    results["encode_ascii_rdy"] = opsPerSecond(lambda: SorterProtocol.encodeCmd("RDY", []), seconds)
+    results["encode_cached_rdy"] = opsPerSecond(lambda: SorterProtocol.plainFrames["RDY"], seconds)
+
+    binaryLink = BinaryProtocol.BinaryEncoder()
+    results["encode_binary_mes"] = opsPerSecond(lambda: binaryLink.encode("MES", mesArgs), seconds)
+
+    # Decoding, 32 frames per feed so buffer handling is included.
+    asciiFrame = SorterProtocol.encodeCmd("MES", mesArgs, terminate=True)
+    results["decode_ascii_mes"] = decodeOps(SorterProtocol.FrameDecoder(terminated=True), asciiFrame * 32, 32, seconds)
+
+    binaryFrames = b"".join(binaryLink.encode("MES", mesArgs) for i in range(32))
+    binaryDecoder = BinaryProtocol.BinaryFrameDecoder()
+
+    # Replaying the same frames breaks the sequence check; only the decode cost matters here.
+    def feedBinary():
+        binaryDecoder.expectedSeq = None
+        binaryDecoder.feed(binaryFrames)
+    results["decode_binary_mes"] = opsPerSecond(feedBinary, seconds) * 32
+
+    # String parsing, as used for Commands built from text.
+    asciiText = asciiFrame[:-2].decode("ascii")
+    results["parse_ascii_mes"] = opsPerSecond(lambda: SorterProtocol.parseCmd(asciiText), seconds)
+
+    # What the link can carry, for comparison.
+    link = {}
+    for baudrate in [9600, 115200, 1000000]:
+        link[str(baudrate)] = {
+            "ascii_mes": linkFramesPerSecond(baudrate, len(asciiFrame)),
+            "binary_mes": linkFramesPerSecond(baudrate, len(binaryFrames) / 32.0),
+        }
+
+    return(results, link)
+
+def main():
+    parser = argparse.ArgumentParser(description="Command encode/decode micro-benchmarks")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--seconds", type=float, default=0.5, help="approximate time per benchmark")
+    options = parser.parse_args()
+
+    results, link = runBenchmarks(options.seconds)
+
+    for name in sorted(results):
+        print("{:<22} {:>14,.0f} ops/s".format(name, results[name]))
+
+    print("\nMES frames per second the link can carry:")
+    for baudrate in sorted(link, key=int):
+        print("{:>8} baud   ascii {:>8,.0f}   binary {:>8,.0f}".format(int(baudrate), link[baudrate]["ascii_mes"], link[baudrate]["binary_mes"]))
+
+    if options.output:
+        with open(options.output, 'w') as outFile:
+            json.dump({"time": time.time(), "ops_per_second": results, "link_frames_per_second": link}, outFile, indent=2)
+
+if __name__ == "__main__":
+    main()
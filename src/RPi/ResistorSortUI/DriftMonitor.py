@@ -0,0 +1,182 @@
+import math
+
+# Watches the measurement stream for calibration drift.
+#
+# The mainboard's calibration (internalTestResistances, avHigh and internalCurrentSources in ProgmemData.cpp) is
+# fixed at build time, so worn contacts or a drifting reference only show up as slowly shifting readings. Every
+# MES updates running statistics per cup and per measurement range; none of them keep the readings, so memory
+# stays constant however long the machine runs.
+#
+# Drift itself is measured against reference resistors: precision parts of known value that are fed through the
+# machine every so often, ideally one per range. A reading within captureBand percent of a reference is taken to
+# be that reference, so pick values that no part in the bag comes close to (E96 values between the E24 values of
+# the bag work well). Each reference keeps an exponentially weighted mean and spread of its error, which follow
+# drift within a few readings while ignoring single noisy ones, and raises an alert once either leaves tolerance.
+
+class RunningStats:
+    """Count, mean and variance of a stream, updated one value at a time (Welford's method)."""
+    __slots__ = ("count", "mean", "m2", "low", "high")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.low = None
+        self.high = None
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+        if (self.low is None or value < self.low):
+            self.low = value
+        if (self.high is None or value > self.high):
+            self.high = value
+
+    def variance(self):
+        # Sample variance. 0 until there are two values.
+        return(self.m2 / (self.count - 1) if self.count > 1 else 0.0)
+
+    def stdDev(self):
+        return(math.sqrt(self.variance()))
+
+class Reference:
+    """One reference resistor and the drift seen on it.
+
+    error tracks every reading's error in percent; drift and spread are its exponentially weighted mean and
+    standard deviation, so they follow recent readings. alerted is set while either is out of tolerance.
+    """
+
+    def __init__(self, nominal, alpha):
+        self.nominal = nominal
+        self.alpha = alpha
+        self.error = RunningStats()
+        self.drift = 0.0
+        self.variance = 0.0
+        self.range = None
+        self.alerted = False
+
+    def spread(self):
+        return(math.sqrt(self.variance))
+
+    def add(self, value, measureRange=None):
+        # Adds one reading. Returns its error in percent.
+        error = (value / self.nominal - 1.0) * 100.0
+
+        # Seed the average with the first reading rather than pulling it up from zero.
+        if (self.error.count == 0):
+            self.drift = error
+        else:
+            delta = error - self.drift
+            self.drift += self.alpha * delta
+            self.variance = (1.0 - self.alpha) * (self.variance + self.alpha * delta * delta)
+
+        self.error.add(error)
+        if (measureRange is not None):
+            self.range = measureRange
+
+        return(error)
+
+class DriftMonitor:
+    """Running statistics for every cup and range, and drift alerts from reference resistors.
+
+    tolerancePercent is how far a reference's average error may drift before an alert. minSamples readings of a
+    reference are needed before it can alert, so one bad contact doesn't trip it.
+    """
+
+    def __init__(self, references=None, tolerancePercent=0.5, captureBand=3.0, alpha=0.2, minSamples=5):
+        self.tolerancePercent = tolerancePercent
+        self.captureBand = captureBand
+        self.alpha = alpha
+        self.minSamples = minSamples
+        self.references = [Reference(float(nominal), alpha) for nominal in (references or [])]
+        self.cups = {}
+        self.ranges = {}
+        self.alerts = 0
+
+    def reference(self, value):
+        # The reference this reading belongs to, or None.
+        for reference in self.references:
+            if (abs(value / reference.nominal - 1.0) * 100.0 <= self.captureBand):
+                return(reference)
+
+        return(None)
+
+    def add(self, thisCmd):
+        # Adds one MES. Returns a list of alert messages, empty unless a reference has just gone out of tolerance
+        # or its readings have become too noisy to trust.
+        try:
+            cup = int(thisCmd.args[0])
+            value = float(thisCmd.args[1])
+        except (ValueError, IndexError):
+            return([])
+
+        # Newer mainboards also say which range was used.
+        measureRange = None
+        if (len(thisCmd.args) > 3):
+            try:
+                measureRange = int(thisCmd.args[3])
+            except ValueError:
+                pass
+
+        if (value <= 0):
+            return([])
+
+        self.cups.setdefault(cup, RunningStats()).add(value)
+        if (measureRange is not None):
+            self.ranges.setdefault(measureRange, RunningStats()).add(value)
+
+        reference = self.reference(value)
+        if (reference is None):
+            return([])
+
+        reference.add(value, measureRange)
+        return(self.check(reference))
+
+    def check(self, reference):
+        # Raises or clears the alert on one reference.
+        if (reference.error.count < self.minSamples):
+            return([])
+
+        alerts = []
+        drifted = abs(reference.drift) > self.tolerancePercent
+        noisy = reference.spread() > self.tolerancePercent
+
+        if ((drifted or noisy) and not reference.alerted):
+            reference.alerted = True
+            self.alerts += 1
+
+            where = "" if reference.range is None else " on range {}".format(reference.range)
+            if drifted:
+                alerts.append("Reference {:g}{} reads {:+.2f}% off (tolerance {:g}%).".format(reference.nominal, where, reference.drift, self.tolerancePercent))
+            else:
+                alerts.append("Reference {:g}{} is noisy: {:.2f}% standard deviation.".format(reference.nominal, where, reference.spread()))
+
+        # Only clear once well back inside, so a reference sitting on the limit doesn't alert on every reading.
+        elif (reference.alerted and abs(reference.drift) < self.tolerancePercent / 2 and not noisy):
+            reference.alerted = False
+
+        return(alerts)
+
+    def summary(self):
+        # A table of the references, then the spread in every cup and range.
+        lines = []
+
+        for reference in self.references:
+            if (reference.error.count > 0):
+                lines.append("Reference {:>10g}: {:4d} readings, drift {:+.3f}%, mean {:+.3f}%, sd {:.3f}%{}".format(
+                    reference.nominal, reference.error.count, reference.drift, reference.error.mean,
+                    reference.error.stdDev(), "  OUT OF TOLERANCE" if reference.alerted else ""))
+
+        for label, streams in [("Cup", self.cups), ("Range", self.ranges)]:
+            for key in sorted(streams):
+                stats = streams[key]
+                lines.append("{:<5} {:>2}: {:6d} readings, mean {:12.2f}, sd {:10.2f}, {:g} to {:g}".format(
+                    label, key, stats.count, stats.mean, stats.stdDev(), stats.low, stats.high))
+
+        if (len(lines) == 0):
+            return("No measurements monitored.")
+
+        return("\n".join(lines))
@@ -0,0 +1,171 @@
+import numpy as np
+
+# Standard resistor values and cup assignment on the host, vectorized with NumPy so whole measurement logs can be
+# snapped and re-binned at once.
+#
+# The base tables are the ones in ProgmemData.cpp (values x100 within one decade), and the cup rules mirror the
+# mode handlers and getTargetCup() in RS_Mainboard.ino. Keep them in step.
+
+stdResistors1 = [
+    100, 102, 105, 107, 110, 113, 115, 118, 121, 124, 127, 130, 133, 137, 140, 143,
+    147, 150, 154, 158, 162, 165, 169, 174, 178, 182, 187, 191, 196, 200, 205, 210,
+    215, 221, 226, 232, 237, 243, 249, 255, 261, 267, 274, 280, 287, 294, 301, 309,
+    316, 324, 332, 340, 348, 357, 365, 374, 383, 392, 402, 412, 422, 432, 442, 453,
+    464, 475, 487, 499, 511, 523, 536, 549, 562, 576, 590, 604, 619, 634, 649, 665,
+    681, 698, 715, 732, 750, 768, 787, 806, 825, 845, 866, 887, 909, 931, 953, 976]
+
+stdResistors2_5 = [
+    100, 110, 120, 130, 150, 160, 180, 200, 220, 240, 270, 300, 330, 360, 390, 430,
+    470, 510, 560, 620, 680, 750, 820, 910]
+
+stdResistors10 = [100, 120, 150, 180, 220, 270, 330, 390, 470, 560, 680, 820]
+
+baseTables = {"E96": stdResistors1, "E24": stdResistors2_5, "E12": stdResistors10}
+
+# Decades covered: 1 ohm up to the 1M decade, which is as far as the mainboard measures.
+minDecade = 0
+maxDecade = 6
+
+cupCount = 10
+
+def buildSeries(name, lowDecade=minDecade, highDecade=maxDecade):
+    # Returns every value of the named series from 10^lowDecade up to the end of the 10^highDecade decade, sorted.
+    base = np.array(baseTables[name], dtype=np.float64) / 100.0
+    decades = 10.0 ** np.arange(lowDecade, highDecade + 1, dtype=np.float64)
+
+    return(np.outer(decades, base).ravel())
+
+series = {name: buildSeries(name) for name in baseTables}
+
+def seriesForPrecision(precisionPercent):
+    # The series the mainboard uses for a given precision (see MAJ): 1% is E96, 2% and 5% are E24, anything else E12.
+    if (precisionPercent == 1):
+        return("E96")
+    elif (precisionPercent == 2 or precisionPercent == 5):
+        return("E24")
+    else:
+        return("E12")
+
+def snap(readings, name="E24"):
+    # Returns (nominals, indices): the nearest standard value in the named series for each reading, and its index
+    # into series[name]. "Nearest" is by ratio, since tolerances are percentages, so the boundary between two
+    # neighbours is their geometric mean.
+    values = series[name]
+    readings = np.asarray(readings, dtype=np.float64)
+
+    # Index of the first standard value above each reading, clamped so both neighbours exist.
+    upper = np.clip(np.searchsorted(values, readings), 1, len(values) - 1)
+    lower = upper - 1
+
+    # Compare in log space. Zero and negative readings go to the lowest value.
+    logReadings = np.log(np.maximum(readings, values[0] * 1e-3))
+    logValues = np.log(values)
+    useLower = (logReadings - logValues[lower]) < (logValues[upper] - logReadings)
+
+    indices = np.where(useLower, lower, upper)
+    return(values[indices], indices)
+
+def toleranceBand(nominals, precisionPercent):
+    # Returns (min, max) arrays for nominals at the given precision, the same way as getMin()/getMax() on the mainboard.
+    nominals = np.asarray(nominals, dtype=np.float64)
+    diff = nominals * (precisionPercent / 100.0)
+
+    return(nominals - diff, nominals + diff)
+
+def withinTolerance(readings, precisionPercent, name=None):
+    # Snaps readings to the series for precisionPercent (or the named one) and returns (nominals, inBand), where
+    # inBand says whether each reading is inside its nominal's tolerance band.
+    if (name is None):
+        name = seriesForPrecision(precisionPercent)
+
+    readings = np.asarray(readings, dtype=np.float64)
+    nominals, indices = snap(readings, name)
+    low, high = toleranceBand(nominals, precisionPercent)
+
+    return(nominals, (readings >= low) & (readings <= high))
+
+def assignCups(readings, mins, maxs, rejects):
+    # Returns the cup number (1-based) each reading would go to, following getTargetCup(): the first non-reject cup
+    # whose range holds it, else the first reject cup, else -1.
+    readings = np.asarray(readings, dtype=np.float64)[:, None]
+    accepts = (readings >= mins) & (readings <= maxs) & ~rejects
+
+    cups = np.argmax(accepts, axis=1) + 1
+    found = accepts.any(axis=1)
+
+    if rejects.any():
+        fallback = int(np.argmax(rejects)) + 1
+    else:
+        fallback = -1
+
+    return(np.where(found, cups, fallback))
+
+class CupTable:
+    """The mainboard's cup ranges and reject flags, kept up to date from the setup commands sent to it.
+
+    apply() mirrors the MAJ, SGL, QCR, SSR, OHM and CUP handlers in RS_Mainboard.ino. Until one of them has been
+    applied the table is not configured and assign() returns None.
+    """
+
+    def __init__(self):
+        self.mins = np.zeros(cupCount)
+        self.maxs = np.zeros(cupCount)
+        self.rejects = np.zeros(cupCount, dtype=bool)
+        self.configured = False
+
+    def setCup(self, index, minValue, maxValue, reject=False):
+        self.mins[index] = minValue
+        self.maxs[index] = maxValue
+        self.rejects[index] = reject
+
+    def setNominal(self, index, nominal, precisionPercent):
+        low, high = toleranceBand(nominal, precisionPercent)
+        self.setCup(index, low, high)
+
+    def apply(self, cmd, args):
+        # Updates the table for one command. Returns True if the command was a cup setup command.
+        if (cmd == "MAJ"):
+            precisionPercent = int(args[0])
+            precision = precisionPercent / 100.0
+            top = baseTables[seriesForPrecision(precisionPercent)][-1] / 100.0
+
+            # One decade per cup for the first six cups, the rest reject.
+            for i in range(6):
+                lowSide = 10.0 ** i
+                self.setCup(i, lowSide * (1 - precision), lowSide * top * (1 + precision))
+            self.rejects[6:] = True
+
+        elif (cmd == "SGL" or cmd == "QCR"):
+            self.setNominal(0, float(args[1]), int(args[0]))
+            self.rejects[1:] = True
+
+        elif (cmd == "SSR"):
+            # A precision and up to nine nominals; a blank nominal and cup 10 are reject.
+            precisionPercent = int(args[0])
+            for i in range(1, min(len(args), cupCount)):
+                if (args[i] == ""):
+                    self.rejects[i - 1] = True
+                else:
+                    self.setNominal(i - 1, float(args[i]), precisionPercent)
+            self.rejects[cupCount - 1] = True
+
+        elif (cmd == "OHM"):
+            self.mins[:] = 0.0
+            self.maxs[:] = 1000000000.0
+            self.rejects[:] = False
+
+        elif (cmd == "CUP"):
+            self.setCup(int(args[0]) - 1, float(args[1]), float(args[2]), int(args[3]) != 0)
+
+        else:
+            return(False)
+
+        self.configured = True
+        return(True)
+
+    def assign(self, readings):
+        # Cup numbers for an array of readings, or None if no setup command has been applied yet.
+        if not self.configured:
+            return(None)
+
+        return(assignCups(readings, self.mins, self.maxs, self.rejects))
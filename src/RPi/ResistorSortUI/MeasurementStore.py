@@ -0,0 +1,225 @@
+import argparse
+import array
+import queue
+import sqlite3
+import threading
+import time
+
+# A queryable history of every measurement, kept in SQLite alongside the text measurement log.
+#
+# Writes go through a background thread and are committed in batches, so recording a MES never waits on the disk.
+# Reads open their own read-only connection with a memory-mapped database file, so queries over millions of rows
+# page data in from the OS cache instead of copying it all into the heap. The resistance column is indexed, which
+# makes "every part between 4.6k and 4.8k" a range scan rather than a full one.
+#
+#   python3 MeasurementStore.py [--db measurements.db] [--min 4600] [--max 4800] [--cup 4] [--session ID]
+
+schema = """
+CREATE TABLE IF NOT EXISTS measurements (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    session TEXT NOT NULL,
+    mode TEXT,
+    cup INTEGER,
+    resistance REAL,
+    range INTEGER,
+    samples INTEGER,
+    seq INTEGER
+);
+CREATE INDEX IF NOT EXISTS measurementsResistance ON measurements (resistance);
+CREATE INDEX IF NOT EXISTS measurementsSession ON measurements (session);
+CREATE INDEX IF NOT EXISTS measurementsCup ON measurements (cup, resistance);
+"""
+
+columns = ["ts", "session", "mode", "cup", "resistance", "range", "samples", "seq"]
+
+def buildWhere(minValue=None, maxValue=None, cup=None, session=None, mode=None):
+    # Returns the WHERE clause and its parameters for the given filters. Unset filters match everything.
+    terms = []
+    params = []
+
+    if (minValue is not None):
+        terms.append("resistance >= ?")
+        params.append(minValue)
+    if (maxValue is not None):
+        terms.append("resistance <= ?")
+        params.append(maxValue)
+    if (cup is not None):
+        terms.append("cup = ?")
+        params.append(cup)
+    if (session is not None):
+        terms.append("session = ?")
+        params.append(session)
+    if (mode is not None):
+        terms.append("mode = ?")
+        params.append(mode)
+
+    if (len(terms) == 0):
+        return("", params)
+
+    return(" WHERE " + " AND ".join(terms), params)
+
+def toNumber(text, convert):
+    # MES arguments arrive as strings. Missing or malformed ones are stored as NULL.
+    try:
+        return(convert(text))
+    except (TypeError, ValueError):
+        return(None)
+
+class MeasurementStore(threading.Thread):
+    """Appends measurements to the SQLite database at path from a background thread.
+
+    Rows are committed every commitInterval seconds or every batchSize rows, whichever comes first. Like the text
+    logs, a full queue drops rows rather than blocking the caller; the count is kept in dropped.
+    """
+
+    def __init__(self, path, session, queueSize=10000, batchSize=500, commitInterval=1.0):
+        threading.Thread.__init__(self, name="MeasurementStore", daemon=True)
+
+        self.path = path
+        self.session = session
+        self.rows = queue.Queue(queueSize)
+        self.batchSize = batchSize
+        self.commitInterval = commitInterval
+        self.dropped = 0
+
+        self.start()
+
+    def add(self, mode, args, session=None):
+        # Queues the arguments of one MES: cup, resistance and, from newer mainboards, seq, range and samples.
+        # session overrides the store's own, so one store can take measurements from several machines.
+        args = list(args) + [None] * (5 - len(args))
+        row = (time.time(), session or self.session, mode, toNumber(args[0], int), toNumber(args[1], float),
+               toNumber(args[3], int), toNumber(args[4], int), toNumber(args[2], int))
+
+        try:
+            self.rows.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        # Commits everything still queued, then stops the thread.
+        self.rows.put(None)
+        self.join()
+
+    def run(self):
+        # SQLite connections belong to the thread that made them, so the writer opens its own.
+        database = sqlite3.connect(self.path)
+        database.execute("PRAGMA journal_mode=WAL")    # Readers never block the writer.
+        database.execute("PRAGMA synchronous=NORMAL")  # Safe with WAL; only the last batch can be lost on power cut.
+        database.executescript(schema)
+
+        insert = "INSERT INTO measurements (" + ",".join(columns) + ") VALUES (" + ",".join("?" * len(columns)) + ")"
+        running = True
+
+        while running:
+            batch = []
+            deadline = time.monotonic() + self.commitInterval
+
+            while (len(batch) < self.batchSize):
+                try:
+                    row = self.rows.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+
+                if (row is None):
+                    running = False
+                    break
+
+                batch.append(row)
+
+            if (len(batch) > 0):
+                with database:
+                    database.executemany(insert, batch)
+
+        database.close()
+
+class MeasurementReader:
+    """Read-only queries over a measurement database.
+
+    The file is opened read-only and memory-mapped (up to mmapSize bytes), so it can be used while a sort is
+    writing to it.
+    """
+
+    def __init__(self, path, mmapSize=1 << 30):
+        self.database = sqlite3.connect("file:" + path + "?mode=ro", uri=True)
+        self.database.execute("PRAGMA mmap_size={:d}".format(mmapSize))
+
+    def close(self):
+        self.database.close()
+
+    def query(self, minValue=None, maxValue=None, cup=None, session=None, mode=None):
+        # Yields (ts, session, mode, cup, resistance, range, samples, seq) rows in resistance order. Rows are
+        # fetched as they are consumed, so large results are never held in memory all at once.
+        where, params = buildWhere(minValue, maxValue, cup, session, mode)
+        cursor = self.database.execute("SELECT " + ",".join(columns) + " FROM measurements" + where + " ORDER BY resistance", params)
+
+        for row in cursor:
+            yield row
+
+    def resistances(self, minValue=None, maxValue=None, cup=None, session=None, mode=None):
+        # Returns just the resistance values matching the filters as a flat array of floats.
+        where, params = buildWhere(minValue, maxValue, cup, session, mode)
+        where = where + (" AND" if where else " WHERE") + " resistance IS NOT NULL"
+        cursor = self.database.execute("SELECT resistance FROM measurements" + where, params)
+
+        output = array.array("d")
+        for row in cursor:
+            output.append(row[0])
+
+        return(output)
+
+    def summary(self, minValue=None, maxValue=None, cup=None, session=None, mode=None):
+        # Returns count, mean, standard deviation, min and max of the matching resistances, and how many went into
+        # each cup. Computed inside SQLite, so nothing but the totals comes back.
+        where, params = buildWhere(minValue, maxValue, cup, session, mode)
+
+        count, mean, meanSquare, low, high = self.database.execute(
+            "SELECT COUNT(*), AVG(resistance), AVG(resistance * resistance), MIN(resistance), MAX(resistance) FROM measurements" + where, params).fetchone()
+
+        stdDev = None
+        if (count > 1):
+            # Population variance from the moments, scaled to the sample estimate.
+            stdDev = (max(0.0, meanSquare - mean * mean) * count / (count - 1)) ** 0.5
+
+        cups = {}
+        for cupNum, cupCount in self.database.execute("SELECT cup, COUNT(*) FROM measurements" + where + " GROUP BY cup", params):
+            cups[cupNum] = cupCount
+
+        return({"count": count, "mean": mean, "stdDev": stdDev, "min": low, "max": high, "cups": cups})
+
+    def sessions(self):
+        # Returns (session, mode, count, first ts, last ts) for each session and mode, oldest first.
+        return(self.database.execute(
+            "SELECT session, mode, COUNT(*), MIN(ts), MAX(ts) FROM measurements GROUP BY session, mode ORDER BY MIN(ts)").fetchall())
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise stored measurements")
+    parser.add_argument("--db", default="./measurements.db", help="measurement database")
+    parser.add_argument("--min", type=float, help="lowest resistance to include")
+    parser.add_argument("--max", type=float, help="highest resistance to include")
+    parser.add_argument("--cup", type=int, help="only this cup")
+    parser.add_argument("--session", help="only this session")
+    parser.add_argument("--mode", help="only this sort mode (MAJ, SSR, SGL, QCR, OHM)")
+    parser.add_argument("--sessions", action="store_true", help="list sessions instead")
+    options = parser.parse_args()
+
+    reader = MeasurementReader(options.db)
+
+    if options.sessions:
+        for session, mode, count, first, last in reader.sessions():
+            print("{}  {:<4} {:>8} parts  {} to {}".format(session, mode or "-", count,
+                  time.strftime("%Y-%m-%d %H:%M", time.localtime(first)), time.strftime("%H:%M", time.localtime(last))))
+    else:
+        stats = reader.summary(options.min, options.max, options.cup, options.session, options.mode)
+        print("Count: {}".format(stats["count"]))
+        if (stats["count"] > 0):
+            print("Mean: {:.4f}  Std Dev: {}  Min: {:.4f}  Max: {:.4f}".format(stats["mean"],
+                  "-" if stats["stdDev"] is None else "{:.4f}".format(stats["stdDev"]), stats["min"], stats["max"]))
+            for cupNum in sorted(stats["cups"], key=lambda c: -1 if c is None else c):
+                print("Cup {}: {}".format(cupNum, stats["cups"][cupNum]))
+
+    reader.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import math
+
+# Aggregates the per-phase timings the mainboard reports with telemetry on (TLM;1). After each resistor is
+# dispensed it sends:
+#
+#   PHS;seq,feed,contact,ranging,release,wheel,swing
+#
+# with each phase in microseconds. feed and wheel are motions that overlap other work; the rest are blocking.
+
+phases = ["feed", "contact", "ranging", "release", "wheel", "swing"]
+
+# Histogram buckets: four per decade from 100 us to 10 s, plus one each for anything below or above.
+bucketsPerDecade = 4
+lowestBucket = 100.0
+bucketCount = 5 * bucketsPerDecade + 2
+
+def bucketIndex(micros):
+    if (micros < lowestBucket):
+        return(0)
+
+    index = int(math.log10(micros / lowestBucket) * bucketsPerDecade) + 1
+    return(min(index, bucketCount - 1))
+
+def bucketLimit(index):
+    # Upper bound of a bucket in microseconds (infinite for the last).
+    if (index >= bucketCount - 1):
+        return(float("inf"))
+
+    return(lowestBucket * 10 ** (index / float(bucketsPerDecade)))
+
+def percentile(ordered, p):
+    # Nearest-rank percentile of an already sorted list.
+    index = max(0, min(len(ordered) - 1, int(math.ceil(p / 100.0 * len(ordered))) - 1))
+    return(ordered[index])
+
+class PhaseProfile:
+    """Timings for one sort session: every sample per phase, and a log-scale histogram of each for live display."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.samples = {phase: [] for phase in phases}
+        self.histograms = {phase: [0] * bucketCount for phase in phases}
+        self.count = 0
+
+    def add(self, thisCmd):
+        # Records one PHS command. Malformed ones are ignored.
+        try:
+            values = [int(arg) for arg in thisCmd.args[1:1 + len(phases)]]
+        except ValueError:
+            return
+
+        if (len(values) != len(phases)):
+            return
+
+        for phase, micros in zip(phases, values):
+            self.samples[phase].append(micros)
+            self.histograms[phase][bucketIndex(micros)] += 1
+
+        self.count += 1
+
+    def stats(self, phase):
+        # (mean, p50, p95, max) in milliseconds for one phase.
+        ordered = sorted(self.samples[phase])
+        mean = sum(ordered) / float(len(ordered))
+
+        return(mean / 1000.0, percentile(ordered, 50) / 1000.0, percentile(ordered, 95) / 1000.0, ordered[-1] / 1000.0)
+
+    def summary(self):
+        # A table of every phase, with its share of the blocking time per resistor.
+        if (self.count == 0):
+            return("No phase timings received.")
+
+        means = {phase: self.stats(phase)[0] for phase in phases}
+        blocking = sum(means[phase] for phase in ["contact", "ranging", "release", "swing"])
+
+        lines = ["Phase timings over {} resistors (ms):".format(self.count),
+                 "{:<8} {:>9} {:>9} {:>9} {:>9} {:>7}".format("phase", "mean", "p50", "p95", "max", "share")]
+
+        for phase in phases:
+            mean, p50, p95, high = self.stats(phase)
+            share = "{:6.1f}%".format(100.0 * mean / blocking) if phase not in ["feed", "wheel"] and blocking > 0 else "   (bg)"
+            lines.append("{:<8} {:9.1f} {:9.1f} {:9.1f} {:9.1f} {}".format(phase, mean, p50, p95, high, share))
+
+        return("\n".join(lines))
+
+    def renderHistogram(self, phase, width=40):
+        # A text histogram of one phase, one line per non-empty bucket.
+        counts = self.histograms[phase]
+        peak = max(counts)
+        if (peak == 0):
+            return(phase + ": no data")
+
+        lines = [phase + ":"]
+        for index, bucketTotal in enumerate(counts):
+            if (bucketTotal > 0):
+                limit = bucketLimit(index)
+                label = "inf" if math.isinf(limit) else "{:.1f}".format(limit / 1000.0)
+                lines.append("  <{:>8} ms {:<{}} {}".format(label, "#" * max(1, bucketTotal * width // peak), width, bucketTotal))
+
+        return("\n".join(lines))
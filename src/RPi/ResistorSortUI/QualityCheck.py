@@ -0,0 +1,158 @@
+import math
+
+# Incoming inspection statistics for a QC (QCR) sort.
+#
+# The mainboard puts parts within tolerance in cup 1 and everything else in the rejects. This keeps the lot's
+# statistics as the measurements arrive, in constant memory: yield, mean and standard deviation (Welford), Cpk
+# against the tolerance band, and a histogram across twice the band.
+#
+# A reading of 0.0 is a part that was open or out of every range. It is a defect like any other out of tolerance
+# part, in the yield and the SPRT, but has no value to add to the mean, standard deviation or Cpk. (An empty feed
+# position after a jam also reads 0.0; StallWatchdog picks those out before they get here.)
+#
+# It also runs Wald's sequential probability ratio test on the defect rate. The lot is acceptable if at most
+# acceptableRate of it is out of tolerance and should be rejected at rejectableRate or more; after every part the
+# log likelihood ratio of the two is compared with bounds set by the risks alpha (rejecting a good lot) and beta
+# (accepting a bad one). A bad lot crosses the reject bound after a few tens of parts, so it can be stopped there
+# instead of being measured in full.
+
+class QualityCheck:
+    """Statistics and the SPRT decision for one lot.
+
+    nominal and precisionPercent set the tolerance band, as in QCR. decision is None while the test is undecided,
+    then "accept" or "reject"; once made it stands, while the statistics keep counting every part.
+    """
+
+    def __init__(self, nominal, precisionPercent, acceptableRate=0.01, rejectableRate=0.05, alpha=0.05, beta=0.10, bins=20):
+        self.nominal = float(nominal)
+        self.precisionPercent = precisionPercent
+        self.low = self.nominal * (1.0 - precisionPercent / 100.0)
+        self.high = self.nominal * (1.0 + precisionPercent / 100.0)
+
+        # Per part contribution to the log likelihood ratio, and the bounds it is tested against.
+        self.defectStep = math.log(rejectableRate / acceptableRate)
+        self.passStep = math.log((1.0 - rejectableRate) / (1.0 - acceptableRate))
+        self.rejectBound = math.log((1.0 - beta) / alpha)
+        self.acceptBound = math.log(beta / (1.0 - alpha))
+
+        # Histogram over [nominal - 2 tolerances, nominal + 2 tolerances], plus one bin either side for the rest.
+        self.bins = bins
+        self.histLow = self.nominal - 2.0 * (self.nominal - self.low)
+        self.binWidth = 4.0 * (self.nominal - self.low) / bins
+
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.passed = 0
+        self.unreadable = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.ratio = 0.0
+        self.decision = None
+        self.decidedAt = None
+        self.histogram = [0] * (self.bins + 2)
+
+    def add(self, value):
+        # Adds one measurement. Returns the decision if this part made it, otherwise None. A reading of 0.0 (no
+        # reading) counts as a defect.
+        self.count += 1
+
+        if (value <= 0):
+            self.unreadable += 1
+            value = 0.0
+        else:
+            readable = self.count - self.unreadable
+            delta = value - self.mean
+            self.mean += delta / readable
+            self.m2 += delta * (value - self.mean)
+
+        index = int(math.floor((value - self.histLow) / self.binWidth)) + 1
+        self.histogram[max(0, min(index, self.bins + 1))] += 1
+
+        inTolerance = (value > 0 and value >= self.low and value <= self.high)
+        if inTolerance:
+            self.passed += 1
+
+        if (self.decision is not None):
+            return(None)
+
+        self.ratio += self.passStep if inTolerance else self.defectStep
+        if (self.ratio >= self.rejectBound):
+            self.decision = "reject"
+        elif (self.ratio <= self.acceptBound):
+            self.decision = "accept"
+        else:
+            return(None)
+
+        self.decidedAt = self.count
+        return(self.decision)
+
+    def yieldPercent(self):
+        return(100.0 * self.passed / self.count if self.count > 0 else 0.0)
+
+    def stdDev(self):
+        readable = self.count - self.unreadable
+        return(math.sqrt(self.m2 / (readable - 1)) if readable > 1 else 0.0)
+
+    def cpk(self):
+        # Process capability against the tolerance band. None until there is a spread to measure.
+        sigma = self.stdDev()
+        if (sigma == 0):
+            return(None)
+
+        return(min(self.high - self.mean, self.mean - self.low) / (3.0 * sigma))
+
+    def status(self):
+        # One line for the console after each part.
+        cpk = self.cpk()
+        return("Lot: {} parts, yield {:.1f}%, Cpk {}{}".format(self.count, self.yieldPercent(),
+            "-" if cpk is None else "{:.2f}".format(cpk),
+            "" if self.decision is None else ", {} after {}".format(self.decision.upper(), self.decidedAt)))
+
+    def renderHistogram(self, width=40):
+        # A text histogram, one line per bin, with the tolerance limits marked.
+        peak = max(max(self.histogram), 1)
+        lines = []
+
+        for index, binTotal in enumerate(self.histogram):
+            if (index == 0):
+                label = "{:>12}".format("< {:g}".format(self.histLow))
+            elif (index == self.bins + 1):
+                label = "{:>12}".format("> {:g}".format(self.histLow + self.bins * self.binWidth))
+            else:
+                label = "{:>12.5g}".format(self.histLow + (index - 0.5) * self.binWidth)
+
+            lower = self.histLow + (index - 1) * self.binWidth
+            marker = "|" if (lower >= self.low and lower + self.binWidth <= self.high + 1e-9) else " "
+            lines.append("{} {} {:<{}} {}".format(label, marker, "#" * (binTotal * width // peak), width, binTotal))
+
+        return("\n".join(lines))
+
+    def report(self):
+        # The lot summary printed at the end of the sort.
+        if (self.count == 0):
+            return("No parts measured.")
+
+        lines = ["Quality check of {:g} at {}%: {} parts".format(self.nominal, self.precisionPercent, self.count),
+                 "  Yield:  {:.2f}% ({} in tolerance, {} with no reading)".format(self.yieldPercent(), self.passed, self.unreadable)]
+
+        if (self.count > self.unreadable):
+            lines.append("  Mean:   {:.4g} ({:+.3f}% from nominal)".format(self.mean, (self.mean / self.nominal - 1.0) * 100.0))
+            lines.append("  SD:     {:.4g} ({:.3f}%)".format(self.stdDev(), self.stdDev() / self.nominal * 100.0))
+        else:
+            lines.append("  Mean:   -")
+            lines.append("  SD:     -")
+
+        cpk = self.cpk()
+        lines.append("  Cpk:    " + ("-" if cpk is None else "{:.2f}".format(cpk)))
+
+        if (self.decision is None):
+            lines.append("  Lot:    undecided")
+        else:
+            lines.append("  Lot:    {} after {} parts".format(self.decision.upper(), self.decidedAt))
+
+        lines.append("")
+        lines.append(self.renderHistogram())
+
+        return("\n".join(lines))
@@ -0,0 +1,294 @@
+import argparse
+import os
+import numpy as np
+import ESeries
+import MeasurementStore
+
+# Plans a Range Sort: every standard value between two resistances gets its own cup, over as few passes as possible.
+#
+# Only cups 1-9 take values; cup 10 is the reject cup. Anything not sorted in one pass is refed from cup 10 in the
+# next, so a value sorted in pass k is handled k times. A pass with fewer than nine values is set up with SSR and then
+# CUP for every cup: a blank SSR nominal makes that cup a reject, and the mainboard sends rejects to the first reject
+# cup, so strays would land in the lowest unused cup instead of cup 10. The SSR still goes first so the pass is
+# recorded as an SSR sort rather than under whichever mode ran before it. The number of passes is fixed by how many values there are,
+# but which values go in which pass decides the handling: putting the most common values first means most of the
+# bag leaves the machine early. With a histogram from past measurements the plan is ordered that way; without one,
+# values are taken in ascending order, which is the easiest to follow at the machine.
+#
+# Every pass measures the whole of cup 10 again, so by the end of a pass the host has a reading for every part that
+# will be fed in the next one. RejectCache keeps them, and replan() uses them to re-plan the passes still to come:
+# values nothing in cup 10 matches are dropped, the rest are ordered by their exact counts, and each pass carries a
+# hint (HNT) of where its parts measure so the mainboard starts ranging there instead of trying every range.
+#
+#   python3 RangePlanner.py 100 10k 5 [--db measurements.db]
+
+sortCups = 9
+
+class SortPass:
+    """One pass of a plan: the nominal for each cup (None for cups left as rejects) and the parts expected in it.
+    hint, if set, is the resistance the parts fed in this pass are expected near."""
+
+    def __init__(self, number, nominals, precisionPercent, fed, expected, hint=None):
+        self.number = number
+        self.nominals = nominals
+        self.precisionPercent = precisionPercent
+        self.fed = fed
+        self.expected = expected
+        self.hint = hint
+
+    def full(self):
+        # True if every one of cups 1-9 has a value.
+        return(all(nominal is not None for nominal in self.nominals))
+
+    def ssrArgs(self):
+        # SSR arguments: the precision, then a nominal for each of cups 1-9. Blank cups become rejects, so a short
+        # pass follows it with CUP.
+        args = [str(self.precisionPercent)]
+
+        for nominal in self.nominals:
+            args.append("" if nominal is None else "{:g}".format(nominal))
+
+        return(args)
+
+    def cupArgs(self):
+        # CUP arguments for each cup, as an alternative to SSR: cup, min, max, reject. Cup 10 is the only reject.
+        output = []
+
+        for i, nominal in enumerate(self.nominals):
+            if (nominal is None):
+                # An unused cup accepts nothing (its minimum is above its maximum) but isn't a reject either.
+                output.append([str(i + 1), "1", "0", "0"])
+            else:
+                low, high = ESeries.toleranceBand(nominal, self.precisionPercent)
+                output.append([str(i + 1), "{:.4f}".format(low), "{:.4f}".format(high), "0"])
+
+        output.append([str(ESeries.cupCount), "0", "0", "1"])
+
+        return(output)
+
+    def commands(self, style=None):
+        # The (cmd, args) sequence that sets the mainboard up for this pass. Always an SSR, which sets the sort mode;
+        # then, without a style, CUP for every cup of a short pass.
+        if (style is None):
+            style = "SSR" if self.full() else "CUP"
+
+        output = [("SSR", self.ssrArgs())]
+        if (style == "CUP"):
+            output.extend(("CUP", args) for args in self.cupArgs())
+
+        if (self.hint is not None):
+            output.append(("HNT", ["{:.4g}".format(self.hint)]))
+
+        return(output)
+
+    def targets(self):
+        return([nominal for nominal in self.nominals if nominal is not None])
+
+class RangePlan:
+    """A complete Range Sort plan.
+
+    passes is the list of SortPass in the order they run. fed and strays are the expected part counts; handling is
+    the total number of times parts are fed through the machine across all passes.
+    """
+
+    def __init__(self, passes, precisionPercent, strays):
+        self.passes = passes
+        self.precisionPercent = precisionPercent
+        self.strays = strays
+        self.handling = sum(sortPass.fed for sortPass in passes)
+
+    def describe(self):
+        # A printable summary of the plan, one line per pass.
+        lines = ["{} passes at {}%, about {:.0f} parts handled in total.".format(len(self.passes), self.precisionPercent, self.handling)]
+
+        for sortPass in self.passes:
+            values = ", ".join(formatResistance(nominal) for nominal in sortPass.targets())
+            lines.append("Pass {}: {} (expect {:.0f} of {:.0f} fed)".format(sortPass.number, values, sortPass.expected, sortPass.fed))
+
+        if (self.strays > 0):
+            lines.append("About {:.0f} parts match none of these values and will finish in cup 10.".format(self.strays))
+
+        return("\n".join(lines))
+
+def formatResistance(value):
+    # 4700.0 -> "4.7k", the way fetchResistance accepts it.
+    for scale, suffix in [(1e6, "M"), (1e3, "k")]:
+        if (value >= scale):
+            return("{:g}{}".format(value / scale, suffix))
+
+    return("{:g}".format(value))
+
+def targetValues(minValue, maxValue, precisionPercent):
+    # The standard values for this precision that fall inside [minValue, maxValue].
+    values = ESeries.series[ESeries.seriesForPrecision(precisionPercent)]
+
+    # Round to avoid 4.7 * 1000 = 4700.000000000001 style misses at the ends.
+    values = np.round(values, 6)
+    return(values[(values >= minValue) & (values <= maxValue)])
+
+def histogram(readings, targets, precisionPercent):
+    # Counts past readings per target value. Returns (counts, strays), where strays are readings that are within
+    # no target's tolerance band.
+    readings = np.asarray(readings, dtype=np.float64)
+    counts = np.zeros(len(targets))
+
+    if (len(readings) == 0 or len(targets) == 0):
+        return(counts, float(len(readings)))
+
+    low, high = ESeries.toleranceBand(targets, precisionPercent)
+    matched = np.zeros(len(readings), dtype=bool)
+
+    # Same first-match rule as the mainboard uses across cups.
+    for i in range(len(targets)):
+        hits = (readings >= low[i]) & (readings <= high[i]) & ~matched
+        counts[i] = np.count_nonzero(hits)
+        matched |= hits
+
+    return(counts, float(np.count_nonzero(~matched)))
+
+def storedReadings(path, minValue, maxValue, precisionPercent):
+    # Past readings from a measurement database that could belong to this range, or None if there is no database.
+    if not os.path.exists(path):
+        return(None)
+
+    reader = MeasurementStore.MeasurementReader(path)
+    low, high = ESeries.toleranceBand([minValue, maxValue], precisionPercent)
+    readings = np.asarray(reader.resistances(low[0], high[1]))
+    reader.close()
+
+    return(readings)
+
+class RejectCache:
+    """The readings of every part sent to cup in the current pass of a Range Sort (cup 10, the one the operator
+    reloads), which are the parts the next pass will be fed. unreadable counts the rejects that measured 0.0."""
+
+    def __init__(self, cup=ESeries.cupCount):
+        self.cup = cup
+        self.values = []
+        self.unreadable = 0
+
+    def clear(self):
+        self.values = []
+        self.unreadable = 0
+
+    def add(self, value):
+        if (value > 0):
+            self.values.append(value)
+        else:
+            self.unreadable += 1
+
+    def count(self):
+        return(len(self.values) + self.unreadable)
+
+    def readings(self):
+        return(np.asarray(self.values, dtype=np.float64))
+
+    def hint(self):
+        # The median reject by ratio, which is where the next pass's ranging should start. None with no readings.
+        if (len(self.values) == 0):
+            return(None)
+
+        return(float(np.exp(np.median(np.log(self.readings())))))
+
+def planPasses(targets, counts, strays, precisionPercent, ordered, firstPass=1, hint=None):
+    # Splits targets into passes of up to sortCups values. With ordered, the most common values go first; otherwise
+    # they stay in the order given.
+    if ordered:
+        # lexsort's last key is the primary one; ties stay in ascending value order.
+        order = np.lexsort((targets, -counts))
+    else:
+        order = np.arange(len(targets))
+
+    passes = []
+    remaining = counts.sum() + strays
+
+    for start in range(0, len(order), sortCups):
+        chosen = order[start:start + sortCups]
+
+        # Within a pass, cups run in ascending value so the cup order matches the bag labels.
+        chosen = chosen[np.argsort(targets[chosen])]
+        nominals = [float(targets[i]) for i in chosen] + [None] * (sortCups - len(chosen))
+
+        sortedParts = float(counts[chosen].sum())
+        passes.append(SortPass(firstPass + len(passes), nominals, precisionPercent, remaining, sortedParts, hint))
+        remaining -= sortedParts
+
+        # Only the first pass is fed exactly the parts the hint came from.
+        hint = None
+
+    return(passes)
+
+def planRange(minValue, maxValue, precisionPercent, readings=None, bagSize=None):
+    # Plans a Range Sort. readings, if given, are past measurements used to estimate how common each value is;
+    # bagSize scales the estimates to the number of parts about to be sorted.
+    targets = targetValues(minValue, maxValue, precisionPercent)
+    ordered = (readings is not None and len(readings) > 0)
+
+    if ordered:
+        # Most common first.
+        counts, strays = histogram(readings, targets, precisionPercent)
+    else:
+        counts = np.ones(len(targets))
+        strays = 0.0
+
+    if (bagSize is not None):
+        total = counts.sum() + strays
+        if (total > 0):
+            counts = counts * (bagSize / total)
+            strays = strays * (bagSize / total)
+
+    return(RangePlan(planPasses(targets, counts, strays, precisionPercent, ordered), precisionPercent, strays))
+
+def replan(plan, completed, rejects):
+    # Re-plans the passes after the first completed ones from the rejects they left (a RejectCache), without a
+    # survey pass, and returns the whole plan. Values no reject matches are dropped, so it may need fewer passes.
+    # The rejects must come from a pass that ran to the end; after a pass stopped early, keep the old plan.
+    remaining = [nominal for sortPass in plan.passes[completed:] for nominal in sortPass.targets()]
+    targets = np.array(sorted(remaining))
+
+    counts, strays = histogram(rejects.readings(), targets, plan.precisionPercent)
+    strays += rejects.unreadable
+
+    keep = counts > 0
+    passes = planPasses(targets[keep], counts[keep], strays, plan.precisionPercent, True, completed + 1, rejects.hint())
+
+    return(RangePlan(plan.passes[:completed] + passes, plan.precisionPercent, strays))
+
+def main():
+    parser = argparse.ArgumentParser(description="Plan a multi-pass Range Sort")
+    parser.add_argument("low", help="lowest value to sort, e.g. 100 or 4k7")
+    parser.add_argument("high", help="highest value to sort")
+    parser.add_argument("precision", type=int, help="precision in percent")
+    parser.add_argument("--db", help="weight the plan with measurements from this database")
+    parser.add_argument("--bag", type=int, help="number of parts in the bag")
+    parser.add_argument("--cup", action="store_true", help="print CUP commands for every pass, not just short ones")
+    options = parser.parse_args()
+
+    low = parseResistance(options.low)
+    high = parseResistance(options.high)
+
+    readings = None
+    if options.db:
+        readings = storedReadings(options.db, low, high, options.precision)
+
+    plan = planRange(low, high, options.precision, readings, options.bag)
+    print(plan.describe())
+
+    for sortPass in plan.passes:
+        print("\nPass {}:".format(sortPass.number))
+        for cmd, args in sortPass.commands("CUP" if options.cup else None):
+            print(cmd + ";" + ",".join(args))
+
+def parseResistance(text):
+    # Accepts 4700, 4.7k or 4k7.
+    scales = {"R": 1.0, "k": 1e3, "K": 1e3, "M": 1e6}
+
+    for suffix in scales:
+        if suffix in text:
+            whole, _, fraction = text.partition(suffix)
+            return(float(whole + "." + fraction if fraction else whole) * scales[suffix])
+
+    return(float(text))
+
+if __name__ == "__main__":
+    main()
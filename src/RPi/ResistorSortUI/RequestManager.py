@@ -0,0 +1,340 @@
+import collections
+import time
+import SorterProtocol
+
+# Ties every reply from the mainboard back to the request that caused it, with a deadline for each.
+#
+# Every command sent is entered in a pending table with the replies it should get (an ACK, then RDY for NXT, DON for
+# END and so on). Each frame received is matched to the oldest request waiting for that reply, sequence number
+# included where the frame has one, and MES, PHS and ERR frames also go to their handlers whether or not anyone is
+# waiting. Only the ERRs in refusals answer a request, taking the place of a NXT's ACK; every other ERR (a bad frame,
+# no valid cup) is reported without completing anything, and whatever it was about times out or is retried. Anything that matches no request and has no handler is counted as unsolicited and passed to unexpected.
+#
+# The deadline for a reply comes from how long the mechanism takes to produce it, times a safety margin. When it
+# passes, an idempotent command (a setup command, which the mainboard simply applies again) is sent again, up to
+# maxRetries times. Anything else, or a setup command that has used up its retries, times out: the wait gets a TMO
+# pseudo command in place of the reply, like the RCN sent after a reset, and the sort carries on without it.
+#
+# Pipelined RDYs come back in the order the resistors were fed, so a RDY also answers any earlier NXT still waiting
+# for one: that RDY was lost, and the resistor has long since moved on.
+#
+# ACKs carry nothing to say which request they answer. If a retried command's first ACK was only late, a second ACK
+# follows; it is counted as a duplicate rather than reported.
+
+# Mechanical timings in seconds, from ProgmemData.cpp and TeensySim.Timing.
+contactTime = 0.45      # Contact arm home to touch, each way
+swingTime = 0.4         # Swing arm home to open, each way
+rangeTime = 0.15        # Relay settle plus the readings on one measurement range
+rangeCount = 9
+wheelStep = 0.12        # Sort wheel moving one cup
+cupCount = 10
+feedStep = 0.25         # Feed advancing one position
+feedPositions = 5       # Load platform to measurement platform
+
+# A frame there and back, plus the mainboard's loop getting round to it when idle.
+linkTime = 0.25
+
+# One resistor from load platform to cup, worst case: every range tried and the wheel turning all the way.
+measureTime = 2 * contactTime + rangeCount * rangeTime
+cycleTime = feedStep + measureTime + (cupCount - 1) * wheelStep + 2 * swingTime
+
+# How long each reply can take after its request, or after the reply before it. Anything not listed is answered
+# at once, in linkTime. Commands read mid-cycle wait for the current cycle to finish first.
+replyTimes = {("NXT", "ACK"): cycleTime,
+              ("NXT", "RDY"): cycleTime,
+              ("SRT", "RDY"): cycleTime,
+              ("END", "ACK"): cycleTime,
+              ("END", "DON"): feedPositions * cycleTime,
+              ("TME", "MES"): measureTime,
+              ("CFD", "ACK"): feedStep,         # Per cycle asked for
+              ("MSW", "ACK"): (cupCount - 1) * wheelStep,
+              ("CDA", "ACK"): 2 * swingTime,
+              ("BIN", "ACK"): 1.0}
+
+# The replies each command gets, in order. Everything else gets an ACK.
+replyLists = {"NXT": ["ACK", "RDY"],
+              "SRT": ["RDY"],
+              "END": ["ACK", "DON"],
+              "TME": ["ACK", "MES"],
+              "ACK": [],
+              "ERR": [],
+              "DAT": [],
+              "PPW": []}
+
+# A mainboard takes this long to come back from a reset: USB enumeration, then the handshake and setup replay.
+resetTime = 15.0
+
+# ERRs the mainboard sends in place of a NXT's ACK, refusing it. RS_Mainboard.ino sends no other ERR in answer to a
+# request.
+refusals = ["Feed In Process", "Load Platform Not Empty", "Pipeline Full"]
+
+# Pseudo command passed back in place of a reply that never came. Never sent to or by the mainboard.
+timeoutCmd = "TMO"
+
+class Request:
+    """One command sent to the mainboard, the replies it still expects and when the next one is due."""
+    __slots__ = ("cmd", "args", "seq", "expect", "sentAt", "deadline", "attempts")
+
+    def __init__(self, cmd, args, expect):
+        self.cmd = cmd
+        self.args = list(args)
+        self.expect = list(expect)
+        self.seq = args[0] if (cmd == "NXT" and len(args) > 0) else None
+        self.sentAt = time.monotonic()
+        self.deadline = None
+        self.attempts = 1
+
+class RequestManager:
+    """The pending request table and the single place replies are read from.
+
+    fetch(timeout) returns the next received Command, or None if none arrives within timeout seconds (None waits
+    for ever). transmit(cmd, args) sends a command again without entering it in the table. handlers maps commands
+    to functions called with every such frame. unexpected is called with frames nobody asked for. A command in
+    passThrough (RCN) means the mainboard reset: everything pending is dropped and the frame handed straight on.
+    """
+
+    def __init__(self, fetch, transmit, handlers, unexpected, passThrough=(), idempotent=(), maxRetries=2, margin=2.0):
+        self.fetch = fetch
+        self.transmit = transmit
+        self.handlers = handlers
+        self.unexpected = unexpected
+        self.passThrough = list(passThrough)
+        self.idempotent = list(idempotent)
+        self.maxRetries = maxRetries
+        self.margin = margin
+
+        self.pending = []
+        self.duplicates = collections.Counter()     # Further replies owed by retried requests
+        self.held = False
+        self.matched = None
+        self.reset()
+
+    def reset(self):
+        # Clears the metrics.
+        self.counts = collections.Counter()         # (event, command) -> count
+        self.latency = {}                           # (command, reply) -> [count, total seconds, worst seconds]
+
+    # Requests
+
+    def replyTime(self, request, reply):
+        # Seconds allowed for the next reply to request, margin included.
+        if (reply in self.passThrough):
+            seconds = resetTime
+        else:
+            seconds = replyTimes.get((request.cmd, reply), linkTime)
+
+        if (request.cmd == "CFD" and len(request.args) > 0):
+            try:
+                seconds *= max(1, int(request.args[0]))
+            except ValueError:
+                pass
+
+        # Replies that queue behind earlier requests of the same kind, like pipelined RDYs, get their time as well.
+        ahead = sum(1 for other in self.pending if other is not request and other.cmd == request.cmd and other.expect[:1] == [reply])
+        return((ahead + 1) * seconds * self.margin)
+
+    def sent(self, cmd, args=None, expect=None):
+        # Enters a command just sent in the table. Returns its Request, or None if it gets no reply.
+        if (args is None):
+            args = []
+        if (expect is None):
+            expect = replyLists.get(cmd, ["ACK"])
+        if (len(expect) == 0):
+            return(None)
+
+        # Sending the same command again replaces a request that was never answered.
+        request = Request(cmd, args, expect)
+        self.pending = [other for other in self.pending if not (other.cmd == cmd and other.args == request.args)]
+        request.deadline = request.sentAt + self.replyTime(request, expect[0])
+        self.pending.append(request)
+        self.counts["sent", cmd] += 1
+
+        return(request)
+
+    def awaiting(self, reply):
+        # The oldest request whose next reply is reply, or None.
+        for request in self.pending:
+            if (request.expect[0] == reply):
+                return(request)
+
+        return(None)
+
+    def retry(self, request):
+        # Sends request again if it may be. Returns True if it was.
+        if (request.cmd not in self.idempotent or request.attempts > self.maxRetries):
+            return(False)
+
+        request.attempts += 1
+        request.deadline = time.monotonic() + self.replyTime(request, request.expect[0])
+        self.counts["retry", request.cmd] += 1
+        self.transmit(request.cmd, request.args)
+
+        return(True)
+
+    def expire(self, request):
+        # Gives up on request. Returns the TMO that stands in for its reply.
+        self.pending.remove(request)
+        self.counts["timeout", request.cmd] += 1
+
+        return(SorterProtocol.Command(timeoutCmd, [request.cmd, request.expect[0]] + request.args))
+
+    def hold(self):
+        # Stops deadlines passing, while the mainboard is being reconnected or a jam cleared. The RCN after a
+        # reconnect releases them.
+        self.held = True
+
+    def release(self):
+        # Lets deadlines pass again after hold(), counting from now.
+        now = time.monotonic()
+        for request in self.pending:
+            request.deadline = max(request.deadline, now + self.replyTime(request, request.expect[0]))
+
+        self.held = False
+
+    # Receiving
+
+    def match(self, thisCmd):
+        # The pending request thisCmd answers, or None.
+        seq = thisCmd.args[0] if (thisCmd.cmd in ["ACK", "RDY"] and len(thisCmd.args) > 0) else None
+
+        for request in self.pending:
+            if (thisCmd.cmd == "ERR"):
+                # A refused NXT gets an ERR in place of its ACK.
+                if (request.cmd == "NXT" and request.expect[0] == "ACK" and thisCmd.args[:1] and thisCmd.args[0] in refusals):
+                    return(request)
+                continue
+
+            if (request.expect[0] == thisCmd.cmd and (seq is None or request.seq is None or request.seq == seq)):
+                return(request)
+
+        return(None)
+
+    def receive(self, thisCmd):
+        # Files one received frame against the table and hands it to its handler. Returns the request it answered.
+        now = time.monotonic()
+
+        if (thisCmd.cmd in self.passThrough):
+            # Everything pending was lost with the reset, except a request waiting for exactly this.
+            request = self.match(thisCmd)
+            self.pending = []
+            self.held = False
+            return(request)
+
+        request = self.match(thisCmd)
+
+        if (request is not None):
+            reply = request.expect.pop(0)
+
+            if (thisCmd.cmd == "ERR"):
+                self.counts["error", request.cmd] += 1
+                request.expect = []
+            else:
+                stats = self.latency.setdefault((request.cmd, reply), [0, 0.0, 0.0])
+                stats[0] += 1
+                stats[1] += now - request.sentAt
+                stats[2] = max(stats[2], now - request.sentAt)
+
+            if (request.attempts > 1):
+                self.duplicates[reply] += request.attempts - 1
+
+            if (request.seq is not None):
+                overtaken = [other for other in self.pending[:self.pending.index(request)] if other.cmd == request.cmd and other.expect[:1] == [reply]]
+                for other in overtaken:
+                    self.pending.remove(other)
+                    self.counts["overtaken", other.cmd] += 1
+
+            if (len(request.expect) == 0):
+                self.pending.remove(request)
+            else:
+                request.sentAt = now
+                request.deadline = now + self.replyTime(request, request.expect[0])
+
+        handler = self.handlers.get(thisCmd.cmd)
+        if (handler is not None):
+            handler(thisCmd)
+        elif (request is None):
+            if (self.duplicates[thisCmd.cmd] > 0):
+                self.duplicates[thisCmd.cmd] -= 1
+                self.counts["duplicate", thisCmd.cmd] += 1
+            else:
+                self.counts["unsolicited", thisCmd.cmd] += 1
+                self.unexpected(thisCmd)
+
+        return(request)
+
+    def poll(self, limit=None):
+        # Returns the next frame received, or a TMO once a request's deadline has passed for good. matched is set to
+        # the request either one belongs to. With a limit, returns None if limit seconds pass without either.
+        endAt = None if limit is None else time.monotonic() + limit
+
+        while True:
+            due = [request for request in self.pending if request.deadline is not None]
+            timeout = None
+
+            if (len(due) > 0 and not self.held):
+                request = min(due, key=lambda request: request.deadline)
+                timeout = request.deadline - time.monotonic()
+
+                if (timeout <= 0):
+                    if self.retry(request):
+                        continue
+
+                    self.matched = request
+                    return(self.expire(request))
+
+            if (endAt is not None):
+                left = endAt - time.monotonic()
+                if (left <= 0):
+                    self.matched = None
+                    return(None)
+                timeout = left if timeout is None else min(timeout, left)
+
+            thisCmd = self.fetch(timeout)
+            if (thisCmd is None):
+                continue
+
+            self.matched = self.receive(thisCmd)
+            return(thisCmd)
+
+    def waitFor(self, reply):
+        # Waits for reply. Returns it; or the ERR or TMO that came instead, if a request was waiting for it; or a
+        # pass through command. Everything else received meanwhile is dispatched.
+        request = self.awaiting(reply)
+
+        while True:
+            thisCmd = self.poll()
+
+            if (thisCmd.cmd in self.passThrough):
+                return(thisCmd)
+
+            if (request is not None):
+                if (self.matched is request):
+                    return(thisCmd)
+            elif (thisCmd.cmd == reply):
+                return(thisCmd)
+
+    # Metrics
+
+    def total(self, event):
+        return(sum(count for (thisEvent, cmd), count in self.counts.items() if thisEvent == event))
+
+    def troubled(self):
+        # Whether anything went wrong since the last reset.
+        return(any(self.total(event) > 0 for event in ["retry", "timeout", "error", "overtaken", "unsolicited"]))
+
+    def summary(self):
+        # A few lines for the console: totals, then the commands that needed retries or timed out.
+        lines = ["Requests: {} sent, {} retried, {} timed out, {} refused, {} replies lost. {} unsolicited and {} duplicate replies.".format(
+            self.total("sent"), self.total("retry"), self.total("timeout"), self.total("error"), self.total("overtaken"),
+            self.total("unsolicited"), self.total("duplicate"))]
+
+        for event, label in [("retry", "Retried"), ("timeout", "Timed out"), ("error", "Refused"), ("overtaken", "Reply lost"), ("unsolicited", "Unsolicited")]:
+            detail = ["{} x{}".format(cmd, count) for (thisEvent, cmd), count in sorted(self.counts.items()) if thisEvent == event]
+            if (len(detail) > 0):
+                lines.append("  {}: {}".format(label, ", ".join(detail)))
+
+        for (cmd, reply), (count, total, worst) in sorted(self.latency.items()):
+            if (cmd in ["NXT", "SRT", "END"]):
+                lines.append("  {} to {}: mean {:.0f} ms, worst {:.0f} ms over {}".format(cmd, reply, total / count * 1000.0, worst * 1000.0, count))
+
+        return("\n".join(lines))
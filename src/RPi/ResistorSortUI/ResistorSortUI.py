@@ -2,6 +2,11 @@
 from time import sleep
 import re
 
+try:
+    import RangePlanner  # Needs numpy
+except ImportError:
+    RangePlanner = None
+
 def menuPrompt(menuList):
     # Generates a menu prompt given a list of options. Automatically handles ValueErrors and returns the option selected.
     
@@ -78,7 +83,7 @@ def fetchResistance(prompt):
     result = 0.0
     response = ""
     
-    while (format == 0):
+    while (resFormat == 0):
         print("\n")
         response = input(prompt)
         
@@ -146,6 +151,18 @@ def warnConfirm(prompt):
     else:
         return False
 
+def runSort():
+    # Asks whether the sort should run unattended from a hopper, then starts it.
+    
+    if (warnConfirm("Run unattended from the hopper [Y/N]? ")):
+        count = fetchInt("How many resistors are loaded? ", 1, 100000)
+        ResistorSorter.sortContinuous(count)
+        
+        print("Press [Enter] to continue.")
+        input()
+    else:
+        ResistorSorter.sort()
+
 # Menu lists...
 mainMenu = ["1. Major Division Split",
             "2. Range Sort",
@@ -165,13 +182,30 @@ debugMenu = ["1.  Cycle Feed",
              "7.  Flush Serial to Console",
              "8.  Send Ready",
              "9.  Send ACK",
-             "10. Back to Main"]
+             "10. Adaptive Ranging",
+             "11. Phase Telemetry",
+             "12. Wheel Pre-positioning",
+             "13. Drift Monitor",
+             "14. Sequential Sampling",
+             "15. Stall Watchdog",
+             "16. Back to Main"]
+
+ResistorSorter.connect()
 
 print("Sending Ready to Mainboard...\n")
 ResistorSorter.sendRdy()
 
 print("Waiting on handshake...\n")
-ResistorSorter.waitFor("ACK")
+while (ResistorSorter.waitFor("ACK").cmd != "ACK"):
+    # The mainboard may still be starting up. RDY is safe to send until it answers.
+    print("No handshake yet. Sending Ready again...\n")
+    ResistorSorter.sendRdy()
+
+print("Negotiating binary link...\n")
+ResistorSorter.negotiateBinary()
+
+if ResistorSorter.loadCalibration():
+    print("Sent this board's calibration.\n")
 
 quitSelected = False
 sortSetup = False
@@ -191,15 +225,71 @@ while (not quitSelected):
         sortMode.send();
         
         ResistorSorter.waitFor("ACK")
+        ResistorSorter.applySampling(precision)
         
         if (warnConfirm("Would you like to begin this sort [Y/N]? ")):
-            ResistorSorter.sort()
+            runSort()
         
     elif (menuChoice == 2):
-        # Ranged Sort should ask the user what range of values they'd like to sort
-        # Next, it should let them know how many sort cycles this should take and prompt for the OK before continuing.
-        print("Range Sort not yet implemented. Please use a Custom Sort to proceed.")
-        sleep(4)
+        # Ranged Sort asks the user what range of values they'd like to sort, plans the passes, and shows the plan
+        # before running them. Rejects (cup 10) from each pass are refed in the next.
+        if (RangePlanner is None):
+            print("Range Sort needs numpy. Please use a Custom Sort to proceed.")
+            sleep(4)
+            continue
+        
+        precision = fetchInt("What is the nominal precision for this set of resistors (Enter a whole number)? ", 1, 100)
+        lowValue = fetchResistance("What is the lowest value to sort? ")
+        highValue = fetchResistance("What is the highest value to sort? ")
+        
+        # Past measurements, if we have them, let the planner put the most common values first.
+        readings = RangePlanner.storedReadings("./measurements.db", lowValue, highValue, precision)
+        plan = RangePlanner.planRange(lowValue, highValue, precision, readings)
+        
+        if (len(plan.passes) == 0):
+            print("There are no standard values between those resistances.")
+            sleep(4)
+            continue
+        
+        print("\n" + plan.describe())
+        
+        if (warnConfirm("Would you like to begin this sort [Y/N]? ")):
+            # Every pass measures all of cup 10, so its rejects are enough to re-plan the passes still to come.
+            rejects = RangePlanner.RejectCache()
+            ResistorSorter.collectRejects(rejects)
+            completed = 0
+            
+            while (completed < len(plan.passes)):
+                sortPass = plan.passes[completed]
+                for cmd, args in sortPass.commands():
+                    sortSettings = ResistorSorter.Command(cmd, args)
+                    sortSettings.send()
+                    ResistorSorter.waitFor("ACK")
+                ResistorSorter.applySampling(precision)
+                
+                ResistorSorter.clearScreen()
+                if (sortPass.number == 1):
+                    print("Pass 1 of {}. Load the bag.".format(len(plan.passes)))
+                else:
+                    print("Pass {} of {}. Load the parts from cup 10.".format(sortPass.number, len(plan.passes)))
+                print("Cups: " + ", ".join(RangePlanner.formatResistance(nominal) for nominal in sortPass.targets()))
+                
+                rejects.clear()
+                runSort()
+                completed += 1
+                
+                if (completed == len(plan.passes)):
+                    break
+                
+                # A pass that stopped early left parts unmeasured, so its rejects don't describe what is left.
+                if (ResistorSorter.stopReason is None):
+                    plan = RangePlanner.replan(plan, completed, rejects)
+                    print("\n" + plan.describe())
+                
+                if (completed < len(plan.passes) and not warnConfirm("Continue with pass {} [Y/N]? ".format(completed + 1))):
+                    break
+            
+            ResistorSorter.collectRejects(None)
         
     elif (menuChoice == 3):
         # Custom Sort will ask the user what values should be accepted in each cup. 
@@ -218,9 +308,10 @@ while (not quitSelected):
             
         sortSettings.send()
         ResistorSorter.waitFor("ACK")
+        ResistorSorter.applySampling(precision)
         
         if (warnConfirm("Would you like to begin this sort [Y/N]? ")):
-            ResistorSorter.sort()
+            runSort()
         
     elif (menuChoice == 4):
         # Single Value Sort will ask the user what resistor they are looking for, and what precision.
@@ -236,9 +327,10 @@ while (not quitSelected):
             
         sortSettings.send()
         ResistorSorter.waitFor("ACK")
+        ResistorSorter.applySampling(precision)
         
         if (warnConfirm("Would you like to begin this sort [Y/N]? ")):
-            ResistorSorter.sort()
+            runSort()
         
     elif (menuChoice == 5):
         # QC mode will ask the user what the nominal values of the resistors being tested are.
@@ -254,9 +346,13 @@ while (not quitSelected):
         
         sortSettings.send()
         ResistorSorter.waitFor("ACK")
+        ResistorSorter.applySampling(precision)
         
         if (warnConfirm("Would you like to begin this sort [Y/N]? ")):
-            ResistorSorter.sort()
+            # Lot statistics are reported when the sort finishes. A clearly failing lot can be stopped early.
+            earlyReject = warnConfirm("Stop early if the lot is failing [Y/N]? ")
+            ResistorSorter.startQualityCheck(float(cupNom), precision, earlyReject)
+            runSort()
         
     elif (menuChoice == 6):
         # Ohmmeter only asks for confirmation before beginning the "sort" but will report resistances back and ask the user to cycle parts manually.
@@ -268,7 +364,7 @@ while (not quitSelected):
         ResistorSorter.waitFor("ACK")
         
         if (warnConfirm("Would you like to begin measurements [Y/N]? ")):
-            ResistorSorter.sort()
+            runSort()
         
     elif (menuChoice == 7):
         # This will open another menu with certain debug commands.
@@ -315,7 +411,8 @@ while (not quitSelected):
                 mesData = ResistorSorter.waitFor("MES")
                 
                 # Read back the measurement and wait for input.
-                print("Cup: " + mesData.args[0] + ", Resistance: " + mesData.args[1] + "\n")
+                if (mesData.cmd == "MES"):
+                    print("Cup: " + mesData.args[0] + ", Resistance: " + mesData.args[1] + "\n")
                 ResistorSorter.sendAck()
                 input()
                 
@@ -339,14 +436,18 @@ while (not quitSelected):
                     reset.send()
                     ResistorSorter.waitFor("ACK")
                     
-                    print("Please Restart this script.")
-                    while (True):
-                        pass
+                    # The reader reconnects once the Teensy is back on USB and sets it up as it was.
+                    print("Waiting for the mainboard to restart...\n")
+                    if (ResistorSorter.waitFor(ResistorSorter.reconnectCmd).cmd == ResistorSorter.timeoutCmd):
+                        print("The mainboard hasn't come back yet. It will be set up again as soon as it does.\n")
                                     
             elif (debugChoice == 7):
                 # Flush Serial to Console
-                # TODO: Implement Serial Flush
-                sleep(1)
+                for waiting in ResistorSorter.flushCmds():
+                    print(waiting.cmd + ";" + ",".join(waiting.args))
+
+                print("\nPress [Enter] to continue.")
+                input()
                 
             elif (debugChoice == 8):
                 # Force Send RDY
@@ -357,6 +458,42 @@ while (not quitSelected):
                 ResistorSorter.sendAck()
                 
             elif (debugChoice == 10):
+                # Adaptive Ranging
+                if warnConfirm("Enable adaptive ranging [Y/N]? "):
+                    window = fetchInt("Accept readings within what percent of mid-scale [1-50]? ", 1, 50)
+                    ResistorSorter.setAdaptiveRanging(True, window)
+                else:
+                    ResistorSorter.setAdaptiveRanging(False)
+                
+            elif (debugChoice == 11):
+                # Phase Telemetry
+                ResistorSorter.setTelemetry(warnConfirm("Report phase timings after every sort [Y/N]? "))
+                
+            elif (debugChoice == 12):
+                # Wheel Pre-positioning
+                ResistorSorter.setWheelScheduling(warnConfirm("Park the wheel ahead of each resistor [Y/N]? "))
+                
+            elif (debugChoice == 13):
+                # Drift Monitor
+                if warnConfirm("Monitor measurements for calibration drift [Y/N]? "):
+                    numReferences = fetchInt("How many reference resistors will be fed [0-6]? ", 0, 6)
+                    references = [fetchResistance("Value of reference {}? ".format(i + 1)) for i in range(numReferences)]
+                    tolerance = fetchInt("Alert at how many tenths of a percent of drift [1-50]? ", 1, 50) / 10.0
+                    autoPause = warnConfirm("Stop feeding when drift is detected [Y/N]? ")
+                    ResistorSorter.setDriftMonitoring(True, references, tolerance, autoPause)
+                else:
+                    ResistorSorter.setDriftMonitoring(False)
+                
+            elif (debugChoice == 14):
+                # Sequential Sampling
+                sequential = warnConfirm("Stop sampling once a reading is precise enough for the sort [Y/N]? ")
+                ResistorSorter.setSampling(sequential, warnConfirm("Use continuous ADC conversions [Y/N]? "))
+                
+            elif (debugChoice == 15):
+                # Stall Watchdog
+                ResistorSorter.setStallWatchdog(warnConfirm("Clear feed and wheel jams automatically in continuous sorts [Y/N]? "))
+                
+            elif (debugChoice == 16):
                 # Sets the retSelected flag to leave the debug menu.
                 retSelected = True
             
@@ -1,9 +1,34 @@
-﻿import subprocess  # Used to run console commands in special circumstances
-import serial  # Serial Comms
+﻿import serial  # Serial Comms
 import sys
-import tty, termios
 import os
+import tty, termios
 import time
+import threading  # Background serial reader
+import queue  # Thread-safe hand-off of received commands
+import SorterProtocol  # Command framing shared with the async client and simulator
+import BinaryProtocol  # Optional COBS/CRC16 link mode
+import SorterLog  # Background, rotating log files
+import MeasurementStore  # Queryable measurement history
+import PhaseProfile  # Per-phase timings from the mainboard's telemetry
+import WheelScheduler  # Parks the sort wheel ahead of the next resistor
+import SorterDiscovery  # Finds attached mainboards by USB serial number
+import DriftMonitor  # Running statistics and calibration drift alerts
+import QualityCheck  # Lot statistics and early reject for QC sorts
+import SorterTUI  # In-process screen drawing and the live sort display
+import SessionTrace  # Timestamped record of every byte on the serial port
+import RequestManager  # Deadlines, retries and dispatch for everything received
+import StallWatchdog  # Notices and clears feed and wheel jams in unattended sorts
+
+try:
+    import ESeries  # Host copy of the cup rules, for cross-checking the mainboard. Needs numpy.
+except ImportError:
+    ESeries = None
+
+try:
+    import Calibrate  # Cached per-board calibration, sent at session start. Needs numpy.
+except ImportError:
+    Calibrate = None
+import atexit
 
 def getch():
     """getch() -> key character
@@ -23,161 +48,403 @@ def getch():
         termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
     return ch
 
-# Open a logfile for debugging...
-debugFile = open("./debug", 'w')
-measureLog = open("./measurements", 'w')
-    
-serialTTY = ""
-print("Looking for Serial ACM", end='', flush=True)
-loopCount = 0
-
-# Wait until it is found
-while (serialTTY == ""):
-    if (loopCount > 30):
-        loopCount = 0
-        print(".", end='', flush=True)
-    # Since the serial port for the Teensy may change on reboots and resets, we search it up to be sure we don't have issues.
-    proc = subprocess.Popen('ls /dev/tty* | grep ACM', shell=True, stdout=subprocess.PIPE)
-    output = proc.stdout.read()    # Run it and store the result
-    output = output[:-1]        # Remove the last character (the newline)
-    
-    # The proc output comes as a byte string, we need a string literal. Decode it.
-    serialTTY = output.decode("ascii")
-    
-    loopCount += 1
-    
-print ("\n")
+# Nothing below touches the disk or a port until connect() is called.
+session = None
+debugLog = None
+measureLog = None
+measureStore = None
+
+# The sort mode most recently sent to the mainboard, stored with each measurement.
+sortModes = ["MAJ", "SSR", "SGL", "QCR", "OHM"]
+activeMode = None
+
+# Set by setStallWatchdog. Continuous sorts create stallWatchdog on first use, which learns how long each resistor
+# normally takes and works through a recovery when one takes far longer.
+watchdogEnabled = True
+stallWatchdog = None
+
+# The cup ranges we have set up on the mainboard, used to check the cup it picks for every measurement.
+cupTable = ESeries.CupTable() if ESeries is not None else None
+
+# Setup commands as last sent to the mainboard, replayed after it resets. CUP is kept per cup and CAL per range.
+# CUP and HNT belong to one sort mode's setup, so a new mode drops them.
+resumeCmds = sortModes + ["CUP", "CAL", "ARG", "HNT", "SEQ", "TLM", "PIP", "DIV"]
+setupCommands = {}
+
+# Sent to our own receive queue once the link is back after a reset. Never sent to or by the mainboard.
+reconnectCmd = "RCN"
+
+# Passed back by waitFor() in place of a reply that never came, after any retries.
+timeoutCmd = RequestManager.timeoutCmd
+
+# Commands the mainboard can safely be sent twice, so they are sent again when their ACK doesn't come. RDY is always
+# answered with an ACK and changes nothing once the mainboard is up.
+idempotentCmds = resumeCmds + ["RDY"]
+
+# Every session's serial traffic is recorded to a trace here, named after the session (see SessionTrace.py). None
+# turns recording off.
+traceDir = "./traces"
+traceWriter = None
+
+def openLogs():
+    # Opens the logs. All append, are tagged with this session, and are written by their own threads.
+    global session, debugLog, measureLog, measureStore, traceWriter
+    session = SorterLog.newSession()
+    debugLog = SorterLog.LogWriter("./debug", session)
+    measureLog = SorterLog.LogWriter("./measurements", session)
+    measureStore = MeasurementStore.MeasurementStore("./measurements.db", session)
+
+    if (traceDir is not None):
+        traceWriter = SessionTrace.TraceWriter(os.path.join(traceDir, session + ".trace"))
+
+def closeLogs():
+    # Writes out anything still queued before the interpreter exits.
+    if (debugLog is not None):
+        debugLog.close()
+        measureLog.close()
+        measureStore.close()
+
+    if (traceWriter is not None):
+        traceWriter.close()
+
+atexit.register(closeLogs)
+
+def openPort(path, baudrate=9600, firstDelay=0.05, maxDelay=2.0, timeout=30.0):
+    # Opens the serial port at path, retrying while the Teensy boots or udev is still setting its permissions.
+    # The delay between attempts doubles up to maxDelay. Raises serial.SerialException after timeout seconds.
+    deadline = time.monotonic() + timeout
+    delay = firstDelay
+
+    while True:
+        try:
+            # No timeout: reads block in the kernel until data arrives instead of polling in_waiting.
+            return(serial.Serial(path, baudrate, timeout=None))
+        except (serial.SerialException, OSError) as err:
+            if (time.monotonic() + delay > deadline):
+                raise serial.SerialException("Could not open {}: {}".format(path, err))
+
+        time.sleep(delay)
+        delay = min(delay * 2, maxDelay)
+
+def tracePort(serialPort):
+    # Wraps a freshly opened port so its traffic goes into the session trace, if there is one.
+    if (traceWriter is None):
+        return(serialPort)
+
+    return(SessionTrace.RecordingPort(serialPort, traceWriter))
+
+def logFrame(frame):
+    # Writes a received frame to the debug log. The length byte is logged as a number, as it may be a control character.
+    debugLog.record(dir="IN", length=frame[0], frame=frame[1:].decode("ascii", "replace"))
+
+def logBinaryFrame(frame):
+    # Writes a received binary frame to the debug log as hex.
+    debugLog.record(dir="IN", frame=frame.hex())
+
+class SerialReader(threading.Thread):
+    """Blocks on the serial port and queues each complete command as soon as it arrives.
 
-print("Waiting for permission from OS...")
-time.sleep(2)
+    If the port fails (the Teensy reset or the cable was pulled) it waits for the same board to come back, opens
+    it again, repeats the RDY handshake and the setup commands, and then queues an RCN command so whoever is
+    waiting knows that anything in flight was lost.
+    """
+
+    def __init__(self, serialPort, serialNumber=None):
+        threading.Thread.__init__(self, name="SerialReader", daemon=True)
+        self.port = serialPort
+        self.serialNumber = serialNumber
+        self.decoder = SorterProtocol.FrameDecoder(terminated=True, log=logFrame)
+        self.commands = queue.Queue()
+        self.stopping = False
+
+    def run(self):
+        while not self.stopping:
+            try:
+                # read(1) sleeps in select() until the fd is readable, then we take everything else already waiting.
+                data = self.port.read(1)
+                waiting = self.port.in_waiting
+                if (waiting > 0):
+                    data = data + self.port.read(waiting)
+            except (serial.SerialException, OSError) as err:
+                if self.stopping:
+                    break
+                report("WARNING: Lost the mainboard ({}). Waiting for it to come back...".format(err))
+                debugLog.record(event="disconnected", error=err)
+                self.reconnect()
+                continue
+
+            for command in self.decoder.feed(data):
+                self.commands.put(command)
+
+    def stop(self):
+        # Ends the thread and closes the port, without waiting for the mainboard to come back.
+        self.stopping = True
+        self.port.cancel_read()
+        self.join()
+        self.port.close()
+
+    def expect(self, command, timeout=2.0):
+        # Reads directly from the port until command arrives. Only used while reconnecting, before anything else
+        # is reading. Raises TimeoutError if it doesn't.
+        deadline = time.monotonic() + timeout
+
+        while (time.monotonic() < deadline):
+            self.port.timeout = max(0.0, deadline - time.monotonic())
+            for thisCmd in self.decoder.feed(self.port.read(max(1, self.port.in_waiting))):
+                if (thisCmd.cmd == command):
+                    return(thisCmd)
+
+        raise TimeoutError("No {} from the mainboard".format(command))
+
+    def handshake(self, wasBinary):
+        # Brings a freshly reset mainboard back to where it was: RDY/ACK, every setup command, then the binary link.
+        Command("RDY").transmit()
+        self.expect("ACK")
+
+        for setupCmd in list(setupCommands.values()):
+            setupCmd.transmit()
+            self.expect("ACK")
+
+        if wasBinary:
+            baudrate = binaryBaudrate
+            Command("BIN", [str(baudrate)]).transmit()
+            self.expect("ACK")
+            self.port.baudrate = baudrate
+            self.decoder = BinaryProtocol.BinaryFrameDecoder(log=logBinaryFrame)
+            setBinaryLink(BinaryProtocol.BinaryEncoder())
+
+        self.port.timeout = None
+
+    def reconnect(self):
+        # Blocks until the mainboard is back and set up again. Nothing times out meanwhile.
+        global port
+        wasBinary = binaryLink is not None
+        requestManager.hold()
+
+        while True:
+            try:
+                self.port.close()
+            except (serial.SerialException, OSError):
+                pass
 
-# Open Serial Comms
-port = serial.Serial()
-port.baudrate = 9600
-port.port = serialTTY
+            # A reset mainboard always starts in ASCII at 9600.
+            setBinaryLink(None)
+            self.decoder = SorterProtocol.FrameDecoder(terminated=True, log=logFrame)
+
+            device = SorterDiscovery.waitForSorter(self.serialNumber)
+
+            try:
+                if (traceWriter is not None):
+                    traceWriter.record(SessionTrace.dirReset, device.path.encode())
+                self.port = tracePort(openPort(device.path))
+                port = self.port
+                self.handshake(wasBinary)
+                break
+            except (serial.SerialException, OSError, TimeoutError) as err:
+                # The old device node can linger for a moment after a reset. Try again.
+                debugLog.record(event="reconnect failed", path=device.path, error=err)
+                time.sleep(0.1)
+
+        report("Reconnected to the mainboard on {}.".format(device.path))
+        debugLog.record(event="reconnected", path=device.path)
+        self.commands.put(Command(reconnectCmd))
+
+# Everything that consumes commands pulls them from serialReader.commands, through requestManager, once connect()
+# has started it.
+port = None
+serialReader = None
+requestManager = None
+
+def connect(path=None, serialNumber=None, timeout=None):
+    # Opens the logs and the serial port, and starts the background reader. With no path, waits for a Teensy to
+    # be attached (the one with serialNumber, if given). Returns the path opened.
+    openLogs()
+
+    if (path is None):
+        sorters = SorterDiscovery.findSorters(usbIds=SorterDiscovery.teensyIds)
+        if (len(sorters) > 1 and serialNumber is None):
+            print("{} sorters attached, using {}. Run SorterFleet.py to sort on all of them.\n".format(len(sorters), sorters[0].name()))
+
+        print("Looking for the mainboard...\n")
+        device = SorterDiscovery.waitForSorter(serialNumber, timeout)
+        if (device is None):
+            raise serial.SerialException("No mainboard found")
+
+        path = device.path
+        serialNumber = device.serialNumber
+
+    attach(openPort(path), serialNumber)
+    debugLog.record(event="connected", path=path, serial=serialNumber)
+
+    return(path)
+
+def disconnect():
+    # Stops the background reader and closes the port. The logs stay open until closeLogs().
+    global port
+    global serialReader
+
+    if (serialReader is not None):
+        serialReader.stop()
+        serialReader = None
+    port = None
+
+def attach(serialPort, serialNumber=None):
+    # Starts the background reader on an open port, or anything that reads and writes like one (such as a
+    # SessionTrace.ReplayPort). The logs must already be open.
+    global port
+    global serialReader
+    global requestManager
 
-# Continually try to open the port until it is actually open (in case the Teensy isn't ready/is booting up)
-while True:
-    port.open()
-    if port.isOpen():
-        break
+    port = tracePort(serialPort)
+    serialReader = SerialReader(port, serialNumber)
+    requestManager = RequestManager.RequestManager(fetchCmd, retransmit,
+                                                   {"MES": logMeasurement, "PHS": recordPhases, "ERR": reportError, "LOS": reportLost},
+                                                   reportUnexpected, [reconnectCmd], idempotentCmds)
+    serialReader.start()
 
-class Command:
+# Set once the binary link mode has been negotiated. Outgoing frames are built by it instead of Command.encode().
+binaryLink = None
+binaryBaudrate = 115200
+
+def setBinaryLink(encoder, baudrate=None):
+    # Switches outgoing frames to encoder, or back to ASCII with None.
+    global binaryLink
+    global binaryBaudrate
+    binaryLink = encoder
+    if (baudrate is not None):
+        binaryBaudrate = baudrate
+
+class Command(SorterProtocol.Command):
     """Handles Command I/O and parses input strings into more usable forms."""
-    cmd = ""
-    args = []
+    __slots__ = ()
 
     def send(self):
-        # send converts the cmd and arg list into a valid string and sends it over serial.
+        # send converts the cmd and arg list into a valid frame, sends it over serial and waits on its replies.
+        self.transmit()
 
-        # First get the command and append the semicolon
-        output = self.cmd
-        output = output + ";"
-        
-        # Next join the list of args by a comma and append it.
-        output = output + ",".join(self.args)
+        if (requestManager is not None):
+            requestManager.sent(self.cmd, self.args)
 
-        # Get the validation byte and append it to the start
-        byteValue = len(output) + 1
-        validByte = chr(byteValue)
-        output = validByte + output
-        
-        global debugFile
-        debugFile.write("OUT: ")
-        debugFile.write(output)
-        debugFile.write("\n")
+    def transmit(self):
+        # Sends the frame without entering it in the pending requests. Used for retries and after a reset.
+        global binaryLink
+        global activeMode
+        if (self.cmd in sortModes):
+            activeMode = self.cmd
 
-        # Convert to a byte string for serial comms
-        serOut = bytes(output, "ascii")
+        if (cupTable is not None):
+            try:
+                cupTable.apply(self.cmd, self.args)
+            except (ValueError, IndexError):
+                pass
+
+        # Remember how the mainboard was set up, so it can be set up the same way after a reset.
+        if (self.cmd in resumeCmds):
+            if (self.cmd in sortModes):
+                for key in [key for key in setupCommands if key[0] in ["CUP", "HNT"]]:
+                    del setupCommands[key]
+            key = (self.cmd, self.args[0] if self.args else "") if self.cmd in ["CUP", "CAL"] else (self.cmd,)
+            setupCommands.pop(key, None)
+            setupCommands[key] = Command(self.cmd, list(self.args))
+
+        if (binaryLink is not None):
+            serOut = binaryLink.encode(self.cmd, self.args)
+        else:
+            serOut = self.encode()
+
+        if (binaryLink is not None):
+            debugLog.record(dir="OUT", frame=serOut.hex())
+        else:
+            debugLog.record(dir="OUT", length=serOut[0], frame=serOut[1:].decode("ascii"))
 
         # Send it out over the global port.
         global port
         port.write(serOut)
 
-    def parse(self, inputStr):
-        # parse takes an input string and fills out the cmd and args members accordingly.
+def fetchCmd(timeout=None):
+    # This fetches the next Command received by the serial reader. Blocks (without spinning) until one is available,
+    # or for up to timeout seconds, returning None if none came.
 
-        # first we ditch the verification byte (verification byte is used for serial buffer purposes, and is already checked before it gets here)
-        workingStr = inputStr[1:]
+    global serialReader
+    try:
+        output = serialReader.commands.get(timeout=timeout)
+    except queue.Empty:
+        output = None
 
-        # The next three characters will be the command. Take them, then ditch them from the working string along with the semicolon.
-        self.cmd = workingStr[:3]
-        workingStr = workingStr[4:]
+    return(output)
 
-        # If there are characters remaining, those must be arguments.
-        if (len(workingStr) > 0):
-            # Split them by comma (so much easier than in Arduino...)
-            self.args = workingStr.split(',')
-        else:
-            # Otherwise, the argument list is empty.
-            self.args = []
-            
-def fetchCmd():
-    # This fetches the next command in the serial buffer.
-    
-    global port
-    output = ""
+def retransmit(cmd, args):
+    # Sends a request again for requestManager. While the port is down the reader is reconnecting, and replays the
+    # setup itself.
+    try:
+        Command(cmd, args).transmit()
+    except (serial.SerialException, OSError) as err:
+        debugLog.record(event="retry failed", cmd=cmd, error=err)
+        return
+
+    debugLog.record(event="retry", cmd=cmd, args=",".join(args))
+
+def reportError(thisCmd):
+    # Handles an ERR from the mainboard.
+    report("ERROR: Mainboard reported {}".format(",".join(thisCmd.args)))
+    debugLog.record(event="mainboard error", error=",".join(thisCmd.args))
+
+def reportLost(thisCmd):
+    # Handles a LOS: binary frames we sent never reached the mainboard. Whatever was in them times out and is retried.
+    report("WARNING: The mainboard missed {} frame(s) from us.".format(",".join(thisCmd.args)))
+    debugLog.record(event="frames lost", count=",".join(thisCmd.args))
+
+def reportUnexpected(thisCmd):
+    # Handles a frame that answers nothing we sent.
+    report("WARNING: Received unexpected Command {}. Continuing.".format(thisCmd.cmd))
+    debugLog.record(event="unsolicited", cmd=thisCmd.cmd, args=",".join(thisCmd.args))
+
+def flushCmds():
+    # Returns every Command currently waiting in the receive queue without blocking.
+
+    global serialReader
+    output = []
 
-    # Wait until a line is available and grab it
     while True:
-        if (port.in_waiting > 0):
-            nextLine = port.readline()
-            
-            global debugFile
-            debugFile.write("IN: ")
-            debugFile.write(nextLine.decode("ascii"))
-            debugFile.write("\n")
-            
-            # Ditch the newline characters
-            nextLine = nextLine[:-2]
-
-            # verify the length using the byte
-            if (nextLine[0] != len(nextLine)):
-                received = nextLine[0]
-                expected = len(nextLine)
-                print("ERROR: Verification byte invalid. Received {}, Expected {}.\n".format(received, expected))
-            else:
-                output = nextLine.decode("ascii")
-            
+        try:
+            output.append(serialReader.commands.get_nowait())
+        except queue.Empty:
             break
 
     return(output)
 
-def sendRdy():
-    # Creates a standard RDY command and sends it.
-    readyCommand = Command()
+def sendPlain(cmd):
+    # Sends one of the argument-less commands. In ASCII mode its frame is pre-encoded, so this is a single write.
+    global binaryLink
+    if (binaryLink is not None):
+        Command(cmd).send()
+        return
 
-    readyCommand.cmd = "RDY"
-    readyCommand.args = []
+    serOut = SorterProtocol.plainFrames[cmd]
 
-    readyCommand.send()
+    debugLog.record(dir="OUT", length=serOut[0], frame=serOut[1:].decode("ascii"))
 
-def sendAck():
-    # Creates a standard ACK command and sends it.
-    ackCommand = Command()
+    global port
+    port.write(serOut)
 
-    ackCommand.cmd = "ACK"
-    ackCommand.args = []
+    if (requestManager is not None):
+        requestManager.sent(cmd)
 
-    ackCommand.send()
+def sendRdy():
+    # Sends a standard RDY command.
+    sendPlain("RDY")
+
+def sendAck():
+    # Sends a standard ACK command.
+    sendPlain("ACK")
     
 def sendNxt():
-    # Creates a standard NXT command and sends it.
-    nxtCommand = Command()
-
-    nxtCommand.cmd = "NXT"
-    nxtCommand.args = []
-
-    nxtCommand.send()
+    # Sends a standard NXT command.
+    sendPlain("NXT")
     
 def sendEnd():
-    # Creates a standard END command and sends it.
-    endCommand = Command()
-
-    endCommand.cmd = "END"
-    endCommand.args = []
-
-    endCommand.send()
+    # Sends a standard END command.
+    sendPlain("END")
 
 def sendError(err):
     # Creates an ERR command using err as the arg and sends it.
@@ -197,48 +464,400 @@ def sendDat(data):
 
     datCommand.send()
     
+def negotiateBinary(baudrate=115200):
+    # Asks the mainboard to switch to the binary link mode at baudrate. Must follow the RDY/ACK handshake.
+    # Returns True if the mainboard agreed. Firmware without binary support never answers, so we stay in ASCII.
+    global port
+    global serialReader
+
+    binCommand = Command()
+    binCommand.cmd = "BIN"
+    binCommand.args = [str(baudrate)]
+    binCommand.send()
+
+    reply = requestManager.waitFor("ACK")
+    if (reply.cmd == timeoutCmd):
+        print("WARNING: Mainboard did not answer BIN. Staying in ASCII mode.\n")
+        return(False)
+
+    if (reply.cmd != "ACK"):
+        print("WARNING: Received {} in answer to BIN. Staying in ASCII mode.\n".format(reply.cmd))
+        return(False)
+
+    # The mainboard switches as soon as it has sent the ACK, and stays quiet until we next talk to it.
+    port.baudrate = baudrate
+    serialReader.decoder = BinaryProtocol.BinaryFrameDecoder(log=logBinaryFrame)
+    setBinaryLink(BinaryProtocol.BinaryEncoder(), baudrate)
+
+    return(True)
+
+def loadCalibration():
+    # Sends the cached calibration for the connected board, if there is one (see Calibrate.py). Must follow the
+    # RDY/ACK handshake. Returns True if any was sent.
+    if (Calibrate is None or serialReader is None):
+        return(False)
+
+    try:
+        ranges = Calibrate.loadCalibration(serialReader.serialNumber)
+    except (OSError, ValueError) as err:
+        print("WARNING: Could not read the calibration cache. {}\n".format(err))
+        return(False)
+
+    if not ranges:
+        return(False)
+
+    for cmd, args in Calibrate.calCommands(ranges):
+        Command(cmd, args).send()
+        waitFor("ACK")
+
+    debugLog.record(event="calibration sent", serial=serialReader.serialNumber, ranges=",".join(str(r) for r in sorted(ranges)))
+    return(True)
+
+def setAdaptiveRanging(enabled, window=10):
+    # Sends ARG. When enabled, the mainboard starts at the range that won last time and stops ranging as soon as a
+    # reading lands within window percent of mid-scale. Must be sent outside of a sort.
+    argCommand = Command()
+
+    argCommand.cmd = "ARG"
+    argCommand.args = ["1" if enabled else "0", str(window)]
+
+    argCommand.send()
+    waitFor("ACK")
+
+# Sequential sampling. When on, every sort's SEQ asks the mainboard to stop reading a range once the standard error is
+# within sampleFraction of the sort's precision.
+sampleFraction = 0.1
+sequentialSampling = False
+continuousSampling = False
+
+def setSampling(sequential, continuous=False):
+    # Turns sequential sampling and continuous ADC conversions on or off. Must be sent outside of a sort; the
+    # tolerance itself is sent by applySampling() once the sort's precision is known.
+    global sequentialSampling
+    global continuousSampling
+    sequentialSampling = sequential
+    continuousSampling = continuous
+
+    Command("SEQ", ["0", "1" if continuous else "0"]).send()
+    waitFor("ACK")
+
+def applySampling(precisionPercent):
+    # Sends the sampling tolerance for a sort at this precision, so a 10% sort takes far fewer readings than a 1%
+    # one. Nothing is sent unless sequential sampling is on.
+    if not sequentialSampling:
+        return
+
+    Command("SEQ", ["{:g}".format(precisionPercent * sampleFraction), "1" if continuousSampling else "0"]).send()
+    waitFor("ACK")
+
+def setTelemetry(enabled):
+    # Turns per-phase timing reports (PHS after every resistor) on or off. Must be sent while not sorting.
+    telemetryCommand = Command()
+    telemetryCommand.cmd = "TLM"
+    telemetryCommand.args = ["1" if enabled else "0"]
+
+    telemetryCommand.send()
+    waitFor("ACK")
+
+# Phase timings for the current sort, printed and cleared at DON.
+phaseProfile = PhaseProfile.PhaseProfile()
+
+def recordPhases(thisCmd):
+    # Adds a PHS command to the session's profile.
+    phaseProfile.add(thisCmd)
+
+def reportPhases():
+    # Prints the profile of the sort that just finished, if telemetry was on, and starts a new one.
+    if (phaseProfile.count > 0):
+        print(phaseProfile.summary() + "\n")
+        debugLog.record(event="phase profile", **{phase: "{:.1f}".format(phaseProfile.stats(phase)[0]) for phase in PhaseProfile.phases})
+
+    phaseProfile.reset()
+
+def setStallWatchdog(enabled):
+    # Turns jam detection and recovery in continuous sorts on or off.
+    global watchdogEnabled
+    watchdogEnabled = enabled
+
+def sendRecovery(cmd, args):
+    # Sends one command of a jam recovery for stallWatchdog. Its ACK comes back through the sort loop, which passes it
+    # to stallWatchdog.answered() so the next command follows.
+    Command(cmd, args).send()
+    debugLog.record(event="recovery", cmd=cmd, args=",".join(args))
+
+# Set by setWheelScheduling. When present, every MES is followed by a PPW naming where to park the wheel.
+wheelScheduler = None
+
+def setWheelScheduling(enabled):
+    # Turns wheel pre-positioning on or off. PPW is a hint and is never acknowledged.
+    global wheelScheduler
+    wheelScheduler = WheelScheduler.WheelScheduler() if enabled else None
+
+def scheduleWheel(thisCmd):
+    # Tells the mainboard where to park the wheel once the resistor in this MES has been dispensed.
+    if (wheelScheduler is None):
+        return
+
+    try:
+        wheelScheduler.observe(int(thisCmd.args[0]))
+    except (ValueError, IndexError):
+        return
+
+    parkCup = wheelScheduler.parkingCup()
+    if (parkCup is not None):
+        Command("PPW", [str(parkCup)]).send()
+
+# Why the current sort stopped feeding early, or None. Set by checks on the measurement stream; sort() and
+# sortContinuous() then sort out what is already in the feed and finish.
+stopReason = None
+
+# Set by setDriftMonitoring. Every MES goes through it; with pauseOnDrift, an alert stops the sort feeding.
+driftMonitor = None
+pauseOnDrift = False
+
+def setDriftMonitoring(enabled, references=None, tolerancePercent=0.5, autoPause=False):
+    # Starts watching for calibration drift against the given reference resistances, or stops watching.
+    global driftMonitor
+    global pauseOnDrift
+    driftMonitor = DriftMonitor.DriftMonitor(references, tolerancePercent) if enabled else None
+    pauseOnDrift = autoPause
+
+def checkDrift(thisCmd):
+    # Adds a MES to the drift monitor and reports any alert it raises.
+    global stopReason
+    if (driftMonitor is None):
+        return
+
+    for alert in driftMonitor.add(thisCmd):
+        report("WARNING: Calibration drift. " + alert)
+        debugLog.record(event="drift", message=alert)
+
+        if pauseOnDrift:
+            stopReason = "Sorting was paused for calibration drift. Check the contacts and references before carrying on."
+
+# Set by startQualityCheck for the next QCR sort, and reported and cleared when it finishes.
+qualityCheck = None
+rejectEarly = False
+
+def startQualityCheck(nominal, precisionPercent, earlyReject=False):
+    # Keeps lot statistics for the next sort. With earlyReject, feeding stops as soon as the lot is known to fail.
+    global qualityCheck
+    global rejectEarly
+    qualityCheck = QualityCheck.QualityCheck(nominal, precisionPercent)
+    rejectEarly = earlyReject
+
+def checkQuality(thisCmd):
+    # Adds a QCR measurement to the lot and reports the running figures.
+    global stopReason
+    if (qualityCheck is None or activeMode != "QCR"):
+        return
+
+    try:
+        decision = qualityCheck.add(float(thisCmd.args[1]))
+    except (ValueError, IndexError):
+        return
+
+    if (display is not None):
+        display.info("lot", qualityCheck.status())
+    else:
+        print(qualityCheck.status() + "\n")
+
+    if (decision is not None):
+        debugLog.record(event="lot " + decision, parts=qualityCheck.count, yieldPercent="{:.2f}".format(qualityCheck.yieldPercent()))
+
+    if (decision == "reject" and rejectEarly):
+        stopReason = "Lot rejected after {} parts: too many out of tolerance.".format(qualityCheck.count)
+
+# Set by collectRejects. Takes the reading of every part sent to the cup that is refed, for planning the next pass.
+rejectCache = None
+
+def collectRejects(cache):
+    # Starts adding rejects to cache (a RangePlanner.RejectCache), or stops with None.
+    global rejectCache
+    rejectCache = cache
+
+def cacheReject(thisCmd):
+    # Adds a MES to the reject cache if it went to the cup the next pass is fed from. Other reject cups aren't
+    # reloaded, so their parts never reach the next pass.
+    if (rejectCache is None):
+        return
+
+    try:
+        cup = int(thisCmd.args[0])
+        value = float(thisCmd.args[1])
+    except (ValueError, IndexError):
+        return
+
+    if (cup == rejectCache.cup):
+        rejectCache.add(value)
+
+def endSession():
+    # Prints the phase profile and wheel travel for the sort that just finished, then starts afresh.
+    reportPhases()
+
+    if (wheelScheduler is not None):
+        print(wheelScheduler.summary() + "\n")
+        debugLog.record(event="wheel travel", steps=wheelScheduler.travel, exposed=wheelScheduler.exposed, direct=wheelScheduler.directTravel, directExposed=wheelScheduler.directExposed)
+        wheelScheduler.reset()
+
+    if (driftMonitor is not None):
+        print(driftMonitor.summary() + "\n")
+
+    global qualityCheck
+    if (qualityCheck is not None and qualityCheck.count > 0):
+        print(qualityCheck.report() + "\n")
+        cpk = qualityCheck.cpk()
+        debugLog.record(event="quality check", nominal=qualityCheck.nominal, precision=qualityCheck.precisionPercent,
+                        parts=qualityCheck.count, yieldPercent="{:.2f}".format(qualityCheck.yieldPercent()),
+                        mean=qualityCheck.mean, sd=qualityCheck.stdDev(), cpk="-" if cpk is None else "{:.3f}".format(cpk),
+                        decision=qualityCheck.decision or "undecided")
+        qualityCheck = None
+
+    if (stopReason is not None):
+        print(stopReason + "\n")
+
+    if (stallWatchdog is not None):
+        if (stallWatchdog.jams > 0):
+            print(stallWatchdog.summary() + "\n")
+        debugLog.record(event="jams", jams=stallWatchdog.jams, cleared=stallWatchdog.cleared, hours="{:.3f}".format(stallWatchdog.sortTime / 3600.0),
+                        perHour="{:.2f}".format(stallWatchdog.jamRate()), empty=stallWatchdog.emptyPositions)
+
+    if requestManager.troubled():
+        print(requestManager.summary() + "\n")
+    debugLog.record(event="requests", sent=requestManager.total("sent"), retries=requestManager.total("retry"),
+                    timeouts=requestManager.total("timeout"), refused=requestManager.total("error"), lost=requestManager.total("overtaken"),
+                    unsolicited=requestManager.total("unsolicited"), duplicates=requestManager.total("duplicate"))
+    requestManager.reset()
+
+def recordMeasurement(thisCmd):
+    # Appends a MES command to the measurement log. Only queues the record, so it is safe on the sorting path.
+    args = thisCmd.args
+    fields = {"cup": args[0], "resistance": args[1]}
+
+    if (len(args) > 2):
+        fields["seq"] = args[2]
+    if (len(args) > 4):
+        fields["range"] = args[3]
+        fields["samples"] = args[4]
+    if (len(args) > 5):
+        fields["adc"] = args[5]
+
+    measureLog.record(**fields)
+    measureStore.add(activeMode, args)
+
+def checkCup(thisCmd):
+    # Warns if the mainboard's cup for a MES differs from the one the host expects.
+    if (cupTable is None):
+        return
+
+    try:
+        expected = cupTable.assign([float(thisCmd.args[1])])
+        actual = int(thisCmd.args[0])
+    except (ValueError, IndexError):
+        return
+
+    if (expected is not None and expected[0] != actual):
+        report("WARNING: Mainboard sent {} to cup {}, expected cup {}.".format(thisCmd.args[1], actual, expected[0]))
+        debugLog.record(event="cup mismatch", resistance=thisCmd.args[1], cup=actual, expected=expected[0])
+
+def logMeasurement(thisCmd):
+    # Logs a MES command and reports it to the console.
+    if (stallWatchdog is not None and stallWatchdog.measured(thisCmd)):
+        # A position emptied by clearing a jam. There was no resistor to log.
+        debugLog.record(event="empty position", seq=thisCmd.args[2] if len(thisCmd.args) > 2 else "")
+        report("Skipped an empty feed position after the jam.")
+        return
+
+    recordMeasurement(thisCmd)
+    checkCup(thisCmd)
+    checkDrift(thisCmd)
+    checkQuality(thisCmd)
+    cacheReject(thisCmd)
+    scheduleWheel(thisCmd)
+
+    if (display is not None):
+        try:
+            if (len(thisCmd.args) > 4):
+                display.measured(int(thisCmd.args[0]), float(thisCmd.args[1]), int(thisCmd.args[3]), int(thisCmd.args[4]))
+            else:
+                display.measured(int(thisCmd.args[0]), float(thisCmd.args[1]))
+        except (ValueError, IndexError):
+            pass
+        return
+
+    print("Measurement: " + thisCmd.args[1] + "\n")
+    print("Target Cup: " + thisCmd.args[0] + "\n")
+
+    # Newer mainboards also report the range used and how many ADC reads it took.
+    if (len(thisCmd.args) > 4):
+        print("Range: " + thisCmd.args[3] + ", Samples: " + thisCmd.args[4] + "\n")
+
 def waitFor(command):
-    # Waits for the given command and passes it back when received.
-    
-    cmdRecieved = False
-    
-    while (not cmdRecieved):
-        thisInput = fetchCmd()
-        thisCmd = Command()
-        thisCmd.parse(thisInput)
-        
-        if (thisCmd.cmd == "MES"):
-            
-            # Log this measurement
-            global measureLog
-            measureLog.write(','.join(thisCmd.args))
-            measureLog.write('\n')
-            
-            print("Measurement: " + thisCmd.args[1] + "\n")
-            print("Target Cup: " + thisCmd.args[0] + "\n")
+    # Waits for the given command and passes it back when received. Everything else received meanwhile goes to its
+    # handler. Passes back the ERR the mainboard sent instead, an RCN if it reset, or a TMO if the command never came.
     
-        if (thisCmd.cmd == command):
-            cmdRecieved = True
-            
-        elif (thisCmd.cmd != "MES"):
-            print("WARNING: Received unexpected Command. Received {}. Expected {}. Continuing.\n".format(thisCmd.cmd, command))
+    thisCmd = requestManager.waitFor(command)
+
+    if (thisCmd.cmd == reconnectCmd and command != reconnectCmd):
+        # The mainboard reset while we were waiting. What we were waiting for will never come.
+        report("WARNING: Mainboard reset while waiting for {}.".format(command))
+
+    elif (thisCmd.cmd == timeoutCmd):
+        report("WARNING: No {} from the mainboard in answer to {}. Continuing without it.".format(command, thisCmd.args[0]))
+        debugLog.record(event="timeout", cmd=thisCmd.args[0], expected=command)
     
     return(thisCmd)
             
 def clearScreen():
-    os.system('clear')
-    
-    # Title Line
-    print("Resistor Sortation System\n\n")
+    # Clears the screen and prints the title line.
+    SorterTUI.clearScreen()
     
 def setterm(bgCol, fgCol):
-    command = 'setterm -background ' + bgCol + ' -foreground ' + fgCol
-    os.system(command)
+    SorterTUI.setColours(bgCol, fgCol)
     clearScreen()
+
+# The live sort screen while a sort runs on a terminal, else None.
+display = None
+
+def startDisplay():
+    # Starts the live sort screen. When stdout isn't a terminal, progress is printed line by line instead.
+    global display
+    if SorterTUI.isTerminal():
+        display = SorterTUI.SortDisplay()
+        display.start()
+
+def stopDisplay():
+    global display
+    if (display is not None):
+        display.stop()
+        display = None
+
+def showStatus(text, background="black"):
+    # Tells the operator what the sort is doing. The background colour is the signal: red busy, green ready.
+    if (display is not None):
+        display.setStatus(text, background, "white" if background == "black" else "black")
+    else:
+        print(text + "\n\n")
+
+def report(text):
+    # Shows a warning or note on the sort screen if one is up, otherwise prints it. Safe from any thread.
+    if (display is not None):
+        display.message(text)
+    else:
+        print(text + "\n")
     
+def restartSort():
+    # Starts sorting again after the mainboard reset mid-sort. The reader has already replayed its setup.
+    report("Restarting the sort. Anything that was in the feed needs loading again.")
+
+    Command("SRT").send()
+    waitFor("RDY")
+
 def sort():
     # Begins a sort. Prompts will occur like this: ANY BUTTON EXCEPT ESCAPE WILL TRIGGER THE NEXT CYCLE
     # ESCAPE SORTS TO END.
+    global stopReason
+    stopReason = None
     
     # sortCommand will hold the various commands we send to the controller during this sort. Start by triggering the sort mode.
     sortCommand = Command()
@@ -249,9 +868,11 @@ def sort():
     # Wait for the system to be ready, then clear the screen and prompt the user.
     waitFor("RDY")
     sortToEnd = False
+    readyText = "Sorting Mode. Press Any Key to load the next resistor. Press Escape when no more resistors available."
     
     clearScreen()
-    print("Sorting Mode. Press Any Key to load the next resistor. Press Escape when no more resistors available.\n\n")
+    startDisplay()
+    showStatus(readyText, "green")
     
     # Until the user runs out of resistors, run this input loop.
     while (not sortToEnd):
@@ -260,8 +881,7 @@ def sort():
         thisChar = getch()
         
         # When the user types a character, set the screen red and let them know we're waiting for a sort motion.
-        setterm('red', 'black')
-        print("Waiting for motion to complete...\n\n")
+        showStatus("Waiting for motion to complete...", "red")
         
         if (thisChar == '\x1b'):
             # If it was an escape character, they wanted to sort to the end.
@@ -272,24 +892,185 @@ def sort():
             sortCommand.send()
             
             # Wait for the ACK saying the sorter received this command, and then wait for the RDY saying the motion is complete.
-            waitFor("ACK")
-            waitFor("RDY")
+            # A refused or lost NXT was reported by waitFor; the next key press tries again.
+            reply = waitFor("ACK")
+            if (reply.cmd == "ACK"):
+                reply = waitFor("RDY")
+
+            if (reply.cmd == reconnectCmd):
+                restartSort()
+
+            # A drift alert or a rejected lot stops the sort as if Escape was pressed.
+            if (stopReason is not None):
+                sortToEnd = True
+                continue
             
-            # Set the terminal back green to signal the system is ready for the next action.
-            setterm('green', 'black')
-            print("Sorting Mode. Press Any Key to load the next resistor. Press Escape when no more resistors available.\n\n")
+            # Set the screen back green to signal the system is ready for the next action.
+            showStatus(readyText, "green")
     
-    # After the user is out of resistors, set terminal red and let the user know what's happening
-    setterm('red', 'black')
-    print("Waiting for sort to complete...\n\n")
+    # After the user is out of resistors, set the screen red and let the user know what's happening
+    showStatus("Waiting for sort to complete...", "red")
     
     sortCommand.cmd = "END"
     sortCommand.send()
     
-    # Wait for the system to complete, then return to normal.
-    waitFor("ACK")
-    waitFor("DON")
+    # Wait for the system to complete, then return to normal. After a reset there is nothing left to sort.
+    if (waitFor("ACK").cmd == "ACK"):
+        waitFor("DON")
     
+    stopDisplay()
     setterm('black', 'white')
+    endSession()
+
+def recordSequenced(thisCmd, measured):
+    # Files a pipelined MES under the sequence number of the resistor it belongs to. It has already been logged.
+    if (stallWatchdog is not None and len(thisCmd.args) > 2 and thisCmd.args[2] in stallWatchdog.empty):
+        return
+
+    if (len(thisCmd.args) > 2):
+        measured[int(thisCmd.args[2])] = (thisCmd.args[0], thisCmd.args[1])
+
+# NXTs an unattended sort keeps in flight. Pipelining only hides the host's round trip between RDY and the next NXT:
+# the mainboard still feeds after each dispense (see pipeWindow in RS_Mainboard.ino), so with the next NXT already
+# queued a deeper window buys nothing.
+continuousWindow = 2
+
+def sortContinuous(count, window=continuousWindow):
+    # Runs an unattended sort of count resistors from a hopper. Up to window NXT commands are kept in flight, so the
+    # mainboard loads the next resistor as soon as the load platform clears instead of waiting on a round trip to
+    # the host. It is latency hiding only; the machine itself is no faster.
+    # Every NXT carries a sequence number; the mainboard echoes it in the matching ACK, RDY and MES.
+    # Ctrl+C, a drift alert with pauseOnDrift set, or a lot rejected early stops issuing new resistors and sorts to
+    # the end. So does a jam the stall watchdog can't clear.
+    global stopReason
+    global stallWatchdog
+    stopReason = None
+
+    if (watchdogEnabled and stallWatchdog is None):
+        stallWatchdog = StallWatchdog.StallWatchdog(sendRecovery)
+    watchdog = stallWatchdog if watchdogEnabled else None
+
+    # Pipelining has to be requested before SRT.
+    pipeCommand = Command()
+    pipeCommand.cmd = "PIP"
+    pipeCommand.args = [str(window)]
+    pipeCommand.send()
+    waitFor("ACK")
+
+    sortCommand = Command()
+    sortCommand.cmd = "SRT"
+    sortCommand.args = []
+    sortCommand.send()
+    waitFor("RDY")
+
     clearScreen()
-    
\ No newline at end of file
+    startDisplay()
+    showStatus("Continuous Sorting Mode. {} resistors, {} in flight. Press Ctrl+C to stop early.".format(count, window))
+
+    nextSeq = 1
+    inFlight = set()        # Sequence numbers sent but not yet RDY
+    measured = {}           # Sequence number -> (cup, resistance)
+    startTime = time.monotonic()
+
+    if (watchdog is not None):
+        watchdog.start(activeMode, window)
+
+    try:
+        while ((nextSeq <= count and stopReason is None) or len(inFlight) > 0):
+
+            # Keep the window full, unless a jam is being cleared.
+            while (nextSeq <= count and stopReason is None and len(inFlight) < window and not (watchdog is not None and watchdog.recovering())):
+                sortCommand.cmd = "NXT"
+                sortCommand.args = [str(nextSeq)]
+                sortCommand.send()
+                inFlight.add(nextSeq)
+                if (watchdog is not None):
+                    watchdog.sent(nextSeq)
+                nextSeq += 1
+
+            # MES, PHS and ERR have been handled by the time poll() returns them. None means the watchdog ran out.
+            thisCmd = requestManager.poll(watchdog.remaining() if watchdog is not None else None)
+
+            if (thisCmd is None):
+                # Nothing has moved for far longer than it ever takes in this mode. Something is jammed.
+                note = watchdog.recover()
+                debugLog.record(event="stall", mode=watchdog.key, step=watchdog.step, inFlight=len(inFlight))
+
+                if (note is not None):
+                    # The NXTs in flight shouldn't time out while the recovery runs.
+                    requestManager.hold()
+                    report("WARNING: " + note)
+                else:
+                    requestManager.release()
+                    inFlight.clear()
+                    showStatus("Jammed. Sorting out what was already measured...")
+                    stopReason = "Stopped: the feed or sort wheel is jammed and recovery didn't clear it. Clear it by hand and sort the rest again."
+                continue
+
+            if (watchdog is not None and requestManager.matched is not None and thisCmd.cmd in ["ACK", "ERR", timeoutCmd]):
+                # Each recovery command waits for the one before it to be answered.
+                watchdog.answered(requestManager.matched.cmd)
+
+            if (thisCmd.cmd == "RDY"):
+                # The resistor named has cleared the load platform, freeing a slot in the window. So has every one fed
+                # before it, even if its RDY was lost.
+                seq = int(thisCmd.args[0])
+                inFlight = set(waiting for waiting in inFlight if waiting > seq)
+
+                if (watchdog is not None):
+                    if watchdog.recovering():
+                        requestManager.release()
+                    note = watchdog.ready(seq)
+                    if (note is not None):
+                        report(note)
+                        debugLog.record(event="jam cleared", mode=watchdog.key, note=note)
+
+            elif (thisCmd.cmd == "MES"):
+                recordSequenced(thisCmd, measured)
+
+            elif (thisCmd.cmd == timeoutCmd or (thisCmd.cmd == "ERR" and requestManager.matched is not None)):
+                # A lost or refused NXT would hold its slot for ever. Give the slot back and carry on.
+                request = requestManager.matched
+                if (request is not None and request.seq is not None):
+                    inFlight.discard(int(request.seq))
+                    if (thisCmd.cmd == timeoutCmd):
+                        report("WARNING: No {} for resistor {}. Carrying on without it.".format(thisCmd.args[1], request.seq))
+
+            elif (thisCmd.cmd == reconnectCmd):
+                # Everything in flight was lost with the reset.
+                inFlight.clear()
+                restartSort()
+
+    except KeyboardInterrupt:
+        showStatus("Stopping after the resistors already fed...")
+        stopReason = "Stopped early at the operator's request."
+
+    if (watchdog is not None):
+        watchdog.stop()
+        requestManager.release()
+
+    # Sort out whatever is still in the feed. The last few MES arrive between END and DON.
+    sortCommand.cmd = "END"
+    sortCommand.args = []
+    sortCommand.send()
+
+    thisCmd = Command()
+    while (thisCmd.cmd not in ["DON", reconnectCmd, timeoutCmd]):
+        thisCmd = requestManager.poll()
+
+        if (thisCmd.cmd == "MES"):
+            recordSequenced(thisCmd, measured)
+
+        if (thisCmd.cmd == timeoutCmd and thisCmd.args[0] != "END"):
+            # Only the END's own replies are worth waiting on now.
+            thisCmd = Command()
+
+    if (thisCmd.cmd == timeoutCmd):
+        report("WARNING: The mainboard never finished the sort. Check the feed.")
+
+    stopDisplay()
+    elapsed = time.monotonic() - startTime
+    print("Sorted {} resistors in {:.1f} s ({:.1f} per minute).\n".format(nextSeq - 1, elapsed, (nextSeq - 1) * 60.0 / elapsed))
+    endSession()
+
+    return(measured)
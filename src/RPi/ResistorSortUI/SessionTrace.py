@@ -0,0 +1,348 @@
+import argparse
+import os
+import struct
+import tempfile
+import threading
+import time
+import SorterProtocol
+import BinaryProtocol
+
+# Records every byte of a serial session with monotonic nanosecond timestamps, and plays it back.
+#
+# RecordingPort wraps the serial port, so the trace holds exactly what went over the wire in both directions,
+# ASCII or binary. A trace is an 8 byte magic and the wall clock start time, then one record per read or write:
+#
+#   direction (u8), nanoseconds since the start (i64), length (u32), bytes
+#
+# ReplayPort stands in for the serial port and plays the mainboard's side back. Each received chunk is held until
+# the host has written everything it had written before that chunk in the recording, then released after the same
+# delay as recorded (divided by speed, or at once as fast as possible). Replies can never arrive before the request
+# that caused them, and a slower host shows up as a longer replay. replay() drives ResistorSorter through the
+# recorded session (setup, handshakes and the sorts themselves), so a field session can be rerun as a benchmark.
+#
+#   python3 SessionTrace.py show traces/20170402-140210.trace
+#   python3 SessionTrace.py replay traces/20170402-140210.trace [--speed 4 | --max]
+
+magic = b"RSTRACE\x01"
+header = struct.Struct("<q")
+record = struct.Struct("<BqI")
+
+# Record directions. A reset marks the port being opened again after the mainboard was lost.
+dirIn = 0
+dirOut = 1
+dirReset = 2
+
+directionNames = {dirIn: "IN", dirOut: "OUT", dirReset: "RESET"}
+
+class TraceWriter:
+    """Appends records to a trace file. record() may be called from the reader and the sending thread at once; it
+    only packs into a buffer, which is written out every flushInterval seconds and on close()."""
+
+    def __init__(self, path, flushInterval=1.0):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.flushInterval = flushInterval
+        self.lock = threading.Lock()
+        self.file = open(path, "wb")
+        self.file.write(magic + header.pack(time.time_ns()))
+        self.start = time.monotonic_ns()
+        self.lastFlush = self.start
+        self.records = 0
+
+    def record(self, direction, data):
+        now = time.monotonic_ns()
+
+        with self.lock:
+            if (self.file is None):
+                return
+
+            self.file.write(record.pack(direction, now - self.start, len(data)))
+            self.file.write(data)
+            self.records += 1
+
+            if (now - self.lastFlush > self.flushInterval * 1e9):
+                self.file.flush()
+                self.lastFlush = now
+
+    def close(self):
+        with self.lock:
+            if (self.file is not None):
+                self.file.close()
+                self.file = None
+
+class RecordingPort:
+    """A serial port whose traffic is recorded by a TraceWriter. Everything else is passed to the real port."""
+
+    def __init__(self, port, writer):
+        self.__dict__["port"] = port
+        self.__dict__["writer"] = writer
+
+    def read(self, size=1):
+        data = self.port.read(size)
+        if data:
+            self.writer.record(dirIn, data)
+        return(data)
+
+    def write(self, data):
+        self.writer.record(dirOut, data)
+        return(self.port.write(data))
+
+    def __getattr__(self, name):
+        return(getattr(self.port, name))
+
+    def __setattr__(self, name, value):
+        # baudrate and timeout are set on the real port.
+        setattr(self.port, name, value)
+
+def readTrace(path):
+    # Returns (start, records): the wall clock start in nanoseconds and a list of (direction, ns, data).
+    with open(path, "rb") as traceFile:
+        data = traceFile.read()
+
+    if (data[:len(magic)] != magic):
+        raise ValueError("{} is not a session trace".format(path))
+
+    offset = len(magic)
+    start, = header.unpack_from(data, offset)
+    offset += header.size
+    records = []
+
+    # A trace cut short by a crash ends with a partial record, which is dropped.
+    while (offset + record.size <= len(data)):
+        direction, ns, length = record.unpack_from(data, offset)
+        offset += record.size
+        if (offset + length > len(data)):
+            break
+
+        records.append((direction, ns, data[offset:offset + length]))
+        offset += length
+
+    return(start, records)
+
+def decodeRecords(records):
+    # Decodes every record into Commands. Returns a list of (direction, ns, commands), switching each direction to
+    # the binary decoder once the mainboard has acknowledged BIN. Stops at the first reset.
+    decoders = {dirIn: SorterProtocol.FrameDecoder(terminated=True), dirOut: SorterProtocol.FrameDecoder(terminated=False)}
+    binRequested = False
+    output = []
+
+    for direction, ns, data in records:
+        if (direction == dirReset):
+            break
+
+        commands = decoders[direction].feed(data)
+        output.append((direction, ns, commands))
+
+        for thisCmd in commands:
+            if (direction == dirOut and thisCmd.cmd == "BIN"):
+                binRequested = True
+            elif (direction == dirIn and thisCmd.cmd == "ACK" and binRequested):
+                decoders = {dirIn: BinaryProtocol.BinaryFrameDecoder(), dirOut: BinaryProtocol.BinaryFrameDecoder()}
+                binRequested = False
+
+    return(output)
+
+class ReplayPort:
+    """Plays back the mainboard's side of a recorded session to whoever writes to it.
+
+    speed scales the recorded delays: 1.0 is original speed, 4.0 four times faster, None as fast as possible.
+    mismatches counts writes that differ from the recording. If the host has not written what a chunk waits for
+    within stallTimeout seconds, the chunk is released anyway and counted in stalls. Playback stops at the end of
+    the trace or at the first reset in it; done is set once everything has been released.
+    """
+
+    def __init__(self, records, speed=1.0, stallTimeout=5.0):
+        self.speed = speed
+        self.stallTimeout = stallTimeout
+        self.baudrate = 9600
+        self.timeout = None
+
+        # For each received chunk: how many writes come before it, and the recorded time of the last of them.
+        self.chunks = []
+        self.expected = []
+        lastOut = None
+
+        for direction, ns, data in records:
+            if (direction == dirReset):
+                break
+            elif (direction == dirOut):
+                self.expected.append(data)
+                lastOut = ns
+            else:
+                self.chunks.append((len(self.expected), lastOut, ns, data))
+
+        self.cond = threading.Condition()
+        self.buffer = bytearray()
+        self.written = 0
+        self.writtenAt = {}
+        self.cancelled = False
+        self.mismatches = 0
+        self.stalls = 0
+        self.done = threading.Event()
+
+        self.player = threading.Thread(target=self.play, name="ReplayPort", daemon=True)
+        self.player.start()
+
+    @property
+    def in_waiting(self):
+        with self.cond:
+            return(len(self.buffer))
+
+    def read(self, size=1):
+        # Blocks like a serial port: forever with timeout None, otherwise up to timeout seconds, or until cancel_read().
+        with self.cond:
+            if (self.timeout is None):
+                self.cond.wait_for(lambda: len(self.buffer) > 0 or self.cancelled)
+            else:
+                self.cond.wait_for(lambda: len(self.buffer) > 0 or self.cancelled, self.timeout)
+
+            self.cancelled = False
+            data = bytes(self.buffer[:size])
+            del self.buffer[:size]
+            return(data)
+
+    def write(self, data):
+        with self.cond:
+            if (self.written >= len(self.expected) or self.expected[self.written] != bytes(data)):
+                self.mismatches += 1
+
+            self.written += 1
+            self.writtenAt[self.written] = time.monotonic()
+            self.cond.notify_all()
+
+        return(len(data))
+
+    def cancel_read(self):
+        # Makes a blocked read() return at once with whatever is buffered, as on a serial port.
+        with self.cond:
+            self.cancelled = True
+            self.cond.notify_all()
+
+    def close(self):
+        pass
+
+    def play(self):
+        lastIn = None           # (recorded ns, wall time) of the last chunk released
+
+        for gate, outNs, ns, data in self.chunks:
+            with self.cond:
+                if not self.cond.wait_for(lambda: self.written >= gate, self.stallTimeout):
+                    self.stalls += 1
+                gateWall = self.writtenAt.get(gate)
+
+            if (self.speed is not None):
+                # Keep the recorded gap after both the request this answers and the previous chunk.
+                due = time.monotonic()
+                if (gateWall is not None and outNs is not None):
+                    due = max(due, gateWall + (ns - outNs) / 1e9 / self.speed)
+                if (lastIn is not None):
+                    due = max(due, lastIn[1] + (ns - lastIn[0]) / 1e9 / self.speed)
+
+                delay = due - time.monotonic()
+                if (delay > 0):
+                    time.sleep(delay)
+
+            with self.cond:
+                self.buffer.extend(data)
+                self.cond.notify_all()
+
+            lastIn = (ns, time.monotonic())
+
+        self.done.set()
+
+def replay(records, speed=1.0):
+    # Runs ResistorSorter through the host side of a recorded session against a ReplayPort. Returns the port and
+    # the wall time taken. Setup commands are sent as recorded, and each SRT to END runs through sort() or
+    # sortContinuous() with the same number of resistors.
+    import ResistorSorter  # Here rather than at the top, since ResistorSorter records its sessions with this module
+
+
+    script = [thisCmd for direction, ns, commands in decodeRecords(records) if direction == dirOut for thisCmd in commands]
+
+    ResistorSorter.traceDir = None
+    ResistorSorter.openLogs()
+    replayPort = ReplayPort(records, speed)
+    ResistorSorter.attach(replayPort)
+
+    # PPW is only sent with wheel pre-positioning on, and has to be for the writes to line up.
+    ResistorSorter.setWheelScheduling(any(thisCmd.cmd == "PPW" for thisCmd in script))
+
+    startTime = time.monotonic()
+    window = 0
+    i = 0
+
+    while (i < len(script)):
+        thisCmd = script[i]
+
+        if (thisCmd.cmd == "RDY"):
+            ResistorSorter.sendRdy()
+            ResistorSorter.waitFor("ACK")
+
+        elif (thisCmd.cmd == "BIN"):
+            ResistorSorter.negotiateBinary(int(thisCmd.args[0]))
+
+        elif (thisCmd.cmd == "PIP"):
+            # sortContinuous() sends its own.
+            window = int(thisCmd.args[0])
+
+        elif (thisCmd.cmd == "SRT"):
+            end = i + 1
+            while (end < len(script) and script[end].cmd != "END"):
+                end += 1
+            count = sum(1 for sortCmd in script[i + 1:end] if sortCmd.cmd == "NXT")
+
+            if (window > 0):
+                ResistorSorter.sortContinuous(count, window)
+            else:
+                # sort() takes a key per resistor, then Escape.
+                keys = iter([" "] * count + ["\x1b"])
+                ResistorSorter.getch = lambda: next(keys)
+                ResistorSorter.sort()
+
+            window = 0
+            i = end
+
+        elif (thisCmd.cmd not in ["NXT", "END", "PPW", "ACK"]):
+            ResistorSorter.Command(thisCmd.cmd, thisCmd.args).send()
+            ResistorSorter.waitFor("ACK")
+
+        i += 1
+
+    return(replayPort, time.monotonic() - startTime)
+
+def show(records):
+    # Prints every decoded command with its time and direction.
+    for direction, ns, commands in decodeRecords(records):
+        for thisCmd in commands:
+            print("{:12.6f} {:<4} {};{}".format(ns / 1e9, directionNames[direction], thisCmd.cmd, ",".join(thisCmd.args)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Show or replay a recorded serial session")
+    parser.add_argument("action", choices=["show", "replay"])
+    parser.add_argument("trace", help="trace file, from the traces directory")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay this many times faster than recorded")
+    parser.add_argument("--max", action="store_true", help="replay as fast as the host can go")
+    parser.add_argument("--workdir", help="where the replay writes its logs; default is a new temporary directory")
+    options = parser.parse_args()
+
+    start, records = readTrace(options.trace)
+
+    if (options.action == "show"):
+        print("Recorded {}, {} records.".format(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start / 1e9)), len(records)))
+        show(records)
+        return
+
+    # Keep the replay's logs and measurements out of the real ones.
+    os.chdir(options.workdir or tempfile.mkdtemp(prefix="replay-"))
+
+    recorded = records[-1][1] / 1e9 if records else 0.0
+    replayPort, elapsed = replay(records, None if options.max else options.speed)
+
+    print("Replayed {} writes and {} reads in {:.3f} s (recorded {:.3f} s).".format(replayPort.written, len(replayPort.chunks), elapsed, recorded))
+    print("{} writes differed from the recording, {} replies were released after a stall.".format(replayPort.mismatches, replayPort.stalls))
+
+if __name__ == "__main__":
+    main()
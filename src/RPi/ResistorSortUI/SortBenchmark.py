@@ -0,0 +1,299 @@
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import ResistorSorter
+import SessionTrace
+import TeensySim
+import PhaseProfile
+import WheelScheduler
+
+# End-to-end benchmark of sort sessions, against the simulator or a real mainboard.
+#
+# Each session runs the real host stack: ResistorSorter's serial reader, request manager, logs and measurement store,
+# driven through sort() (window 0) or sortContinuous(). The port is wrapped so every byte is timestamped as it is
+# written or read, which gives resistors per minute and the latency distribution of each step of the cycle:
+#
+#   nxtAck    NXT sent to its ACK received (mainboard turnaround)
+#   ackRdy    ACK to RDY (the feed motion)
+#   rdyNxt    RDY to the next NXT (host turnaround)
+#
+# Host CPU time is that of the whole process, every thread included, less the in-process simulator's own thread.
+# Logs, the measurement database and learned latencies go to a temporary directory unless --workdir is given.
+#
+#   python3 SortBenchmark.py [--port /dev/ttyACM0] [--modes MAJ,SSR] [--count 200] [--window 4] [--binary]
+#                            [--telemetry] [--park] [--population e24|wide] [--time-scale 0] [--output results.json]
+
+modeArgs = {
+    "MAJ": ["5"],
+    "SSR": ["5", "100", "220", "470", "1000", "2200", "4700", "10000", "22000", "47000"],
+    "SGL": ["5", "4700"],
+    "QCR": ["5", "4700"],
+    "OHM": [],
+}
+
+def percentile(values, p):
+    # Nearest-rank percentile of a list. None if it is empty.
+    if (len(values) == 0):
+        return(None)
+
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(p / 100.0 * len(ordered) + 0.5)) - 1))
+
+    return(ordered[index])
+
+def summarize(values):
+    # p50/p95/p99 and max, in milliseconds.
+    output = {"count": len(values)}
+
+    for p in [50, 95, 99]:
+        value = percentile(values, p)
+        output["p{}".format(p)] = None if value is None else value * 1000.0
+
+    output["max"] = max(values) * 1000.0 if values else None
+    return(output)
+
+class Recorder:
+    """Collects every chunk read from or written to the port, as SessionTrace records of (direction, ns, data). Takes
+    the place of a TraceWriter behind a SessionTrace.RecordingPort."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = []
+
+    def record(self, direction, data):
+        now = time.monotonic_ns()
+        with self.lock:
+            self.records.append((direction, now, bytes(data)))
+
+    def mark(self):
+        # Where the next session's records start.
+        with self.lock:
+            return(len(self.records))
+
+    def since(self, start):
+        with self.lock:
+            return(self.records[:], len(self.records) - start)
+
+def analyze(recorder, start, park):
+    # Latencies, counts and traffic for the records from start on.
+    records, length = recorder.since(start)
+    decoded = SessionTrace.decodeRecords(records)[len(records) - length:]
+
+    nxtAck = []
+    ackRdy = []
+    rdyNxt = []
+    measured = 0
+    errors = 0
+    profile = PhaseProfile.PhaseProfile()
+    scheduler = WheelScheduler.WheelScheduler() if park else None
+
+    # Stop-and-wait NXTs carry no sequence number, so their replies are matched in order.
+    sentAt = {}
+    ackAt = {}
+    awaitingAck = []
+    awaitingRdy = []
+    lastRdy = None
+    unnumbered = 0
+
+    for direction, ns, commands in decoded:
+        seconds = ns / 1e9
+
+        for thisCmd in commands:
+            seq = thisCmd.args[0] if (thisCmd.args and thisCmd.args[0] != "") else None
+
+            if (direction == SessionTrace.dirOut):
+                if (thisCmd.cmd == "NXT"):
+                    if (seq is None):
+                        unnumbered += 1
+                        seq = "#{}".format(unnumbered)
+                    sentAt[seq] = seconds
+                    awaitingAck.append(seq)
+                    if (lastRdy is not None):
+                        rdyNxt.append(seconds - lastRdy)
+                elif (thisCmd.cmd == "END"):
+                    awaitingAck.append("END")
+
+            elif (thisCmd.cmd == "ACK"):
+                key = seq if seq is not None else (awaitingAck[0] if awaitingAck else None)
+                if key in awaitingAck:
+                    awaitingAck.remove(key)
+                    if key in sentAt:
+                        nxtAck.append(seconds - sentAt[key])
+                        ackAt[key] = seconds
+                        awaitingRdy.append(key)
+
+            elif (thisCmd.cmd == "RDY"):
+                key = seq if seq is not None else (awaitingRdy[0] if awaitingRdy else None)
+                if key in awaitingRdy:
+                    awaitingRdy.remove(key)
+                    ackRdy.append(seconds - ackAt[key])
+                lastRdy = seconds
+
+            elif (thisCmd.cmd == "MES"):
+                measured += 1
+                if (scheduler is not None):
+                    scheduler.observe(int(thisCmd.args[0]))
+                    scheduler.parkingCup()
+
+            elif (thisCmd.cmd == "PHS"):
+                profile.add(thisCmd)
+
+            elif (thisCmd.cmd in ["ERR", "LOS"]):
+                errors += 1
+
+    phases = {}
+    for phase in PhaseProfile.phases:
+        if (profile.count > 0):
+            mean, p50, p95, high = profile.stats(phase)
+            phases[phase] = {"mean": mean, "p50": p50, "p95": p95, "max": high}
+
+    return({
+        "measured": measured,
+        "errors": errors,
+        "bytes": sum(len(data) for direction, ns, data in records[len(records) - length:]),
+        "nxtAck": summarize(nxtAck),
+        "ackRdy": summarize(ackRdy),
+        "rdyNxt": summarize(rdyNxt),
+        "phasesMs": phases,
+        "wheelTravel": None if scheduler is None else {"steps": scheduler.travel, "exposed": scheduler.exposed, "direct": scheduler.directTravel, "directExposed": scheduler.directExposed},
+    })
+
+@contextlib.contextmanager
+def quiet():
+    # Sends everything written to stdout, from any thread, to /dev/null. ResistorSorter still formats all it prints
+    # (which is host work worth measuring), and with stdout no longer a terminal it doesn't start the live display.
+    sys.stdout.flush()
+    saved = os.dup(1)
+    with open(os.devnull, 'w') as devnull:
+        os.dup2(devnull.fileno(), 1)
+
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved, 1)
+        os.close(saved)
+
+def simulatorCpu(fake):
+    # CPU seconds used so far by the simulator's thread, which is not host time. 0 without one.
+    if (fake is None):
+        return(0.0)
+
+    return(time.clock_gettime(time.pthread_getcpuclockid(fake.ident)))
+
+def runSession(recorder, mode, count, window, adaptive, telemetry=False, park=False, fake=None):
+    # Sorts count resistors in the given mode through ResistorSorter and returns the measurements for the session.
+    if adaptive:
+        ResistorSorter.setAdaptiveRanging(True)
+    if telemetry:
+        ResistorSorter.setTelemetry(True)
+    ResistorSorter.setWheelScheduling(park)
+
+    ResistorSorter.Command(mode, modeArgs[mode]).send()
+    ResistorSorter.waitFor("ACK")
+
+    start = recorder.mark()
+    cpuStart = time.process_time() - simulatorCpu(fake)
+    started = time.perf_counter()
+
+    with quiet():
+        if (window > 0):
+            ResistorSorter.sortContinuous(count, window)
+        else:
+            # sort() takes a key per resistor, then Escape.
+            keys = iter([" "] * count + ["\x1b"])
+            ResistorSorter.getch = lambda: next(keys)
+            ResistorSorter.sort()
+
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - simulatorCpu(fake) - cpuStart
+
+    result = analyze(recorder, start, park)
+    result.update({
+        "mode": mode,
+        "count": count,
+        "seconds": elapsed,
+        "resistorsPerMinute": count * 60.0 / elapsed,
+        "cpuPerResistorMs": cpu * 1000.0 / count,
+        "bytesPerResistor": result.pop("bytes") / float(count),
+    })
+
+    return(result)
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end sort session benchmark")
+    parser.add_argument("--port", help="mainboard serial device; the simulator is used if not given")
+    parser.add_argument("--modes", default=",".join(modeArgs), help="comma separated sort modes to run")
+    parser.add_argument("--count", type=int, default=200, help="resistors per session")
+    parser.add_argument("--window", type=int, default=0, help="NXTs in flight (0 is stop-and-wait)")
+    parser.add_argument("--binary", action="store_true", help="negotiate the binary link first")
+    parser.add_argument("--baud", type=int, default=115200, help="baud rate for the binary link")
+    parser.add_argument("--adaptive", action="store_true", help="turn on adaptive ranging")
+    parser.add_argument("--telemetry", action="store_true", help="collect per-phase timings from the mainboard")
+    parser.add_argument("--park", action="store_true", help="pre-position the sort wheel with PPW")
+    parser.add_argument("--population", choices=["e24", "wide"], default="e24", help="simulated bag: E24 values from 100 to 47k, or log-uniform 1 to 1M")
+    parser.add_argument("--time-scale", type=float, default=0.0, help="simulator wall seconds per simulated second")
+    parser.add_argument("--workdir", help="where the host writes its logs; default is a new temporary directory")
+    parser.add_argument("--output", help="write results to this JSON file")
+    options = parser.parse_args()
+
+    output = os.path.abspath(options.output) if options.output else None
+
+    fake = None
+    path = options.port
+    if (path is None):
+        if (options.population == "wide"):
+            population = TeensySim.logUniformPopulation(1.0, 1000000.0, seed=1)
+        else:
+            population = TeensySim.seriesPopulation([100, 220, 470, 1000, 2200, 4700, 10000, 22000, 47000], 5, seed=1)
+        fake = TeensySim.FakeTeensy(population, timeScale=options.time_scale)
+        fake.start()
+        path = fake.path
+
+    # Keep the benchmark's logs and measurements out of the real ones.
+    os.chdir(options.workdir or tempfile.mkdtemp(prefix="benchmark-"))
+
+    recorder = Recorder()
+    ResistorSorter.traceDir = None
+    ResistorSorter.openLogs()
+    ResistorSorter.attach(SessionTrace.RecordingPort(ResistorSorter.openPort(path), recorder))
+
+    ResistorSorter.sendRdy()
+    ResistorSorter.waitFor("ACK")
+    if options.binary:
+        ResistorSorter.negotiateBinary(options.baud)
+
+    sessions = []
+    for mode in options.modes.split(","):
+        virtualStart = fake.clock if fake is not None else 0.0
+        result = runSession(recorder, mode.strip().upper(), options.count, options.window, options.adaptive, options.telemetry, options.park, fake)
+
+        # With the simulator, also report the rate the machine itself would manage, independent of time scale.
+        if (fake is not None):
+            result["simulatedResistorsPerMinute"] = options.count * 60000.0 / max(fake.clock - virtualStart, 1e-9)
+
+        sessions.append(result)
+        print("{mode}: {resistorsPerMinute:,.1f}/min, {cpuPerResistorMs:.3f} ms CPU and {bytesPerResistor:.1f} bytes per resistor".format(**result))
+        if (fake is not None):
+            print("  simulated machine time: {:,.1f}/min".format(result["simulatedResistorsPerMinute"]))
+        for step in ["nxtAck", "ackRdy", "rdyNxt"]:
+            stats = result[step]
+            if (stats["count"] > 0):
+                print("  {:<7} p50 {:9.3f}  p95 {:9.3f}  p99 {:9.3f} ms".format(step, stats["p50"], stats["p95"], stats["p99"]))
+
+    ResistorSorter.closeLogs()
+
+    if output:
+        settings = {"port": options.port or "simulator", "count": options.count, "window": options.window,
+                    "binary": options.binary, "baud": options.baud if options.binary else 9600,
+                    "adaptive": options.adaptive, "telemetry": options.telemetry, "park": options.park, "population": options.population if options.port is None else None, "timeScale": options.time_scale}
+        with open(output, 'w') as outFile:
+            json.dump({"time": time.time(), "settings": settings, "sessions": sessions}, outFile, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import asyncio
+import os
+import serial  # Only used to put the tty into the right mode; all I/O goes through the event loop.
+import SorterProtocol
+
+# An asyncio client for the mainboard. Unlike ResistorSorter, nothing here is global: each SorterClient owns its own
+# port, so one event loop can drive several sorters alongside other tasks.
+
+class CommandProtocol(asyncio.Protocol):
+    """Decodes mainboard frames as they arrive and hands parsed Commands to a SorterClient."""
+
+    def __init__(self, client):
+        self.client = client
+        self.decoder = SorterProtocol.FrameDecoder(terminated=True)
+
+    def data_received(self, data):
+        for thisCmd in self.decoder.feed(data):
+            self.client.commands.put_nowait(thisCmd)
+
+    def connection_lost(self, exc):
+        self.client.connectionLost(exc)
+
+class SorterClient:
+    """Sends Commands to one mainboard and awaits its responses.
+
+    onMeasurement, if set, is called with every MES that arrives while waiting for something else.
+    """
+
+    def __init__(self):
+        self.commands = asyncio.Queue()
+        self.transport = None
+        self.readTransport = None
+        self.serialPort = None
+        self.onMeasurement = None
+        self.lost = None
+
+    def send(self, cmd, args=None):
+        # Frames and writes a command. Never blocks; the transport buffers anything the tty can't take yet.
+        if (self.lost is not None):
+            raise ConnectionError("Sorter connection lost")
+
+        self.transport.write(SorterProtocol.encodeCmd(cmd, args if args is not None else []))
+
+    async def receive(self):
+        # Returns the next Command from the mainboard.
+        thisCmd = await self.commands.get()
+
+        if (thisCmd is None):
+            raise ConnectionError("Sorter connection lost")
+
+        return(thisCmd)
+
+    async def waitFor(self, command):
+        # Waits for the given command and passes it back when received. MES frames go to onMeasurement.
+        while True:
+            thisCmd = await self.receive()
+
+            if (thisCmd.cmd == command):
+                return(thisCmd)
+
+            if (thisCmd.cmd == "MES"):
+                if (self.onMeasurement is not None):
+                    self.onMeasurement(thisCmd)
+            else:
+                print("WARNING: Received unexpected Command. Received {}. Expected {}. Continuing.\n".format(thisCmd.cmd, command))
+
+    async def request(self, cmd, args=None, expect=None, timeout=None):
+        # Sends cmd, then waits for each of the expected responses in order (just an ACK unless told otherwise).
+        # Returns the list of responses.
+        if (expect is None):
+            expect = ["ACK"]
+
+        self.send(cmd, args)
+        responses = []
+
+        for expected in expect:
+            responses.append(await asyncio.wait_for(self.waitFor(expected), timeout))
+
+        return(responses)
+
+    def connectionLost(self, exc):
+        # Wakes up anything waiting on a response so it can raise instead of hanging.
+        self.lost = exc if exc is not None else ConnectionError("Sorter connection closed")
+        self.commands.put_nowait(None)
+
+    def close(self):
+        if (self.readTransport is not None):
+            self.readTransport.close()
+        if (self.transport is not None):
+            self.transport.close()
+        if (self.serialPort is not None):
+            self.serialPort.close()
+
+async def openSorter(path, baudrate=9600):
+    # Opens the serial device at path and returns a connected SorterClient.
+    loop = asyncio.get_running_loop()
+    client = SorterClient()
+
+    # pyserial sets the baud rate and raw mode. The event loop then reads and writes duplicates of its fd.
+    client.serialPort = serial.Serial(path, baudrate, timeout=0)
+    readFile = os.fdopen(os.dup(client.serialPort.fileno()), 'rb', buffering=0)
+    writeFile = os.fdopen(os.dup(client.serialPort.fileno()), 'wb', buffering=0)
+
+    client.readTransport, _ = await loop.connect_read_pipe(lambda: CommandProtocol(client), readFile)
+    client.transport, _ = await loop.connect_write_pipe(asyncio.BaseProtocol, writeFile)
+
+    return(client)
+
+async def demo():
+    # Runs a short OHM sort against the fake mainboard.
+    import TeensySim
+
+    fake = TeensySim.FakeTeensy([4700.0, 10000.0, 220.0])
+    fake.start()
+
+    client = await openSorter(fake.path)
+    client.onMeasurement = lambda mes: print("Cup: " + mes.args[0] + ", Resistance: " + mes.args[1])
+
+    await client.request("RDY", expect=["ACK"])
+    await client.request("OHM", expect=["ACK"])
+    await client.request("SRT", expect=["RDY"])
+
+    for i in range(3):
+        await client.request("NXT", expect=["ACK", "RDY"], timeout=5)
+
+    await client.request("END", expect=["ACK", "DON"], timeout=5)
+
+    client.close()
+    fake.close()
+
+if __name__ == "__main__":
+    asyncio.run(demo())
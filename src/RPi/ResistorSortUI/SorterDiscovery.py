@@ -0,0 +1,137 @@
+import glob
+import os
+import time
+
+try:
+    import pyudev  # Optional: wakes waitForSorter on hotplug events instead of polling
+except ImportError:
+    pyudev = None
+
+# Finds the mainboards attached to this host. Every Teensy enumerates as a USB CDC ACM device (/dev/ttyACM*), but
+# the number it gets depends on plug order and resets, so machines are told apart by their USB serial number.
+#
+# Everything comes from sysfs: /sys/class/tty/ttyACMn/device is the USB interface, and its parent directory is the
+# USB device with idVendor, idProduct and serial. Nothing here opens a port.
+#
+# waitForSorter() blocks until a matching device appears. With pyudev installed it sleeps on udev's netlink socket
+# and rescans only when a tty comes or goes; otherwise it rescans sysfs every pollInterval, which is a handful of
+# small file reads and never forks.
+#
+#   python3 SorterDiscovery.py
+
+sysRoot = "/sys/class/tty"
+devRoot = "/dev"
+
+# USB vendor and product IDs of the Teensy in USB serial mode.
+teensyIds = [("16c0", "0483")]
+
+# Seconds between rescans when pyudev is not available.
+pollInterval = 0.1
+
+class SorterDevice:
+    """One attached mainboard: its device path and USB identity. Any of the USB fields may be None if sysfs did
+    not provide them."""
+    __slots__ = ("path", "serialNumber", "vendorId", "productId")
+
+    def __init__(self, path, serialNumber=None, vendorId=None, productId=None):
+        self.path = path
+        self.serialNumber = serialNumber
+        self.vendorId = vendorId
+        self.productId = productId
+
+    def name(self):
+        # How the machine is shown to the user: its serial number, or the device name if it has none.
+        return(self.serialNumber if self.serialNumber is not None else os.path.basename(self.path))
+
+    def __repr__(self):
+        return("SorterDevice({!r}, {!r}, {!r}, {!r})".format(self.path, self.serialNumber, self.vendorId, self.productId))
+
+def readAttribute(directory, name):
+    # The stripped contents of a sysfs attribute, or None if it doesn't exist.
+    try:
+        with open(os.path.join(directory, name)) as attrFile:
+            return(attrFile.read().strip())
+    except OSError:
+        return(None)
+
+def describeTTY(ttyName, root=sysRoot):
+    # Builds a SorterDevice for one tty, e.g. "ttyACM0".
+    device = SorterDevice(os.path.join(devRoot, ttyName))
+
+    try:
+        usbInterface = os.path.realpath(os.path.join(root, ttyName, "device"))
+    except OSError:
+        return(device)
+
+    usbDevice = os.path.dirname(usbInterface)
+    device.serialNumber = readAttribute(usbDevice, "serial")
+    device.vendorId = readAttribute(usbDevice, "idVendor")
+    device.productId = readAttribute(usbDevice, "idProduct")
+
+    return(device)
+
+def findSorters(root=sysRoot, dev=devRoot, usbIds=None):
+    # Every ACM device currently attached, ordered by serial number so the same machines always come out in the
+    # same order. Devices without one sort last, by path. usbIds, if given, is a list of (vendor, product) pairs;
+    # devices known to be anything else are left out.
+    devices = [describeTTY(os.path.basename(entry), root) for entry in glob.glob(os.path.join(root, "ttyACM*"))]
+
+    # Device nodes sysfs doesn't know about (containers, symlinks to a simulator) are still usable, just anonymous.
+    known = [device.path for device in devices]
+    for path in glob.glob(os.path.join(dev, "ttyACM*")):
+        if path not in known:
+            devices.append(SorterDevice(path))
+
+    if (usbIds is not None):
+        devices = [device for device in devices if device.vendorId is None or (device.vendorId, device.productId) in usbIds]
+
+    devices.sort(key=lambda device: (device.serialNumber is None, device.serialNumber or "", device.path))
+
+    return(devices)
+
+def findSorter(serialNumber, root=sysRoot):
+    # The device with the given USB serial number, or None if it isn't attached.
+    for device in findSorters(root):
+        if (device.serialNumber == serialNumber):
+            return(device)
+
+    return(None)
+
+def waitForSorter(serialNumber=None, timeout=None, usbIds=teensyIds):
+    # Returns the first matching device (any Teensy, or the one with serialNumber), waiting up to timeout seconds
+    # for it to be plugged in. None on timeout.
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    # Start listening before the first scan so a device that arrives in between still wakes us.
+    monitor = None
+    if (pyudev is not None):
+        monitor = pyudev.Monitor.from_netlink(pyudev.Context())
+        monitor.filter_by("tty")
+        monitor.start()
+
+    while True:
+        for device in findSorters(usbIds=usbIds):
+            if (serialNumber is None or device.serialNumber == serialNumber):
+                return(device)
+
+        wait = 1.0 if monitor is not None else pollInterval
+        if (deadline is not None):
+            wait = min(wait, deadline - time.monotonic())
+            if (wait <= 0):
+                return(None)
+
+        if (monitor is not None):
+            monitor.poll(timeout=wait)
+        else:
+            time.sleep(wait)
+
+def main():
+    devices = findSorters(usbIds=teensyIds)
+    if (len(devices) == 0):
+        print("No mainboards found.")
+
+    for device in devices:
+        print("{:<16} {:<14} {}:{}".format(device.path, device.serialNumber or "-", device.vendorId or "?", device.productId or "?"))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+import argparse
+import asyncio
+import signal
+import time
+import serial
+import SorterClient
+import SorterDiscovery
+import SorterLog
+import MeasurementStore
+
+# Runs the same sort on every mainboard attached to this host at once.
+#
+# Machines are found by USB serial number (SorterDiscovery) and each gets its own SorterClient, so one event loop
+# drives them all: while one machine is swinging its arm the loop is serving the others, and a slow or failed
+# machine never holds up the rest. Each runs the pipelined cycle sortContinuous() uses, and the fleet prints a
+# status table every few seconds with per-machine and total throughput. Ctrl+C stops feeding and sorts every
+# machine to the end.
+#
+#   python3 SorterFleet.py MAJ 5 [--count 200] [--window 2] [--serials A,B] [--db measurements.db]
+#   python3 SorterFleet.py SSR 5 100 220 470 --simulate 3 --time-scale 0.05
+
+cupCount = 10
+
+class Machine:
+    """One sorter in the fleet: its device, client and the running totals for its sort."""
+
+    def __init__(self, device):
+        self.device = device
+        self.client = None
+        self.state = "waiting"
+        self.error = None
+        self.fed = 0
+        self.measured = 0
+        self.errors = 0
+        self.cups = [0] * cupCount
+        self.startedAt = None
+        self.finishedAt = None
+
+    def rate(self):
+        # Resistors measured per minute since the sort started.
+        if (self.startedAt is None):
+            return(0.0)
+
+        elapsed = (self.finishedAt or time.monotonic()) - self.startedAt
+        return(self.measured * 60.0 / elapsed if elapsed > 0 else 0.0)
+
+class Fleet:
+    """Every machine taking part in a sort, and the settings they all share.
+
+    store, if given, is a MeasurementStore that takes every machine's measurements, each tagged with a session
+    made from the fleet session and the machine's serial number.
+    """
+
+    def __init__(self, devices, mode, args, count, window=2, store=None, timeout=30.0):
+        self.machines = [Machine(device) for device in devices]
+        self.mode = mode
+        self.args = args
+        self.count = count
+        self.window = max(1, window)
+        self.store = store
+        self.timeout = timeout
+        self.session = SorterLog.newSession()
+        self.stopping = False
+
+    def stop(self):
+        # Stops feeding new resistors. Every machine still sorts out what it already has.
+        self.stopping = True
+
+    def handle(self, machine, thisCmd):
+        # Everything a machine sends besides ACK and RDY.
+        if (thisCmd.cmd == "MES"):
+            machine.measured += 1
+
+            try:
+                machine.cups[int(thisCmd.args[0]) - 1] += 1
+            except (ValueError, IndexError):
+                pass
+
+            if (self.store is not None):
+                self.store.add(self.mode, thisCmd.args, "{}-{}".format(self.session, machine.device.name()))
+
+        elif (thisCmd.cmd == "ERR"):
+            machine.errors += 1
+
+    async def receive(self, machine):
+        return(await asyncio.wait_for(machine.client.receive(), self.timeout))
+
+    async def runMachine(self, machine):
+        # Sets up and runs the sort on one machine. Failures end that machine's sort only.
+        try:
+            machine.state = "connecting"
+            machine.client = await SorterClient.openSorter(machine.device.path)
+            client = machine.client
+
+            await client.request("RDY", timeout=self.timeout)
+            await client.request(self.mode, self.args, timeout=self.timeout)
+            await client.request("PIP", [str(self.window)], timeout=self.timeout)
+            await client.request("SRT", expect=["RDY"], timeout=self.timeout)
+
+            machine.state = "sorting"
+            machine.startedAt = time.monotonic()
+            inFlight = set()
+
+            while ((machine.fed < self.count and not self.stopping) or len(inFlight) > 0):
+
+                # Keep the window full.
+                while (machine.fed < self.count and not self.stopping and len(inFlight) < self.window):
+                    machine.fed += 1
+                    client.send("NXT", [str(machine.fed)])
+                    inFlight.add(machine.fed)
+
+                thisCmd = await self.receive(machine)
+
+                if (thisCmd.cmd == "RDY" and len(thisCmd.args) > 0):
+                    inFlight.discard(int(thisCmd.args[0]))
+                elif (thisCmd.cmd != "ACK"):
+                    self.handle(machine, thisCmd)
+
+            # Sort out whatever is still in the feed.
+            machine.state = "finishing"
+            client.send("END")
+
+            thisCmd = await self.receive(machine)
+            while (thisCmd.cmd != "DON"):
+                self.handle(machine, thisCmd)
+                thisCmd = await self.receive(machine)
+
+            machine.state = "done"
+
+        except (asyncio.TimeoutError, ConnectionError, serial.SerialException, OSError) as err:
+            machine.state = "failed"
+            machine.error = str(err) or type(err).__name__
+
+        finally:
+            machine.finishedAt = time.monotonic()
+            if (machine.client is not None):
+                machine.client.close()
+
+    def status(self):
+        # A table of every machine and the fleet total.
+        lines = ["{:<16} {:<14} {:<10} {:>6} {:>8} {:>6} {:>8}".format("machine", "port", "state", "fed", "measured", "errors", "per min")]
+
+        for machine in self.machines:
+            lines.append("{:<16} {:<14} {:<10} {:>6} {:>8} {:>6} {:>8.1f}".format(
+                machine.device.name(), machine.device.path[-14:], machine.state, machine.fed, machine.measured,
+                machine.errors, machine.rate()))
+
+            if (machine.error is not None):
+                lines.append("    " + machine.error)
+
+        lines.append("{:<16} {:<14} {:<10} {:>6} {:>8} {:>6} {:>8.1f}".format(
+            "total", "", "", sum(m.fed for m in self.machines), sum(m.measured for m in self.machines),
+            sum(m.errors for m in self.machines), sum(m.rate() for m in self.machines)))
+
+        return("\n".join(lines))
+
+    async def run(self, interval=5.0):
+        # Sorts on every machine, printing the status table every interval seconds and once more at the end.
+        tasks = [asyncio.ensure_future(self.runMachine(machine)) for machine in self.machines]
+        pending = set(tasks)
+
+        while (len(pending) > 0):
+            done, pending = await asyncio.wait(pending, timeout=interval)
+            print(self.status() + "\n")
+
+def simulatedDevices(count, timeScale):
+    # Starts count simulated mainboards and returns (devices, simulators).
+    import TeensySim
+
+    simulators = []
+    devices = []
+
+    for i in range(count):
+        population = TeensySim.logUniformPopulation(1.0, 1000000.0, seed=i)
+        fake = TeensySim.FakeTeensy(population, timeScale=timeScale)
+        fake.start()
+        simulators.append(fake)
+        devices.append(SorterDiscovery.SorterDevice(fake.path, "SIM{}".format(i + 1)))
+
+    return(devices, simulators)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run one sort on every attached sorter")
+    parser.add_argument("mode", help="sort mode: MAJ, SSR, SGL, QCR or OHM")
+    parser.add_argument("args", nargs="*", help="arguments for the sort mode, e.g. the precision")
+    parser.add_argument("--count", type=int, default=200, help="resistors per machine")
+    parser.add_argument("--window", type=int, default=2, help="NXTs in flight per machine")
+    parser.add_argument("--serials", help="comma separated USB serial numbers to use; default is every sorter found")
+    parser.add_argument("--db", help="record measurements in this database")
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds between status reports")
+    parser.add_argument("--simulate", type=int, default=0, help="use this many simulated mainboards instead")
+    parser.add_argument("--time-scale", type=float, default=0.0, help="simulator wall seconds per simulated second")
+    options = parser.parse_args()
+
+    simulators = []
+    if (options.simulate > 0):
+        devices, simulators = simulatedDevices(options.simulate, options.time_scale)
+    else:
+        devices = SorterDiscovery.findSorters(usbIds=SorterDiscovery.teensyIds)
+
+    if options.serials:
+        wanted = options.serials.split(",")
+        missing = [serialNumber for serialNumber in wanted if serialNumber not in [device.serialNumber for device in devices]]
+        if (len(missing) > 0):
+            print("Not attached: " + ", ".join(missing))
+        devices = [device for device in devices if device.serialNumber in wanted]
+
+    if (len(devices) == 0):
+        print("No sorters found.")
+        return
+
+    store = MeasurementStore.MeasurementStore(options.db, "fleet") if options.db else None
+    fleet = Fleet(devices, options.mode.upper(), options.args, options.count, options.window, store)
+
+    async def runFleet():
+        asyncio.get_running_loop().add_signal_handler(signal.SIGINT, fleet.stop)
+        await fleet.run(options.interval)
+
+    print("Sorting {} on {} machines.\n".format(fleet.mode, len(devices)))
+    asyncio.run(runFleet())
+
+    if (store is not None):
+        store.close()
+    for fake in simulators:
+        fake.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import os
+import queue
+import re
+import threading
+import time
+
+# Background logging for the debug and measurement logs.
+#
+# Callers only put a record on a bounded queue; formatting, writing, fsync and rotation all happen on the writer
+# thread, so a slow SD card never stalls serial handling. If the queue fills up, records are dropped and counted
+# rather than blocking the caller.
+#
+# Files are opened for append, so history survives restarts. Each line is tab separated key=value fields, starting
+# with the timestamp and session id:
+#
+#   ts=2017-04-02T14:03:11.482	session=20170402-140210	cup=4	resistance=4700.1234	seq=17
+
+def newSession():
+    # Returns an id for this run of the host software.
+    return(time.strftime("%Y%m%d-%H%M%S"))
+
+def formatTime(timestamp):
+    # ISO 8601 local time with milliseconds.
+    return(time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(timestamp)) + ".{:03d}".format(int((timestamp % 1) * 1000)))
+
+class LogWriter(threading.Thread):
+    """Appends structured records to path from a background thread.
+
+    Records are written in batches every flushInterval seconds and fsynced every fsyncInterval seconds. The file is
+    rotated when it grows past maxBytes or has been open longer than maxAge seconds; the newest keep rotated files
+    are kept (none with keep=0).
+    """
+
+    def __init__(self, path, session, queueSize=10000, flushInterval=0.5, fsyncInterval=5.0,
+                 maxBytes=10 * 1024 * 1024, maxAge=24 * 60 * 60, keep=10):
+        threading.Thread.__init__(self, name="LogWriter " + path, daemon=True)
+
+        self.path = path
+        self.session = session
+        self.records = queue.Queue(queueSize)
+        self.flushInterval = flushInterval
+        self.fsyncInterval = fsyncInterval
+        self.maxBytes = maxBytes
+        self.maxAge = maxAge
+        self.keep = keep
+
+        self.dropped = 0
+        self.logFile = None
+        self.openedAt = 0.0
+        self.lastSync = 0.0
+
+        self.start()
+        self.record(event="session start")
+
+    def record(self, **fields):
+        # Queues one record. Never blocks.
+        try:
+            self.records.put_nowait((time.time(), fields))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        # Writes out everything still queued, then stops the thread.
+        self.records.put(None)
+        self.join()
+
+    def formatRecord(self, timestamp, fields):
+        line = "ts=" + formatTime(timestamp) + "\tsession=" + self.session
+
+        for key in fields:
+            line = line + "\t" + key + "=" + str(fields[key])
+
+        return(line + "\n")
+
+    def openLog(self):
+        self.logFile = open(self.path, 'a')
+        self.openedAt = time.time()
+
+    def rotate(self):
+        # Moves the current file aside under a timestamped name and starts a new one.
+        self.logFile.close()
+
+        # Never overwrite an earlier rotation from the same second.
+        rotatedPath = self.path + "." + time.strftime("%Y%m%d-%H%M%S")
+        suffix = 1
+        while os.path.exists(rotatedPath):
+            rotatedPath = self.path + "." + time.strftime("%Y%m%d-%H%M%S") + "-{}".format(suffix)
+            suffix += 1
+        os.replace(self.path, rotatedPath)
+
+        # Only keep the newest rotated files. Other files sharing the name, like measurements.db beside the
+        # measurements log, are left alone.
+        directory = os.path.dirname(self.path) or "."
+        pattern = re.compile(re.escape(os.path.basename(self.path)) + r"\.(\d{8}-\d{6})(?:-(\d+))?$")
+        rotated = []
+        for name in os.listdir(directory):
+            match = pattern.match(name)
+            if (match is not None):
+                rotated.append((match.group(1), int(match.group(2) or 0), name))
+
+        rotated.sort()
+        for stamp, suffix, name in rotated[:len(rotated) - self.keep]:
+            os.remove(os.path.join(directory, name))
+
+        self.openLog()
+
+    def writeBatch(self, batch):
+        self.logFile.write("".join(batch))
+        self.logFile.flush()
+
+        now = time.time()
+        if (now - self.lastSync >= self.fsyncInterval):
+            os.fsync(self.logFile.fileno())
+            self.lastSync = now
+
+        if (self.logFile.tell() >= self.maxBytes or now - self.openedAt >= self.maxAge):
+            self.rotate()
+
+    def run(self):
+        self.openLog()
+        running = True
+
+        while running:
+            batch = []
+
+            # Wait for the first record, then take everything else that is already queued.
+            try:
+                item = self.records.get(timeout=self.flushInterval)
+                while True:
+                    if (item is None):
+                        running = False
+                        break
+
+                    batch.append(self.formatRecord(item[0], item[1]))
+                    item = self.records.get_nowait()
+            except queue.Empty:
+                pass
+
+            if (self.dropped > 0):
+                batch.append(self.formatRecord(time.time(), {"event": "dropped", "count": self.dropped}))
+                self.dropped = 0
+
+            if (len(batch) > 0):
+                self.writeBatch(batch)
+
+        os.fsync(self.logFile.fileno())
+        self.logFile.close()
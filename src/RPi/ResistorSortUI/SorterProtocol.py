@@ -0,0 +1,138 @@
+# The Command framing shared by every transport that talks to the mainboard.
+#
+# A frame is a verification byte followed by "CMD;arg,arg,...". The verification byte holds the length of the whole
+# frame including itself. Frames from the mainboard are sent with println() and so end in "\r\n"; frames to the
+# mainboard have no terminator and are delimited by the verification byte alone.
+#
+# Nothing in this module touches a port, so it is safe to import from tools that never open the real hardware.
+
+def encodeCmd(cmd, args, terminate=False):
+    # Builds the frame bytes for a command and its argument list.
+
+    # Command, semicolon, then the args joined by commas.
+    output = cmd + ";" + ",".join(args)
+
+    # Get the validation byte and append it to the start
+    validByte = chr(len(output) + 1)
+    output = validByte + output
+
+    if terminate:
+        output = output + "\r\n"
+
+    return(bytes(output, "ascii"))
+
+class Command:
+    """Handles Command I/O and parses input strings into more usable forms."""
+    __slots__ = ("cmd", "args")
+
+    def __init__(self, cmd="", args=None):
+        self.cmd = cmd
+        self.args = args if args is not None else []
+
+    def encode(self, terminate=False):
+        # encode converts the cmd and arg list into a valid frame, ready to be written to a port.
+        return(encodeCmd(self.cmd, self.args, terminate))
+
+    def parse(self, inputStr):
+        # parse takes an input string and fills out the cmd and args members accordingly.
+
+        # first we ditch the verification byte (verification byte is used for serial buffer purposes, and is already checked before it gets here)
+        workingStr = inputStr[1:]
+
+        # The next three characters will be the command. Take them, then ditch them from the working string along with the semicolon.
+        self.cmd = workingStr[:3]
+        workingStr = workingStr[4:]
+
+        # If there are characters remaining, those must be arguments.
+        if (len(workingStr) > 0):
+            # Split them by comma (so much easier than in Arduino...)
+            self.args = workingStr.split(',')
+        else:
+            # Otherwise, the argument list is empty.
+            self.args = []
+
+# Pre-encoded frames for the commands that never carry arguments, so sending them costs a single write.
+plainFrames = {}
+for plainCmd in ["RDY", "ACK", "NXT", "END"]:
+    plainFrames[plainCmd] = encodeCmd(plainCmd, [])
+
+def parseCmd(inputStr):
+    # Convenience wrapper that returns a new Command parsed from inputStr.
+    output = Command()
+    output.parse(inputStr)
+    return(output)
+
+class FrameDecoder:
+    """Splits a raw serial byte stream into complete, verified Commands.
+
+    terminated selects the direction: True for mainboard output (CRLF terminated), False for host output
+    (delimited by the verification byte only). log, if given, is called with every raw frame before it is verified.
+
+    Frames are parsed straight out of the receive buffer through a memoryview; the only copies made are the
+    command and argument strings themselves.
+    """
+
+    def __init__(self, terminated=True, log=None):
+        self.buffer = bytearray()
+        self.terminated = terminated
+        self.log = log
+
+    def feed(self, data):
+        # Adds newly received bytes to the buffer and returns every complete Command found.
+        buffer = self.buffer
+        buffer.extend(data)
+        commands = []
+        start = 0
+
+        # The view has to be released before the buffer can shrink, so consumed frames are dropped in one go at the end.
+        with memoryview(buffer) as view:
+            while True:
+                if self.terminated:
+                    # The mainboard terminates each command with println(). Start the search past the verification
+                    # byte, since that byte can legitimately be a '\r' or '\n'.
+                    end = buffer.find(b"\r\n", start + 1)
+                    if (end == -1):
+                        break
+
+                    nextStart = end + 2
+                else:
+                    # Unterminated frames are exactly as long as their verification byte says.
+                    if (start >= len(buffer) or len(buffer) - start < buffer[start]):
+                        break
+
+                    end = start + max(buffer[start], 1)
+                    nextStart = end
+
+                if (self.log is not None):
+                    self.log(bytes(view[start:end]))
+
+                # verify the length using the byte
+                if (buffer[start] != end - start):
+                    received = buffer[start]
+                    expected = end - start
+                    print("ERROR: Verification byte invalid. Received {}, Expected {}.\n".format(received, expected))
+                else:
+                    commands.append(self.parseFrame(view, start, end))
+
+                start = nextStart
+
+        del buffer[:start]
+        return(commands)
+
+    def parseFrame(self, view, start, end):
+        # Parses the frame at view[start:end]: verification byte, three command characters, a semicolon, then
+        # comma separated arguments.
+        thisCmd = Command(str(view[start + 1:start + 4], "ascii", "replace"))
+        argStart = start + 5
+
+        if (argStart < end):
+            while True:
+                comma = self.buffer.find(b",", argStart, end)
+                if (comma == -1):
+                    thisCmd.args.append(str(view[argStart:end], "ascii", "replace"))
+                    break
+
+                thisCmd.args.append(str(view[argStart:comma], "ascii", "replace"))
+                argStart = comma + 1
+
+        return(thisCmd)
@@ -0,0 +1,197 @@
+import collections
+import sys
+import threading
+import time
+
+# Draws the console screens in-process with ANSI escape sequences.
+#
+# The screens used to be drawn by running setterm and clear in a shell, and sort() did that four times per resistor,
+# right between RDY and the next NXT. Forking a shell costs milliseconds on a Pi. Here the colours and clears are
+# escape sequences written to stdout, which the Linux console and every terminal emulator understand.
+#
+# While a sort runs, SortDisplay keeps the live counters: parts sorted, the count in every cup, the last measurement
+# and a rolling rate. The sorting path only updates them under a lock. A display thread redraws at most every
+# interval seconds, and only the lines that changed. Lines are placed with cursor moves rather than newlines, so the
+# screen stays correct while getch() has the terminal in raw mode.
+
+title = "Resistor Sortation System"
+
+# setterm colour names and their ANSI colour numbers.
+colours = {"black": 0, "red": 1, "green": 2, "yellow": 3, "blue": 4, "magenta": 5, "cyan": 6, "white": 7}
+
+def isTerminal(stream=sys.stdout):
+    # Whether stream is a terminal. Escape sequences only make sense on one, so logs piped to a file get plain text.
+    try:
+        return(stream.isatty())
+    except (AttributeError, ValueError):
+        return(False)
+
+def write(text, stream=sys.stdout):
+    stream.write(text)
+    stream.flush()
+
+def colourCode(background, foreground):
+    # The escape sequence that sets both colours, e.g. ("red", "black").
+    return("\x1b[{};{}m".format(40 + colours[background], 30 + colours[foreground]))
+
+def clearScreen(stream=sys.stdout):
+    # Clears the screen in the current colours and prints the title line.
+    write("\x1b[H\x1b[2J" + title + "\n\n\n", stream)
+
+def setColours(background, foreground, stream=sys.stdout):
+    # Sets the colours, like setterm -background -foreground. Takes effect from the next clear.
+    write(colourCode(background, foreground), stream)
+
+def resetColours(stream=sys.stdout):
+    write("\x1b[0m", stream)
+
+class SortDisplay(threading.Thread):
+    """The live sort screen.
+
+    setStatus, measured, info and message may be called from any thread and return at once; the display thread
+    draws the result. rateWindow is how many seconds of measurements the per minute rate is taken over.
+    """
+
+    def __init__(self, cupCount=10, interval=0.1, rateWindow=30.0, stream=sys.stdout):
+        threading.Thread.__init__(self, name="SortDisplay", daemon=True)
+        self.cupCount = cupCount
+        self.interval = interval
+        self.rateWindow = rateWindow
+        self.stream = stream
+
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.running = True
+        self.dirty = True
+
+        self.status = ""
+        self.colours = ("black", "white")
+        self.sortedCount = 0
+        self.cups = [0] * cupCount
+        self.last = None
+        self.times = collections.deque()
+        self.extra = collections.OrderedDict()
+        self.messages = collections.deque(maxlen=5)
+
+        # What is on the screen: the lines drawn and the colours they were drawn in.
+        self.shown = []
+        self.shownColours = None
+
+    # Updates, from any thread
+
+    def setStatus(self, text, background="black", foreground="white"):
+        # The line that tells the operator what the machine is doing. A colour change repaints the whole screen.
+        with self.lock:
+            self.status = text
+            self.colours = (background, foreground)
+            self.dirty = True
+
+    def measured(self, cup, value, measureRange=None, samples=None):
+        # Counts one MES.
+        now = time.monotonic()
+
+        with self.lock:
+            self.sortedCount += 1
+            if (cup >= 1 and cup <= self.cupCount):
+                self.cups[cup - 1] += 1
+
+            self.last = (cup, value, measureRange, samples)
+
+            self.times.append(now)
+            while (self.times[0] < now - self.rateWindow):
+                self.times.popleft()
+
+            self.dirty = True
+
+    def info(self, key, text):
+        # A line of its own that is replaced on every update, e.g. the running lot statistics.
+        with self.lock:
+            self.extra[key] = text
+            self.dirty = True
+
+    def message(self, text):
+        # A warning or note. The latest few are kept on screen.
+        with self.lock:
+            self.messages.append(text.strip())
+            self.dirty = True
+
+    def rate(self):
+        # Resistors per minute over the last rateWindow seconds.
+        if (len(self.times) < 2):
+            return(0.0)
+
+        elapsed = self.times[-1] - self.times[0]
+        return((len(self.times) - 1) * 60.0 / elapsed if elapsed > 0 else 0.0)
+
+    # Drawing, on the display thread
+
+    def lines(self):
+        # The screen below the title, one string per line.
+        output = [self.status, "",
+                  "Sorted: {:<8} Rate: {:.1f} per minute".format(self.sortedCount, self.rate())]
+
+        if (self.last is None):
+            output.append("Last:   -")
+        else:
+            cup, value, measureRange, samples = self.last
+            detail = "" if measureRange is None else " (range {}, {} samples)".format(measureRange, samples)
+            output.append("Last:   {:g} ohms to cup {}{}".format(value, cup, detail))
+
+        output.append("")
+        output.append("Cup   " + "".join("{:>6}".format(i + 1) for i in range(self.cupCount)))
+        output.append("Parts " + "".join("{:>6}".format(total) for total in self.cups))
+
+        if (len(self.extra) > 0):
+            output.append("")
+            output.extend(self.extra.values())
+
+        if (len(self.messages) > 0):
+            output.append("")
+            output.extend(self.messages)
+
+        return(output)
+
+    def render(self):
+        with self.lock:
+            if not self.dirty:
+                return
+
+            lines = self.lines()
+            lineColours = self.colours
+            self.dirty = False
+
+        out = []
+        if (lineColours != self.shownColours):
+            out.append(colourCode(*lineColours) + "\x1b[H\x1b[2J" + title)
+            self.shown = []
+            self.shownColours = lineColours
+
+        # The title takes row 1 and a blank row 2, so the status line is row 3.
+        for row, line in enumerate(lines):
+            if (row >= len(self.shown) or self.shown[row] != line):
+                out.append("\x1b[{};1H{}\x1b[K".format(row + 3, line))
+
+        if (len(lines) < len(self.shown)):
+            out.append("\x1b[{};1H\x1b[J".format(len(lines) + 3))
+
+        if (len(out) == 0):
+            return
+
+        # Leave the cursor below the screen so anything printed afterwards doesn't land on it.
+        out.append("\x1b[{};1H".format(len(lines) + 4))
+
+        self.shown = lines
+        write("".join(out), self.stream)
+
+    def run(self):
+        while self.running:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            self.render()
+
+    def stop(self):
+        # Draws the final state and stops the thread.
+        self.running = False
+        self.wake.set()
+        self.join()
+        self.render()
@@ -0,0 +1,285 @@
+import json
+import math
+import os
+import time
+import RequestManager  # Mechanical timings, for the limit used before any have been learned
+
+# Notices a jammed feed or sort wheel during an unattended sort, and tries to clear it.
+#
+# The feeder and the wheel are I2C slaves that interrupt the mainboard when a motion finishes. A bent resistor that
+# stops the feeder, or a wheel that stalls, means that interrupt never comes and the mainboard waits for it for ever:
+# no RDY, no ERR, nothing. Until now the sort waited with it until an operator noticed.
+#
+# The watchdog learns how long each resistor normally takes, from NXT (or the RDY before it, whichever is later) to its
+# RDY, separately for every sort mode and pipeline window. Latencies are roughly log-normal, so it keeps a running
+# mean and variance of their logarithms (Welford), and saves them between sessions. Anything beyond limitSigmas
+# standard deviations is a stall. Recovery then works through a ladder of steps, waiting the same limit after each
+# for a RDY: re-home the wheel (to cup 1 and back to the cup it was going to), then cycle the feed once, twice. If
+# none of them clears it the sort stops and waits for the operator. The commands of a step go one at a time, each
+# sent once the mainboard has answered the one before it.
+#
+# Cycling the feed moves the mainboard's record of the feed on as well as the parts, so for a feed's length after a
+# recovery a position it believes full may be empty. A reading of 0.0 there is taken as no part rather than as an
+# unreadable one.
+#
+# Jams are counted against the hours spent sorting, which is the figure to watch for a worn feeder.
+
+latencyPath = "./latency.json"
+
+# The recovery ladder. "cup" is replaced by the cup the last measured resistor was sent to.
+recoverySteps = [[("MSW", ["1"]), ("MSW", ["cup"])],
+                 [("CFD", ["1"])],
+                 [("CFD", ["1"])]]
+
+class LatencyModel:
+    """Running statistics of the logarithm of one kind of latency, in seconds.
+
+    Once count reaches maxCount it stops growing, so older sessions fade out and the model follows a machine whose
+    timing slowly changes.
+    """
+
+    def __init__(self, count=0, mean=0.0, m2=0.0, maxCount=500):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.maxCount = maxCount
+
+    def add(self, seconds):
+        if (seconds <= 0):
+            return
+
+        value = math.log(seconds)
+        self.count = min(self.count + 1, self.maxCount)
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+        if (self.count == self.maxCount):
+            # Keep the variance's weight in step with the capped count.
+            self.m2 *= (self.count - 1.0) / self.count
+
+    def sd(self):
+        return(math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0)
+
+    def typical(self):
+        # The geometric mean, in seconds.
+        return(math.exp(self.mean))
+
+    def limit(self, sigmas, factor):
+        # The latency beyond which something is wrong: sigmas standard deviations up, and at least factor times the
+        # typical latency.
+        return(max(math.exp(self.mean + sigmas * self.sd()), factor * self.typical()))
+
+class StallWatchdog:
+    """Watches the RDYs of a continuous sort.
+
+    send(cmd, args) sends a recovery command. Until minSamples latencies have been seen for a mode the limit is
+    defaultLimit seconds, and it is never below minLimit.
+    """
+
+    def __init__(self, send, path=latencyPath, limitSigmas=4.0, limitFactor=1.5, minSamples=10, minLimit=0.5,
+                 defaultLimit=RequestManager.cycleTime * 1.5):
+        self.send = send
+        self.path = path
+        self.limitSigmas = limitSigmas
+        self.limitFactor = limitFactor
+        self.minSamples = minSamples
+        self.minLimit = minLimit
+        self.defaultLimit = defaultLimit
+
+        self.models = {}
+        self.load()
+
+        # Since this watchdog was created, for the jam rate.
+        self.sortTime = 0.0
+        self.jams = 0
+        self.cleared = 0
+        self.emptyPositions = 0
+        self.noticeTime = 0.0       # Seconds from the last progress to each stall being noticed
+        self.clearTime = 0.0        # Seconds from noticing each cleared stall to its RDY
+
+        self.key = None
+        self.model = None
+
+    # Learned latencies
+
+    def load(self):
+        if (self.path is None or not os.path.exists(self.path)):
+            return
+
+        try:
+            with open(self.path) as latencyFile:
+                saved = json.load(latencyFile)
+            self.models = {key: LatencyModel(*values) for key, values in saved.items()}
+        except (OSError, ValueError, TypeError) as err:
+            print("WARNING: Could not read the learned latencies. {}\n".format(err))
+
+    def save(self):
+        if (self.path is None):
+            return
+
+        # Write then rename, so a crash never leaves half a file.
+        with open(self.path + ".tmp", 'w') as latencyFile:
+            json.dump({key: [model.count, model.mean, model.m2] for key, model in self.models.items()}, latencyFile, indent=2, sort_keys=True)
+        os.replace(self.path + ".tmp", self.path)
+
+    def limit(self):
+        # Seconds without a RDY before the current sort counts as stalled.
+        if (self.model is None or self.model.count < self.minSamples):
+            return(self.defaultLimit)
+
+        return(max(self.minLimit, self.model.limit(self.limitSigmas, self.limitFactor)))
+
+    # One sort
+
+    def start(self, mode, window):
+        # A continuous sort is starting in mode, with window NXTs in flight.
+        self.key = "{}/{}".format(mode, window)
+        self.model = self.models.setdefault(self.key, LatencyModel())
+
+        now = time.monotonic()
+        self.startedAt = now
+        self.since = now
+        self.lastReady = now
+        self.sentAt = {}
+        self.step = 0               # Recovery steps taken for the current stall; 0 when not stalled
+        self.stalledAt = None
+        self.suspect = 0            # MES still to come from positions a recovery may have emptied
+        self.lastCup = 1
+        self.empty = set()          # Sequence numbers whose MES was taken as no part
+        self.queue = []             # Commands of the current recovery step still to send
+        self.waiting = None         # The recovery command sent and not yet answered
+
+    def stop(self):
+        # The sort has finished. Saves what was learned.
+        self.sortTime += time.monotonic() - self.startedAt
+        self.key = None
+        self.save()
+
+    def recovering(self):
+        return(self.step > 0)
+
+    def sent(self, seq):
+        now = time.monotonic()
+        if (len(self.sentAt) == 0):
+            self.since = now
+        self.sentAt[seq] = now
+
+    def ready(self, seq):
+        # A RDY for seq. Learns its latency, or closes the stall it ends. Returns a line for the log if it ended one.
+        now = time.monotonic()
+        sentAt = self.sentAt.pop(seq, now)
+        for waiting in [waiting for waiting in self.sentAt if waiting < seq]:
+            del self.sentAt[waiting]
+
+        note = None
+        if self.recovering():
+            self.cleared += 1
+            self.clearTime += now - self.stalledAt
+            note = "Jam cleared after {} recovery step{} ({:.1f} s).".format(self.step, "" if self.step == 1 else "s", now - self.stalledAt)
+            self.step = 0
+        elif (self.suspect == 0):
+            # Latencies straight after a recovery include it, so they aren't learned from.
+            latency = now - max(sentAt, self.lastReady)
+            if (self.model.count < self.minSamples or latency < self.limit()):
+                self.model.add(latency)
+
+        self.lastReady = now
+        self.since = now
+        return(note)
+
+    def remaining(self):
+        # Seconds until the sort counts as stalled, or None with nothing in flight.
+        if (len(self.sentAt) == 0):
+            return(None)
+
+        return(max(0.0, self.since + self.limit() - time.monotonic()))
+
+    def recover(self):
+        # Called when remaining() has run out. Sends the next recovery step and returns a line for the operator, or
+        # returns None once every step has been tried.
+        now = time.monotonic()
+
+        if (self.step == 0):
+            self.jams += 1
+            self.stalledAt = now
+            self.noticeTime += now - self.since
+
+        if (self.step >= len(recoverySteps)):
+            return(None)
+
+        if (self.model.count < self.minSamples):
+            limit = "limit {:.0f} ms, not learned yet".format(self.limit() * 1000.0)
+        else:
+            limit = "limit {:.0f} ms".format(self.limit() * 1000.0)
+
+        # Anything left of the last step is dropped; this one starts afresh.
+        self.queue = [(cmd, [str(self.lastCup) if arg == "cup" else arg for arg in args]) for cmd, args in recoverySteps[self.step]]
+        self.step += 1
+        self.suspect = RequestManager.feedPositions
+        self.sendNext()
+
+        return("No RDY for {:.1f} s ({}). Trying recovery step {} of {}.".format(
+            now - self.lastReady, limit, self.step, len(recoverySteps)))
+
+    def sendNext(self):
+        # Sends the next command of the current recovery step. The limit counts from here.
+        cmd, args = self.queue.pop(0)
+        self.waiting = cmd
+        self.send(cmd, args)
+        self.since = time.monotonic()
+
+    def answered(self, cmd):
+        # A request for cmd got its ACK, or an ERR or TMO in its place. If it was the recovery command waiting, sends
+        # the next one of its step.
+        if (cmd != self.waiting):
+            return
+
+        self.waiting = None
+        if (len(self.queue) > 0):
+            self.sendNext()
+
+    def measured(self, thisCmd):
+        # Checks one MES. Returns True if it is an empty position left by a recovery, which is not a resistor.
+        if (self.key is None):
+            return(False)
+
+        try:
+            cup = int(thisCmd.args[0])
+            value = float(thisCmd.args[1])
+        except (ValueError, IndexError):
+            return(False)
+
+        if (self.suspect == 0):
+            self.lastCup = cup
+            return(False)
+
+        self.suspect -= 1
+        if (value > 0):
+            self.lastCup = cup
+            return(False)
+
+        self.emptyPositions += 1
+        if (len(thisCmd.args) > 2):
+            self.empty.add(thisCmd.args[2])
+        return(True)
+
+    # Reporting
+
+    def jamRate(self):
+        # Jams per hour of sorting.
+        return(self.jams * 3600.0 / self.sortTime if self.sortTime > 0 else 0.0)
+
+    def summary(self):
+        lines = ["Stall watchdog: {} jam{} in {:.2f} h of sorting ({:.1f} per hour), {} cleared automatically.".format(
+            self.jams, "" if self.jams == 1 else "s", self.sortTime / 3600.0, self.jamRate(), self.cleared)]
+
+        if (self.jams > 0):
+            lines.append("  Noticed after {:.1f} s on average, cleared in {:.1f} s. {} empty positions skipped.".format(
+                self.noticeTime / self.jams, self.clearTime / self.cleared if self.cleared > 0 else 0.0, self.emptyPositions))
+
+        for key, model in sorted(self.models.items()):
+            if (model.count > 0):
+                lines.append("  {}: typically {:.2f} s per resistor ({} learned).".format(key, model.typical(), model.count))
+
+        return("\n".join(lines))
@@ -0,0 +1,907 @@
+import argparse
+import math
+import os
+import random
+import select
+import time
+import tty
+import threading
+import collections
+import SorterProtocol
+import BinaryProtocol
+import PhaseProfile
+
+try:
+    import ESeries  # Vectorized cup assignment shared with the host. Needs numpy; PlainCupTable stands in without it.
+except ImportError:
+    ESeries = None
+
+# A simulated mainboard on a pseudo-terminal. Host code opens FakeTeensy.path exactly like it would open
+# /dev/ttyACM0, so the serial protocol can be exercised and benchmarked without the machine attached.
+#
+# The simulator runs the same state machine as loop() in RS_Mainboard.ino: the feed is a shift register of five
+# positions (load platform to measurement platform), NXT loads the load platform, MES is sent when a part reaches
+# the measurement platform, and the wheel and swing arm dispense it. Mechanical motions take time on a virtual
+# clock (milliseconds, see Timing). timeScale maps that onto wall time: 1.0 is real time, 0.01 runs a hundred
+# times faster, and 0 never sleeps at all.
+#
+# Jams can be injected: a jammed feed cycle or wheel move never finishes, as when a bent resistor stops the feeder,
+# until a CFD or MSW starts the motion again.
+#
+# ASCII frames are read the way cmdReady() and readFrame() read them, not with the host's FrameDecoder, so the
+# simulator only understands what the firmware would. --legacy-framing reads them as firmware from before pipelining
+# did, which never reads again once two frames are waiting together.
+#
+#   python3 TeensySim.py [--time-scale 0.1] [--population e24] [--calibration-error 2] [--contact 0.2] [--jam-every 50]
+#                        [--legacy-framing]
+
+# Commands that are acknowledged but otherwise ignored here.
+debugCmds = ["CFD", "MSW", "CDA"]
+
+# Feed positions, as in StepFeed: 0 is the load platform, 4 the measurement platform.
+feedPositions = 5
+
+# Cups on the sort wheel.
+cupCount = 10
+
+# The top standard value of each precision's series within a decade (ProgmemData.cpp), for MAJ.
+majTops = {1: 9.76, 2: 9.1, 5: 9.1}
+
+# Measurement ranges (RS_Mainboard.ino minRange..maxRange) and the resistance each reads mid-scale on.
+rangeMidpoints = {3: 99747.01, 4: 10051.5, 5: 999.8, 6: 99.5, 7: 7.5}
+
+# Readings above this are discarded by the mainboard (maxAccepted).
+maxAccepted = 1000000
+
+# ADC full scale, the cutoff bands either end of it, and the current source reference voltage (ProgmemData.cpp).
+maxAnalog = 4095
+adcCutoffs = (220, 3875)
+avLow = 1.5
+
+# Sequential sampling (SEQ): the standard deviation of a single reading in counts, the fewest readings taken, and the
+# fixed counts used without it.
+sampleNoise = 2.0
+seqMinSamples = 5
+goodTarget = 31
+maxAttempts = 101
+
+# The compiled calibration for ranges 1-9: internalTestResistances (ohms), then internalCurrentSources (amps).
+compiledCalibration = [10500000, 999000, 99747.01, 10051.5, 999.8, 99.5, 0.1, 0.02937, 0.01818]
+
+class Timing:
+    """Mechanical and electrical delays in milliseconds. Defaults are the constants in ProgmemData.cpp, plus
+    estimates for the stepper motions and ADC reads, which the firmware waits on through interrupts."""
+
+    def __init__(self, contactTime=450, swingTime=400, relaySettle=50, sampleTime=0.02, feedStep=250, wheelStep=120):
+        self.contactTime = contactTime      # Contact arm home to touch, and back
+        self.swingTime = swingTime          # Swing arm home to open, and back
+        self.relaySettle = relaySettle      # After switching measurement range
+        self.sampleTime = sampleTime        # One ADC read
+        self.feedStep = feedStep            # Feed advancing one position
+        self.wheelStep = wheelStep          # Sort wheel moving one cup
+
+class Hardware:
+    """What the measurement circuit really is, as opposed to the calibration the mainboard believes.
+
+    By default the two match and every part measures exactly its value. error moves each divider resistor and
+    current source by up to that many percent, contactResistance adds in series with every part, and noise is the
+    standard deviation of the averaged ADC reading in counts.
+    """
+
+    def __init__(self, error=0.0, contactResistance=0.0, noise=0.0, seed=None):
+        self.rng = random.Random(seed)
+        self.values = [value * (1.0 + self.rng.uniform(-error, error) / 100.0) for value in compiledCalibration]
+        self.contactResistance = contactResistance
+        self.noise = noise
+
+    def counts(self, value, rangeNumber):
+        # Noiseless ADC counts for a part of value ohms measured on a range.
+        value = value + self.contactResistance
+
+        if (rangeNumber <= 6):
+            return(maxAnalog * value / (self.values[rangeNumber - 1] + value))
+
+        return(value * self.values[rangeNumber - 1] * maxAnalog / avLow)
+
+    def adcReading(self, value, rangeNumber):
+        # Averaged ADC counts for a part of value ohms measured on a range.
+        counts = self.counts(value, rangeNumber)
+
+        if (self.noise > 0):
+            counts += self.rng.gauss(0.0, self.noise)
+
+        return(counts)
+
+class PlainCupTable:
+    """ESeries.CupTable in plain Python, so the simulator runs without numpy. Same setup commands, same first-match
+    rule as getTargetCup()."""
+
+    def __init__(self):
+        self.mins = [0.0] * cupCount
+        self.maxs = [0.0] * cupCount
+        self.rejects = [False] * cupCount
+        self.configured = False
+
+    def setCup(self, index, minValue, maxValue, reject=False):
+        self.mins[index] = minValue
+        self.maxs[index] = maxValue
+        self.rejects[index] = reject
+
+    def setNominal(self, index, nominal, precisionPercent):
+        diff = nominal * (precisionPercent / 100.0)
+        self.setCup(index, nominal - diff, nominal + diff)
+
+    def apply(self, cmd, args):
+        # Updates the table for one command. Returns True if the command was a cup setup command.
+        if (cmd == "MAJ"):
+            precisionPercent = int(args[0])
+            precision = precisionPercent / 100.0
+            top = majTops.get(precisionPercent, 8.2)
+
+            for i in range(cupCount):
+                lowSide = 10.0 ** i
+                if (i < 6):
+                    self.setCup(i, lowSide * (1 - precision), lowSide * top * (1 + precision))
+                else:
+                    self.rejects[i] = True
+
+        elif (cmd == "SGL" or cmd == "QCR"):
+            self.setNominal(0, float(args[1]), int(args[0]))
+            for i in range(1, cupCount):
+                self.rejects[i] = True
+
+        elif (cmd == "SSR"):
+            precisionPercent = int(args[0])
+            for i in range(1, min(len(args), cupCount)):
+                if (args[i] == ""):
+                    self.rejects[i - 1] = True
+                else:
+                    self.setNominal(i - 1, float(args[i]), precisionPercent)
+            self.rejects[cupCount - 1] = True
+
+        elif (cmd == "OHM"):
+            for i in range(cupCount):
+                self.setCup(i, 0.0, 1000000000.0)
+
+        elif (cmd == "CUP"):
+            self.setCup(int(args[0]) - 1, float(args[1]), float(args[2]), int(args[3]) != 0)
+
+        else:
+            return(False)
+
+        self.configured = True
+        return(True)
+
+    def assign(self, readings):
+        # Cup numbers for a list of readings, or None if no setup command has been applied yet.
+        if not self.configured:
+            return(None)
+
+        return([self.cup(value) for value in readings])
+
+    def cup(self, value):
+        for i in range(cupCount):
+            if (not self.rejects[i] and value >= self.mins[i] and value <= self.maxs[i]):
+                return(i + 1)
+
+        if any(self.rejects):
+            return(self.rejects.index(True) + 1)
+
+        return(-1)
+
+class FirmwareSerial:
+    """The mainboard's receive buffer in ASCII mode, read as cmdReady() and readFrame() read it: a frame is ready once
+    as many bytes as its verification byte says are waiting, and exactly that many are read.
+
+    With legacy set it is read as it was before pipelining, when a frame was only ready if it was the only thing
+    waiting: once two frames are buffered together neither is ever read, and the sort stalls. stacked counts the
+    frames that were read with another already waiting behind them.
+    """
+
+    def __init__(self, legacy=False):
+        self.buffer = bytearray()
+        self.legacy = legacy
+        self.stacked = 0
+        self.stalled = False
+
+    def ready(self):
+        if (len(self.buffer) == 0):
+            return(False)
+
+        if self.legacy:
+            return(len(self.buffer) == self.buffer[0])
+
+        return(len(self.buffer) >= max(self.buffer[0], 1))
+
+    def feed(self, data):
+        # Adds received bytes and returns every Command the firmware would read from them.
+        self.buffer.extend(data)
+        commands = []
+
+        while self.ready():
+            length = max(self.buffer[0], 1)
+            frame = bytes(self.buffer[:length])
+            del self.buffer[:length]
+
+            if (len(self.buffer) > 0):
+                self.stacked += 1
+
+            commands.append(SorterProtocol.parseCmd(frame.decode("ascii", "replace")))
+
+        if (self.legacy and not self.stalled and len(self.buffer) > 0 and len(self.buffer) > self.buffer[0]):
+            self.stalled = True
+            print("WARNING: More than one frame waiting. Firmware before pipelining never reads these.\n")
+
+        return(commands)
+
+def cycleValues(values):
+    # A population that repeats the given values in order.
+    values = list(values)
+    state = {"index": 0}
+
+    def draw():
+        value = values[state["index"] % len(values)]
+        state["index"] += 1
+        return(value)
+
+    return(draw)
+
+def seriesPopulation(nominals, precisionPercent=5, weights=None, missRate=0.0, seed=None):
+    # A population of parts with the given nominals (chosen with the given weights), each off nominal by a normal
+    # error whose 3 sigma is the tolerance. missRate is the fraction of feeds with no part, which measure 0.0.
+    rng = random.Random(seed)
+    nominals = list(nominals)
+    sigma = precisionPercent / 300.0
+
+    def draw():
+        if (missRate > 0 and rng.random() < missRate):
+            return(0.0)
+
+        nominal = rng.choices(nominals, weights)[0]
+        return(nominal * (1.0 + rng.gauss(0.0, sigma)))
+
+    return(draw)
+
+def logUniformPopulation(low, high, seed=None):
+    # Parts spread evenly across decades between low and high.
+    rng = random.Random(seed)
+    logLow = math.log(low)
+    logHigh = math.log(high)
+
+    return(lambda: math.exp(rng.uniform(logLow, logHigh)))
+
+def toInt(text):
+    # String.toInt() on the mainboard: 0 for anything that isn't a number.
+    try:
+        return(int(text))
+    except (TypeError, ValueError):
+        return(0)
+
+def toFloat(text):
+    # strtod() on the mainboard: 0.0 for anything that isn't a number.
+    try:
+        return(float(text))
+    except (TypeError, ValueError):
+        return(0.0)
+
+def bestRange(value):
+    # The range whose mid-scale is closest (by ratio) to value.
+    if (value <= 0):
+        return(min(rangeMidpoints))
+
+    return(min(rangeMidpoints, key=lambda r: abs(math.log(value / rangeMidpoints[r]))))
+
+class FakeTeensy(threading.Thread):
+    """Answers the mainboard side of the Command protocol on a pty.
+
+    resistances is either a list of values, reported in turn for successive parts, or a function returning the next
+    part's resistance (see cycleValues, seriesPopulation and logUniformPopulation). clock is the virtual time in
+    milliseconds and measured the number of parts measured so far. hardware is the real measurement circuit (see
+    Hardware); by default it matches the compiled calibration. feedJams and wheelJams number the feed cycles and wheel
+    moves (sorting and parking) that jam, counting from 1; jamEvery > 0 also jams every jamEvery-th feed cycle. legacyFraming reads ASCII
+    frames as firmware from before pipelining did (see FirmwareSerial).
+    """
+
+    def __init__(self, resistances=None, timing=None, timeScale=0.0, hardware=None, feedJams=(), wheelJams=(), jamEvery=0,
+                 legacyFraming=False):
+        threading.Thread.__init__(self, name="FakeTeensy", daemon=True)
+
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.path = os.ttyname(self.slave)
+
+        if (resistances is None):
+            resistances = [1000.0]
+        if callable(resistances):
+            self.population = resistances
+        else:
+            self.population = cycleValues(resistances)
+
+        self.timing = timing if timing is not None else Timing()
+        self.hardware = hardware if hardware is not None else Hardware()
+        self.timeScale = timeScale
+
+        self.clock = 0.0
+        self.measured = 0
+        self.received = []
+        self.closed = False
+
+        self.feedJams = set(feedJams)
+        self.wheelJams = set(wheelJams)
+        self.jamEvery = jamEvery
+        self.feedCycles = 0
+        self.sortMoves = 0
+        self.jams = 0
+        self.legacyFraming = legacyFraming
+
+        self.reset()
+
+    def reset(self):
+        # Power-on state, also used after RST.
+        self.asciiSerial = FirmwareSerial(self.legacyFraming)
+        self.decoder = self.asciiSerial
+        self.binaryLink = None
+        self.commands = collections.deque()
+        self.halted = False
+
+        self.cState = 0
+        self.cupTable = ESeries.CupTable() if ESeries is not None else PlainCupTable()
+        self.feed = [None] * feedPositions      # Sequence number of the part at each position, None if empty
+        self.parts = {}                         # Resistance of each part in the feed, by position
+        self.feedInProcess = False
+        self.feedDoneAt = 0.0
+        self.sortMotionInProcess = False
+        self.wheelDoneAt = 0.0
+        self.wheelPosition = 1
+        self.parkCup = 0
+        self.held = None                        # (value, samples, cup) measured while state 3 waits for the wheel
+        self.feedToEnd = False
+
+        self.pipeWindow = 0
+        self.pending = collections.deque()
+        self.loadedSeq = 0
+        self.rdyOwed = False
+
+        self.adaptiveRanging = False
+        self.hintRange = 0
+        self.seqTolerance = 0.0
+        self.continuousAdc = False
+        self.lastRange = 0
+        self.lastReading = 0.0
+
+        # Calibration (CAL), back to the compiled values on every reset.
+        self.calValues = list(compiledCalibration)
+        self.calOffsets = [0.0] * len(compiledCalibration)
+
+        # Phase telemetry (TLM), in virtual milliseconds.
+        self.telemetry = False
+        self.phaseTimes = {phase: 0.0 for phase in PhaseProfile.phases}
+
+    # Time
+
+    def delay(self, ms):
+        # A blocking delay, like delay() on the mainboard: nothing else happens meanwhile.
+        if (self.timeScale > 0):
+            time.sleep(ms * self.timeScale / 1000.0)
+        self.clock += ms
+
+    def waitUntil(self, deadline):
+        # Waits for a motion to finish on the virtual clock, returning early if a command arrives.
+        remaining = deadline - self.clock
+        if (remaining <= 0):
+            return
+
+        if (deadline == math.inf):
+            # A jammed motion never finishes. Wait for the host to do something about it.
+            started = time.monotonic()
+            self.poll(None)
+            if (self.timeScale > 0):
+                self.clock += (time.monotonic() - started) * 1000.0 / self.timeScale
+            return
+
+        if (self.timeScale > 0):
+            started = time.monotonic()
+            self.poll(remaining * self.timeScale / 1000.0)
+            remaining = min(remaining, (time.monotonic() - started) * 1000.0 / self.timeScale)
+
+        self.clock += remaining
+
+    def updateMotions(self):
+        # The interrupt routines: clear the in-process flags once the motion's time has passed.
+        if (self.feedInProcess and self.clock >= self.feedDoneAt):
+            self.feedInProcess = False
+        if (self.sortMotionInProcess and self.clock >= self.wheelDoneAt):
+            self.sortMotionInProcess = False
+
+    # Serial
+
+    def reply(self, cmd, args=None):
+        # Sends a frame the way the mainboard does (println, so CRLF terminated), or as a binary frame after BIN.
+        if (args is None):
+            args = []
+
+        if (self.binaryLink is not None):
+            os.write(self.master, self.binaryLink.encode(cmd, args))
+        else:
+            os.write(self.master, SorterProtocol.encodeCmd(cmd, args, terminate=True))
+
+    def poll(self, timeout):
+        # Reads whatever the host has sent, waiting up to timeout seconds (None waits forever). Returns False once
+        # the pty has been closed.
+        try:
+            readable, _, _ = select.select([self.master], [], [], timeout)
+            if (len(readable) == 0):
+                return(True)
+
+            data = os.read(self.master, 4096)
+        except (OSError, ValueError):
+            return(False)
+
+        if (len(data) == 0):
+            return(False)
+
+        lostBefore = self.decoder.lostFrames if (self.binaryLink is not None) else 0
+
+        for thisCmd in self.decoder.feed(data):
+            self.received.append(thisCmd.cmd)
+            if self.parseCmd(thisCmd):
+                self.commands.append(thisCmd)
+
+        # A gap in the host's binary frames is reported with LOS, as fetchBinary() does.
+        if (self.binaryLink is not None and self.decoder.lostFrames > lostBefore):
+            self.reply("LOS", [str(self.decoder.lostFrames - lostBefore)])
+
+        return(True)
+
+    def parseCmd(self, thisCmd):
+        # Commands the mainboard handles as soon as they are parsed. Returns True if the state machine should see it.
+        if self.halted:
+            return(False)
+
+        if (thisCmd.cmd == "HCF"):
+            self.reply("ACK")
+            self.halted = True
+            return(False)
+
+        if (thisCmd.cmd == "RDY"):
+            self.reply("ACK")
+
+        elif (thisCmd.cmd == "CFD"):
+            self.cycleFeed(toInt(thisCmd.args[0]) if thisCmd.args else 1)
+            self.reply("ACK")
+
+        elif (thisCmd.cmd == "MSW"):
+            self.moveWheel(toInt(thisCmd.args[0]) if thisCmd.args else 1)
+            self.reply("ACK")
+
+        elif (thisCmd.cmd == "PPW"):
+            # Unacknowledged; applied after the next dispense.
+            self.parkCup = max(0, min(toInt(thisCmd.args[0]) if thisCmd.args else 0, cupCount))
+
+        elif (thisCmd.cmd == "CDA"):
+            self.delay(2 * self.timing.swingTime)
+            self.reply("ACK")
+
+        elif (thisCmd.cmd == "TME"):
+            self.reply("ACK")
+            value, samples = self.measureResistor(self.population())
+            self.delay(self.timing.contactTime)
+            self.reply("MES", [str(self.wheelPosition), "{:.2f}".format(value), "0", str(self.lastRange), str(samples), "{:.2f}".format(self.lastReading)])
+
+        elif (thisCmd.cmd == "RST"):
+            self.reply("ACK")
+            self.reset()
+            return(False)
+
+        return(True)
+
+    # Mechanics
+
+    def cycleFeed(self, count=1):
+        # Shifts every part along the feed, as StepFeed::cycleFeed does, and starts the motion.
+        for i in range(count):
+            self.feed = [None] + self.feed[:-1]
+            self.parts = {position + 1: value for position, value in self.parts.items() if position + 1 < feedPositions}
+
+        self.feedInProcess = True
+        self.feedDoneAt = self.clock + count * self.timing.feedStep
+        self.phaseTimes["feed"] = count * self.timing.feedStep
+
+    def moveWheel(self, target):
+        # Takes the shortest way round, as SortWheel::moveTo does.
+        steps = abs(target - self.wheelPosition)
+        steps = min(steps, cupCount - steps)
+
+        self.wheelPosition = target
+        self.sortMotionInProcess = True
+        self.wheelDoneAt = self.clock + steps * self.timing.wheelStep
+        self.phaseTimes["wheel"] = steps * self.timing.wheelStep
+
+    def startWheel(self, target):
+        # A wheel move made by the state machine, sorting or parking, which may be one set to jam.
+        self.moveWheel(target)
+        self.sortMoves += 1
+        if (self.sortMoves in self.wheelJams):
+            self.jam("wheel")
+
+    def jam(self, motion):
+        # Stops the motion that just started from ever finishing.
+        self.jams += 1
+        if (motion == "feed"):
+            self.feedDoneAt = math.inf
+        else:
+            self.wheelDoneAt = math.inf
+
+    def load(self, seq):
+        self.feed[0] = seq
+        self.parts[0] = self.population()
+
+    def measureResistor(self, value):
+        # Returns (measurement, samples) for a part, taking as long as the mainboard would. The contacts are left
+        # down, as on the mainboard.
+        self.delay(self.timing.contactTime)
+        self.phaseTimes["contact"] = self.timing.contactTime
+        rangingStart = self.clock
+
+        target = bestRange(value)
+        if (self.adaptiveRanging or self.hintRange != 0):
+            start = self.lastRange or self.hintRange or self.expectedRange()
+            step = 1 if target > start else -1
+            tried = list(range(start, target + step, step))
+        else:
+            tried = sorted(rangeMidpoints)
+
+        samples = 0
+        for r in tried:
+            self.delay(self.timing.relaySettle)
+
+            # Good readings near the right range. Out of range it gives up after maxAttempts, or straight away with
+            # sequential sampling.
+            if (abs(r - target) <= 1 and value > 0):
+                count = self.readingsNeeded(value, r)
+            else:
+                count = seqMinSamples if self.seqTolerance > 0 else maxAttempts
+            samples += count
+            self.delay(count * self.timing.sampleTime)
+
+        self.lastRange = target
+        self.phaseTimes["ranging"] = self.clock - rangingStart
+
+        # What the circuit reads, converted back with whatever calibration the mainboard holds.
+        self.lastReading = self.hardware.adcReading(value, target) if value > 0 else 0.0
+        value = self.getResistance(self.lastReading, target)
+
+        if (value <= 0.5 or value >= maxAccepted):
+            value = 0.0
+            self.lastReading = 0.0
+
+        return(value, samples)
+
+    def readingsNeeded(self, value, rangeNumber):
+        # How many readings readRange() takes for a part it can measure on this range.
+        if (self.seqTolerance <= 0):
+            return(goodTarget)
+
+        # Readings until the standard error, as a fraction of the resistance, is within tolerance (relativeError()).
+        counts = self.hardware.counts(value, rangeNumber)
+        if (counts <= 0 or counts >= maxAnalog):
+            return(maxAttempts)
+
+        if (rangeNumber <= 6):
+            spread = sampleNoise * maxAnalog / (counts * (maxAnalog - counts))
+        else:
+            spread = sampleNoise / counts
+
+        needed = int(math.ceil((spread * 100.0 / self.seqTolerance) ** 2))
+        return(max(seqMinSamples, min(needed, maxAttempts)))
+
+    def getResistance(self, counts, rangeNumber):
+        # getResistance() on the mainboard.
+        if (counts < adcCutoffs[0] or counts > adcCutoffs[1]):
+            return(0.0)
+
+        if (rangeNumber <= 6):
+            result = self.calValues[rangeNumber - 1] * counts / (maxAnalog - counts)
+        else:
+            result = counts * avLow / maxAnalog / self.calValues[rangeNumber - 1]
+
+        return(result + self.calOffsets[rangeNumber - 1])
+
+    def expectedRange(self):
+        # The range for the first accepting cup's nominal, as expectedRange() on the mainboard.
+        for c in range(cupCount):
+            if not self.cupTable.rejects[c]:
+                return(bestRange((self.cupTable.mins[c] + self.cupTable.maxs[c]) / 2.0))
+
+        return(min(rangeMidpoints))
+
+    def targetCup(self, value):
+        # getTargetCup(). Before any setup command every part goes to cup 1.
+        cups = self.cupTable.assign([value])
+        if (cups is None):
+            return(1)
+
+        return(int(cups[0]))
+
+    # State machine
+
+    def loadPending(self):
+        if (len(self.pending) == 0 or self.feedInProcess or self.feed[0] is not None):
+            return(False)
+
+        self.loadedSeq = self.pending.popleft()
+        self.load(self.loadedSeq)
+        self.rdyOwed = True
+
+        return(True)
+
+    def queueNext(self, seq):
+        if (len(self.pending) >= self.pipeWindow):
+            self.reply("ERR", ["Pipeline Full"])
+            return
+
+        self.pending.append(seq)
+        self.reply("ACK", [str(seq)])
+
+    def sendReady(self, seq=None):
+        self.reply("RDY", [str(seq)] if seq is not None else [])
+
+    def handleSetup(self, thisCmd):
+        # Commands accepted while waiting for SRT.
+        try:
+            isCupSetup = self.cupTable.apply(thisCmd.cmd, thisCmd.args)
+        except (ValueError, IndexError):
+            isCupSetup = True
+
+        if isCupSetup:
+            self.reply("ACK")
+
+        elif (thisCmd.cmd == "DIV"):
+            self.reply("ACK")
+
+        elif (thisCmd.cmd == "ARG"):
+            self.adaptiveRanging = (toInt(thisCmd.args[0]) != 0)
+            self.lastRange = 0
+            self.reply("ACK")
+
+        elif (thisCmd.cmd == "HNT"):
+            value = toFloat(thisCmd.args[0]) if len(thisCmd.args) > 0 else 0.0
+            self.hintRange = bestRange(value) if value > 0 else 0
+            self.lastRange = 0
+            self.reply("ACK")
+
+        elif (thisCmd.cmd == "SEQ"):
+            self.seqTolerance = max(0.0, toFloat(thisCmd.args[0])) if len(thisCmd.args) > 0 else 0.0
+            self.continuousAdc = (len(thisCmd.args) > 1 and toInt(thisCmd.args[1]) != 0)
+            self.reply("ACK")
+
+        elif (thisCmd.cmd == "CAL"):
+            if (len(thisCmd.args) >= 2):
+                rangeNumber = toInt(thisCmd.args[0])
+                value = toFloat(thisCmd.args[1])
+
+                if (rangeNumber >= 1 and rangeNumber <= len(self.calValues) and value > 0):
+                    self.calValues[rangeNumber - 1] = value
+                    self.calOffsets[rangeNumber - 1] = toFloat(thisCmd.args[2]) if len(thisCmd.args) >= 3 else 0.0
+            else:
+                self.calValues = list(compiledCalibration)
+                self.calOffsets = [0.0] * len(compiledCalibration)
+
+            self.reply("ACK")
+
+        elif (thisCmd.cmd == "TLM"):
+            self.telemetry = (toInt(thisCmd.args[0]) != 0)
+            self.reply("ACK")
+
+        elif (thisCmd.cmd == "PIP"):
+            self.pipeWindow = max(0, min(toInt(thisCmd.args[0]), 8))
+            self.pending.clear()
+            self.reply("ACK")
+
+        elif (thisCmd.cmd == "BIN"):
+            # Acknowledge in ASCII, then switch both directions to binary frames.
+            self.reply("ACK")
+            self.binaryLink = BinaryProtocol.BinaryEncoder()
+            self.decoder = BinaryProtocol.BinaryFrameDecoder()
+
+    def step(self, thisCmd):
+        # One pass of loop().
+        cmd = thisCmd.cmd if thisCmd is not None else ""
+
+        if (self.cState == 0):
+            if (cmd == "SRT"):
+                self.cState = 1
+                self.sendReady()
+            elif (thisCmd is not None):
+                self.handleSetup(thisCmd)
+            return
+
+        if (self.pipeWindow > 0):
+            if (cmd == "NXT"):
+                self.queueNext(toInt(thisCmd.args[0]) if thisCmd.args else 0)
+                cmd = ""
+            elif (cmd == "END"):
+                self.feedToEnd = True
+                if (self.cState == 1):
+                    self.cState = 2
+                self.reply("ACK")
+                cmd = ""
+
+        if (self.cState == 1):
+            if self.loadPending():
+                self.cState = 2
+                return
+
+            # A queued part waits for a feed motion (from CFD) to finish.
+            if (len(self.pending) > 0 and self.feedInProcess):
+                self.waitUntil(self.feedDoneAt)
+
+            if (cmd == "NXT"):
+                if self.feedInProcess:
+                    self.reply("ERR", ["Feed In Process"])
+                elif (self.feed[0] is not None):
+                    self.reply("ERR", ["Load Platform Not Empty"])
+                else:
+                    self.load(0)
+                    self.cState = 2
+                    self.reply("ACK")
+
+            elif (cmd == "END"):
+                self.feedToEnd = True
+                self.cState = 2
+                self.reply("ACK")
+
+        elif (self.cState == 2):
+            if (self.feed[0] is None):
+                if self.feedInProcess:
+                    self.waitUntil(self.feedDoneAt)
+                    return
+
+                if (self.pipeWindow > 0):
+                    if self.rdyOwed:
+                        self.rdyOwed = False
+                        self.sendReady(self.loadedSeq)
+
+                    if self.loadPending():
+                        return
+
+                if not self.feedToEnd:
+                    self.cState = 1
+                    if (self.pipeWindow == 0):
+                        self.sendReady()
+                    return
+
+            if (self.feed[feedPositions - 1] is not None):
+                self.cState = 3
+            elif all(position is None for position in self.feed):
+                if self.feedToEnd:
+                    self.cState = 0
+                    self.feedToEnd = False
+                    self.pipeWindow = 0
+                    self.pending.clear()
+                    self.lastRange = 0
+                    self.hintRange = 0
+                    self.reply("DON")
+                else:
+                    self.cState = 1
+                    self.sendReady()
+            else:
+                self.cycleFeed(1)
+                self.feedCycles += 1
+                if (self.feedCycles in self.feedJams or (self.jamEvery > 0 and self.feedCycles % self.jamEvery == 0)):
+                    self.jam("feed")
+
+        elif (self.cState == 3):
+            if (self.feed[feedPositions - 1] is not None):
+                if (self.held is None):
+                    value, samples = self.measureResistor(self.parts[feedPositions - 1])
+                    self.held = (value, samples, self.targetCup(value))
+
+                # A parking move may still be finishing. loop() goes round again until it has, reading commands.
+                if self.sortMotionInProcess:
+                    self.waitUntil(self.wheelDoneAt)
+                    return
+
+                value, samples, cup = self.held
+                self.held = None
+
+                # The wheel starts moving before the contacts lift, so the two overlap.
+                self.startWheel(cup)
+                self.reply("MES", [str(cup), "{:.4f}".format(value), str(self.feed[feedPositions - 1]), str(self.lastRange), str(samples),
+                                   "{:.2f}".format(self.lastReading)])
+                self.measured += 1
+
+                self.delay(self.timing.contactTime)
+                self.phaseTimes["release"] = self.timing.contactTime
+                self.cState = 4
+            else:
+                # A CFD may have moved the measured part on while the wheel was awaited.
+                self.held = None
+                self.cState = 4 if self.sortMotionInProcess else 2
+
+        elif (self.cState == 4):
+            if self.sortMotionInProcess:
+                self.waitUntil(self.wheelDoneAt)
+                return
+
+            dispensedSeq = self.feed[feedPositions - 1]
+            self.delay(self.timing.swingTime)
+            self.feed[feedPositions - 1] = None
+            self.parts.pop(feedPositions - 1, None)
+            self.delay(self.timing.swingTime)
+            self.phaseTimes["swing"] = 2 * self.timing.swingTime
+            self.cState = 2
+
+            if self.telemetry:
+                micros = [str(int(self.phaseTimes[phase] * 1000)) for phase in PhaseProfile.phases]
+                self.reply("PHS", [str(dispensedSeq)] + micros)
+
+            if (self.parkCup > 0 and self.parkCup != self.wheelPosition):
+                self.startWheel(self.parkCup)
+            self.parkCup = 0
+
+    def idle(self):
+        # True when loop() would only be waiting for the host.
+        if (len(self.commands) > 0):
+            return(False)
+
+        return(self.halted or self.cState == 0 or (self.cState == 1 and len(self.pending) == 0))
+
+    def run(self):
+        while (not self.closed):
+            if not self.poll(None if self.idle() else 0):
+                break
+
+            self.updateMotions()
+
+            if self.halted:
+                self.commands.clear()
+                continue
+
+            self.step(self.commands.popleft() if len(self.commands) > 0 else None)
+
+    def close(self):
+        # Closes both ends of the pty, which also ends the thread.
+        self.closed = True
+        os.close(self.slave)
+        os.close(self.master)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a simulated mainboard on a pty")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="wall seconds per simulated second (0 = no delays)")
+    parser.add_argument("--population", choices=["e12", "e24", "wide"], default="e24", help="what the simulated bag holds")
+    parser.add_argument("--seed", type=int, help="random seed")
+    parser.add_argument("--calibration-error", type=float, default=0.0, help="percent the real circuit is off its compiled calibration")
+    parser.add_argument("--contact", type=float, default=0.0, help="contact resistance in ohms")
+    parser.add_argument("--jam-every", type=int, default=0, help="jam every this many feed cycles, until the host clears it")
+    parser.add_argument("--legacy-framing", action="store_true", help="read ASCII frames as firmware from before pipelining did")
+    options = parser.parse_args()
+
+    if (options.population != "wide" and ESeries is None):
+        parser.error("--population {} needs numpy. Use --population wide.".format(options.population))
+
+    if (options.population == "wide"):
+        population = logUniformPopulation(1.0, 1000000.0, options.seed)
+    else:
+        name = options.population.upper()
+        population = seriesPopulation(ESeries.buildSeries(name, 1, 5), 10 if name == "E12" else 5, seed=options.seed)
+
+    hardware = Hardware(options.calibration_error, options.contact, 0.3 if options.calibration_error > 0 else 0.0, options.seed)
+    fake = FakeTeensy(population, timeScale=options.time_scale, hardware=hardware, jamEvery=options.jam_every,
+                      legacyFraming=options.legacy_framing)
+    fake.start()
+    print("Simulated mainboard on {}. Press Ctrl+C to stop.".format(fake.path))
+
+    try:
+        while fake.is_alive():
+            fake.join(1.0)
+    except KeyboardInterrupt:
+        pass
+
+    print("\n{} parts measured in {:.1f} simulated seconds, {} jams.".format(fake.measured, fake.clock / 1000.0, fake.jams))
+    print("{} frames arrived with another already waiting.".format(fake.asciiSerial.stacked))
+    fake.close()
+
+if __name__ == "__main__":
+    main()
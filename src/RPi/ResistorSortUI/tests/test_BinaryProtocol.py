@@ -0,0 +1,108 @@
+import struct
+import pytest
+import BinaryProtocol
+import SorterProtocol
+
+def roundTrip(cmd, args):
+    encoder = BinaryProtocol.BinaryEncoder()
+    decoder = BinaryProtocol.BinaryFrameDecoder()
+    frame = encoder.encode(cmd, args)
+
+    assert frame.endswith(b"\x00")
+    assert b"\x00" not in frame[:-1]
+
+    commands = decoder.feed(frame)
+    assert len(commands) == 1
+    assert commands[0].cmd == cmd
+    return(commands[0].args)
+
+def test_crc16_check_value():
+    # The standard check value for CRC-16/CCITT-FALSE.
+    assert BinaryProtocol.crc16(b"123456789") == 0x29B1
+
+@pytest.mark.parametrize("data", [b"", b"\x00", b"\x00\x00", b"\x11\x22\x00\x33", bytes(range(1, 255)), bytes(range(256)) * 3])
+def test_cobs_round_trip(data):
+    encoded = BinaryProtocol.cobsEncode(data)
+    assert b"\x00" not in encoded
+    assert BinaryProtocol.cobsDecode(encoded) == data
+
+def test_cobs_rejects_bad_block():
+    with pytest.raises(ValueError):
+        BinaryProtocol.cobsDecode(b"\x05\x01")
+
+def test_sequence_numbers_use_the_compact_layout():
+    fmt, body = BinaryProtocol.packArgs("NXT", ["12"])
+    assert (fmt, len(body)) == (BinaryProtocol.fmtFixed, 2)
+    assert roundTrip("NXT", ["12"]) == ["12"]
+
+    # Past 16 bits the wide layout takes over.
+    fmt, body = BinaryProtocol.packArgs("RDY", ["70000"])
+    assert (fmt, len(body)) == (BinaryProtocol.fmtFixed, 4)
+    assert roundTrip("RDY", ["70000"]) == ["70000"]
+
+def test_mes_round_trip():
+    args = roundTrip("MES", ["3", "4700.5", "12", "4", "31", "2047.25"])
+    assert args[0] == "3"
+    assert float(args[1]) == pytest.approx(4700.5)
+    assert args[2:5] == ["12", "4", "31"]
+    assert float(args[5]) == 2047.25
+
+    fmt, body = BinaryProtocol.packArgs("MES", ["3", "4700.5", "12", "4", "31", "2047.25"])
+    assert len(body) == 12
+
+def test_mes_wide_layout():
+    args = roundTrip("MES", ["3", "4700.5", "100000", "4", "31", "2047.25"])
+    assert args[2] == "100000"
+    assert float(args[5]) == pytest.approx(2047.25)
+
+def test_mes_is_smaller_than_ascii():
+    args = ["3", "4700.0000", "12", "4", "31", "2047.25"]
+    binary = BinaryProtocol.BinaryEncoder().encode("MES", args)
+    ascii = SorterProtocol.encodeCmd("MES", args, terminate=True)
+    assert len(binary) < len(ascii)
+
+def test_setup_layouts_round_trip():
+    args = roundTrip("SSR", ["5", "100", "220", "470", "1000", "2200", "4700", "10000", "22000", "47000"])
+    assert args[0] == "5"
+    assert [float(arg) for arg in args[1:]] == [100, 220, 470, 1000, 2200, 4700, 10000, 22000, 47000]
+
+    args = roundTrip("CUP", ["10", "0", "0", "1"])
+    assert args[0] == "10" and args[3] == "1"
+
+    assert roundTrip("PHS", ["1", "250000", "450000", "150000", "450000", "360000", "800000"]) == ["1", "250000", "450000", "150000", "450000", "360000", "800000"]
+
+def test_text_fallback():
+    # Blank SSR nominals don't fit the fixed layout.
+    args = ["5", "100", "", "", "", "", "", "", "", ""]
+    assert BinaryProtocol.packArgs("SSR", args)[0] == BinaryProtocol.fmtText
+    assert roundTrip("SSR", args) == args
+
+    assert roundTrip("ERR", ["Pipeline Full"]) == ["Pipeline Full"]
+    assert roundTrip("END", []) == []
+
+def test_corrupt_frame_is_dropped():
+    encoder = BinaryProtocol.BinaryEncoder()
+    decoder = BinaryProtocol.BinaryFrameDecoder()
+
+    bad = bytearray(encoder.encode("ACK", ["1"]))
+    bad[3] ^= 0x40
+    good = encoder.encode("ACK", ["2"])
+
+    commands = decoder.feed(bytes(bad) + good)
+    assert [thisCmd.args for thisCmd in commands] == [["2"]]
+    assert decoder.crcErrors == 1
+
+def test_lost_frames_are_counted():
+    encoder = BinaryProtocol.BinaryEncoder()
+    decoder = BinaryProtocol.BinaryFrameDecoder()
+
+    frames = [encoder.encode("NXT", [str(seq)]) for seq in range(1, 5)]
+    decoder.feed(frames[0] + frames[3])
+    assert decoder.lostFrames == 2
+
+def test_unknown_layout_size_is_dropped():
+    decoder = BinaryProtocol.BinaryFrameDecoder()
+    payload = bytes([0]) + b"MES" + bytes([BinaryProtocol.fmtFixed]) + b"\x01\x02\x03"
+    payload += struct.pack(">H", BinaryProtocol.crc16(payload))
+
+    assert decoder.feed(BinaryProtocol.cobsEncode(payload) + b"\x00") == []
@@ -0,0 +1,64 @@
+import asyncio
+import numpy as np
+import pytest
+import Calibrate
+import SorterClient
+import TeensySim
+
+# Two or more references on each of ranges 3-7, as in the usage line of Calibrate.py.
+references = [47000.0, 100000.0, 220000.0, 4700.0, 10000.0, 22000.0, 470.0, 1000.0, 2200.0, 47.0, 100.0, 220.0, 4.7, 10.0]
+repeats = 3
+
+def calibrateSimulated(hardware):
+    # Runs the calibration against a simulated mainboard with the given circuit. Returns (fits, points after CAL).
+    fake = TeensySim.FakeTeensy(TeensySim.cycleValues(np.repeat(references, repeats)), hardware=hardware)
+    fake.start()
+
+    async def session():
+        client = await SorterClient.openSorter(fake.path)
+        await client.request("RDY", timeout=5.0)
+
+        points = await Calibrate.measureReferences(client, references, repeats, timeout=5.0)
+        fits = Calibrate.fitCalibration(points)
+        for cmd, args in Calibrate.calCommands({r: (fit.value, fit.offset) for r, fit in fits.items()}):
+            await client.request(cmd, args, timeout=5.0)
+
+        verified = await Calibrate.measureReferences(client, references, repeats, timeout=5.0)
+        client.close()
+        return(fits, verified)
+
+    try:
+        return(asyncio.run(session()))
+    finally:
+        fake.close()
+
+def test_fit_recovers_the_circuit():
+    hardware = TeensySim.Hardware(error=2.0, contactResistance=0.05, noise=0.3, seed=1)
+    fits, verified = calibrateSimulated(hardware)
+
+    assert sorted(fits) == [3, 4, 5, 6, 7]
+    assert sum(fit.count for fit in fits.values()) == len(references) * repeats
+
+    for measureRange, fit in fits.items():
+        assert fit.value == pytest.approx(hardware.values[measureRange - 1], rel=1e-3)
+        assert np.abs(fit.after).max() < np.abs(fit.before).max()
+
+    # The offset takes the contact resistance back off, where it is large enough to see.
+    assert fits[7].offset == pytest.approx(-hardware.contactResistance, abs=0.01)
+
+    errors = Calibrate.percentErrors([point.reported for point in verified], [point.actual for point in verified])
+    assert np.abs(errors).max() < 0.1
+
+def test_noiseless_fit_is_exact():
+    # Without noise the model is exact, so every constant comes back to rounding.
+    hardware = TeensySim.Hardware(error=3.0, seed=7)
+    byRange = {r: [] for r in range(3, 8)}
+    for value in references:
+        measureRange = TeensySim.bestRange(value)
+        byRange[measureRange].append((hardware.adcReading(value, measureRange), value))
+
+    for measureRange, readings in byRange.items():
+        adc, actual = zip(*readings)
+        value, offset = Calibrate.fitRange(measureRange, adc, actual)
+        assert value == pytest.approx(hardware.values[measureRange - 1], rel=1e-9)
+        assert offset == pytest.approx(0.0, abs=1e-6 * min(actual))
@@ -0,0 +1,77 @@
+import statistics
+import pytest
+import DriftMonitor
+from SorterProtocol import Command
+
+def mes(value, cup=4, measureRange=5):
+    return(Command("MES", [str(cup), "{:.4f}".format(value), "0", str(measureRange), "10"]))
+
+def feed(monitor, values):
+    # Adds each reading. Returns the alerts, by reading index.
+    alerts = {}
+    for i, value in enumerate(values):
+        messages = monitor.add(mes(value))
+        if messages:
+            alerts[i] = messages
+
+    return(alerts)
+
+def test_running_stats_match_statistics():
+    values = [4700.0, 4712.5, 4689.1, 4701.0, 4695.5]
+    stats = DriftMonitor.RunningStats()
+    for value in values:
+        stats.add(value)
+
+    assert stats.mean == pytest.approx(statistics.mean(values))
+    assert stats.stdDev() == pytest.approx(statistics.stdev(values))
+    assert (stats.low, stats.high) == (min(values), max(values))
+
+def test_shifted_reference_alerts_then_clears():
+    monitor = DriftMonitor.DriftMonitor([1000])
+    reference = monitor.references[0]
+
+    assert feed(monitor, [1000.0] * 10) == {}
+
+    # 1% high. The average follows within a few readings and alerts once.
+    alerts = feed(monitor, [1010.0] * 20)
+    assert list(alerts) == [3]
+    assert alerts[3][0].startswith("Reference 1000 on range 5 reads +0.59% off")
+    assert reference.alerted
+    assert monitor.alerts == 1
+
+    # Back on value: the alert clears once the drift is well inside tolerance, without a second alert.
+    cleared = None
+    for i in range(20):
+        assert monitor.add(mes(1000.0)) == []
+        if (cleared is None and not reference.alerted):
+            cleared = i
+
+    assert cleared is not None and cleared < 10
+    assert abs(reference.drift) < monitor.tolerancePercent / 2
+    assert monitor.alerts == 1
+
+def test_noisy_reference_alerts():
+    monitor = DriftMonitor.DriftMonitor([1000])
+    alerts = feed(monitor, [990.0, 1010.0] * 10)
+
+    assert len(alerts) == 1
+    assert "is noisy" in list(alerts.values())[0][0]
+
+def test_too_few_readings_never_alert():
+    monitor = DriftMonitor.DriftMonitor([1000], minSamples=5)
+    assert feed(monitor, [1020.0] * 4) == {}
+    assert feed(monitor, [1020.0]) != {}
+
+def test_other_parts_only_update_cup_and_range_statistics():
+    monitor = DriftMonitor.DriftMonitor([1000])
+    assert feed(monitor, [4700.0, 0.0, 5100.0]) == {}
+
+    assert monitor.references[0].error.count == 0
+    assert monitor.cups[4].count == 2
+    assert monitor.ranges[5].mean == pytest.approx(4900.0)
+
+def test_monitors_do_not_share_references():
+    first = DriftMonitor.DriftMonitor()
+    first.references.append(DriftMonitor.Reference(1000.0, 0.2))
+
+    assert DriftMonitor.DriftMonitor().references == []
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+import ESeries
+import TeensySim
+
+def test_series_tables():
+    assert len(ESeries.series["E24"]) == 24 * 7
+    assert ESeries.series["E12"][0] == pytest.approx(1.0)
+    assert ESeries.series["E96"][-1] == pytest.approx(9.76e6)
+
+def test_snap_is_by_ratio():
+    # Between 4.3k and 4.7k the boundary is their geometric mean, about 4496, not the midpoint 4500.
+    nominals, indices = ESeries.snap([4490.0, 4497.0, 0.0, 1e9])
+    assert list(nominals) == pytest.approx([4300.0, 4700.0, 1.0, 9.1e6])
+    assert list(ESeries.series["E24"][indices]) == list(nominals)
+
+def test_within_tolerance():
+    # 2% uses E24, and its bands leave gaps between neighbours.
+    nominals, inBand = ESeries.withinTolerance([4700.0, 4890.0, 1015.0], 2)
+    assert list(nominals) == pytest.approx([4700.0, 4700.0, 1000.0])
+    assert list(inBand) == [True, False, True]
+
+# Each setup, some readings and the cup getTargetCup() picks for each: the first non-reject cup whose range holds
+# the reading, else the first reject cup, else -1.
+cases = [
+    # MAJ 5: one decade per cup, 0.95 to 9.555 times the decade, cups 7-10 reject. 9.5 is in both cup 1 and cup 2.
+    ([("MAJ", ["5"])],
+     [1.0, 9.5, 9.6, 104.0, 4700.0, 47000.0, 900000.0, 5e6, 0.0],
+     [1, 1, 2, 3, 4, 5, 6, 7, 7]),
+    # SGL: cup 1 holds the nominal's band, everything else goes to cup 2.
+    ([("SGL", ["5", "4700"])],
+     [4465.0, 4700.0, 4935.0, 4940.0, 0.0],
+     [1, 1, 1, 2, 2]),
+    # SSR with overlapping bands and blank cups: 101 fits cups 1 and 2, strays go to the first blank cup.
+    ([("SSR", ["5", "100", "102", "", "", "", "", "", "", ""])],
+     [101.0, 106.0, 500.0, 0.0],
+     [1, 2, 3, 3]),
+    # A short Range Sort pass: SSR, then CUP makes the unused cups empty rather than reject, leaving only cup 10.
+    ([("SSR", ["5", "100", "220", "", "", "", "", "", "", ""]), ("CUP", ["3", "1", "0", "0"])] +
+     [("CUP", [str(cup), "1", "0", "0"]) for cup in range(4, 10)] + [("CUP", ["10", "0", "0", "1"])],
+     [100.0, 220.0, 500.0, 0.0],
+     [1, 2, 10, 10]),
+    # OHM accepts everything in cup 1 and has no reject cup, so a reading beyond every range has nowhere to go.
+    ([("OHM", [])],
+     [0.0, 4700.0, 2e9],
+     [1, 1, -1]),
+]
+
+@pytest.mark.parametrize("commands, readings, expected", cases)
+def test_cup_tables_agree_with_first_match(commands, readings, expected):
+    vectorized = ESeries.CupTable()
+    plain = TeensySim.PlainCupTable()
+    for cmd, args in commands:
+        assert vectorized.apply(cmd, args)
+        plain.apply(cmd, args)
+
+    assert list(vectorized.assign(readings)) == expected
+    assert plain.assign(readings) == expected
+
+    # assignCups() on its own, with the table's arrays.
+    assert list(ESeries.assignCups(np.array(readings), vectorized.mins, vectorized.maxs, vectorized.rejects)) == expected
+
+def test_unconfigured_table_assigns_nothing():
+    table = ESeries.CupTable()
+    assert not table.apply("PIP", ["2"])
+    assert table.assign([100.0]) is None
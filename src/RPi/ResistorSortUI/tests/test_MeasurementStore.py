@@ -0,0 +1,44 @@
+import pytest
+import MeasurementStore
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / "measurements.db")
+
+    store = MeasurementStore.MeasurementStore(path, "20170402-140210")
+    store.add("SSR", ["4", "4700.1234", "17", "5", "12"])
+    store.add("SSR", ["10", "0.0"])
+    store.add("MAJ", ["2", "220.5", "3"], session="other")
+    store.add("QCR", ["1", "4650", "x", "4", ""])
+    store.close()
+    assert store.dropped == 0
+
+    reader = MeasurementStore.MeasurementReader(path)
+    yield reader
+    reader.close()
+
+def test_rows_round_trip(database):
+    rows = list(database.query())
+    assert [row[1:] for row in rows] == [
+        ("20170402-140210", "SSR", 10, 0.0, None, None, None),
+        ("other", "MAJ", 2, 220.5, None, None, 3),
+        ("20170402-140210", "QCR", 1, 4650.0, 4, None, None),
+        ("20170402-140210", "SSR", 4, 4700.1234, 5, 12, 17),
+    ]
+    assert all(row[0] > 0 for row in rows)
+
+def test_filters(database):
+    assert [row[4] for row in database.query(4600, 4800)] == [4650.0, 4700.1234]
+    assert [row[4] for row in database.query(mode="SSR")] == [0.0, 4700.1234]
+    assert [row[2] for row in database.query(session="other")] == ["MAJ"]
+    assert list(database.resistances(cup=4, session="20170402-140210")) == [4700.1234]
+
+def test_summary_and_sessions(database):
+    stats = database.summary(minValue=1000)
+    assert stats["count"] == 2
+    assert stats["mean"] == pytest.approx((4650 + 4700.1234) / 2)
+    assert stats["stdDev"] == pytest.approx(abs(4700.1234 - 4650) / 2 ** 0.5)
+    assert stats["cups"] == {1: 1, 4: 1}
+
+    sessions = {(session, mode): count for session, mode, count, first, last in database.sessions()}
+    assert sessions == {("20170402-140210", "SSR"): 2, ("20170402-140210", "QCR"): 1, ("other", "MAJ"): 1}
@@ -0,0 +1,71 @@
+import math
+import pytest
+import QualityCheck
+
+def partsUntilDecided(lot, values):
+    for count, value in enumerate(values, 1):
+        decision = lot.add(value)
+        if (decision is not None):
+            return(count, decision)
+
+    return(None, None)
+
+def test_good_lot_is_accepted():
+    lot = QualityCheck.QualityCheck(1000, 5)
+
+    # Each good part moves the ratio by log(0.95 / 0.99), towards the accept bound of log(0.1 / 0.95).
+    expected = math.ceil(lot.acceptBound / lot.passStep)
+    assert partsUntilDecided(lot, [1000.0] * 100) == (expected, "accept")
+    assert lot.decidedAt == expected
+
+def test_bad_lot_is_rejected_early():
+    lot = QualityCheck.QualityCheck(1000, 5)
+    assert partsUntilDecided(lot, [1100.0] * 100) == (2, "reject")
+
+def test_occasional_defect_is_still_accepted():
+    lot = QualityCheck.QualityCheck(1000, 5)
+    values = ([1000.0] * 49 + [900.0]) * 4
+
+    count, decision = partsUntilDecided(lot, values)
+    assert decision == "accept"
+
+def test_decision_stands_but_statistics_keep_counting():
+    lot = QualityCheck.QualityCheck(1000, 5)
+    partsUntilDecided(lot, [1100.0, 1100.0])
+    assert lot.decision == "reject"
+
+    for i in range(100):
+        assert lot.add(1000.0) is None
+
+    assert lot.decision == "reject"
+    assert lot.decidedAt == 2
+    assert lot.count == 102
+    assert lot.passed == 100
+
+def test_no_reading_is_a_defect():
+    lot = QualityCheck.QualityCheck(1000, 5)
+
+    assert lot.add(1000.0) is None
+    assert lot.add(0.0) is None
+    assert lot.add(0.0) == "reject"
+
+    assert lot.count == 3
+    assert lot.unreadable == 2
+    assert lot.yieldPercent() == pytest.approx(100.0 / 3)
+
+def test_no_reading_stays_out_of_mean_and_spread():
+    lot = QualityCheck.QualityCheck(100, 5)
+    for value in [99.0, 0.0, 101.0, 0.0]:
+        lot.add(value)
+
+    assert lot.mean == pytest.approx(100.0)
+    assert lot.stdDev() == pytest.approx(math.sqrt(2.0))
+    assert lot.cpk() == pytest.approx(5.0 / (3.0 * math.sqrt(2.0)))
+
+def test_report_with_no_readings():
+    lot = QualityCheck.QualityCheck(100, 5)
+    lot.add(0.0)
+
+    report = lot.report()
+    assert "0.00% (0 in tolerance, 1 with no reading)" in report
+    assert "Mean:   -" in report
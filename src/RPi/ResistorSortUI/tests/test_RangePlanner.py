@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+import ESeries
+import RangePlanner
+import ResistorSorter
+
+def test_plan_without_history_is_ascending():
+    plan = RangePlanner.planRange(100, 1000, 5)
+
+    targets = [nominal for sortPass in plan.passes for nominal in sortPass.targets()]
+    assert targets == sorted(targets)
+    assert len(targets) == 25
+    assert [len(sortPass.targets()) for sortPass in plan.passes] == [9, 9, 7]
+
+def test_plan_puts_common_values_first():
+    # 470 is the most common value, then 1k; 150 and 680 turn up once each. 588.5 and 863 fall in the gaps between
+    # neighbouring 5% bands, and 5000 is out of range, so those three match nothing.
+    readings = [470] * 20 + [1000] * 10 + [150, 680] + [588.5, 863, 5000]
+    plan = RangePlanner.planRange(100, 1000, 5, readings)
+
+    first = plan.passes[0]
+    assert 470 in first.targets() and 1000 in first.targets()
+    assert first.expected == 32
+    assert first.fed == len(readings)
+    assert plan.strays == 3
+
+def test_full_pass_uses_ssr():
+    plan = RangePlanner.planRange(100, 220, 5)
+    assert len(plan.passes) == 1
+
+    commands = plan.passes[0].commands()
+    assert [cmd for cmd, args in commands] == ["SSR"]
+    assert "" not in commands[0][1]
+
+def test_short_pass_routes_strays_to_cup_10():
+    plan = RangePlanner.planRange(100, 1000, 5)
+    short = plan.passes[-1]
+    assert not short.full()
+
+    table = ESeries.CupTable()
+    commands = short.commands()
+    assert [cmd for cmd, args in commands] == ["SSR"] + ["CUP"] * 10
+    for cmd, args in commands:
+        table.apply(cmd, args)
+
+    # Only cup 10 is a reject, so strays and unreadable parts go there rather than to an unused cup.
+    assert list(np.flatnonzero(table.rejects) + 1) == [10]
+    assert list(table.assign([560, 12345, 0.0])) == [1, 10, 10]
+
+def test_replan_from_rejects():
+    plan = RangePlanner.planRange(100, 1000, 5)
+
+    # After the first pass, cup 10 held only 470s, 820s and a part nothing matches.
+    rejects = RangePlanner.RejectCache()
+    for value in [470] * 6 + [820] * 2 + [5000]:
+        rejects.add(value)
+    rejects.add(0.0)
+
+    replanned = RangePlanner.replan(plan, 1, rejects)
+
+    assert replanned.passes[0] is plan.passes[0]
+    assert len(replanned.passes) == 2
+    second = replanned.passes[1]
+    assert second.number == 2
+    assert second.targets() == [470, 820]
+    assert second.fed == 10
+    assert second.expected == 8
+    assert replanned.strays == 2
+    assert second.hint == pytest.approx(np.exp(np.median(np.log([470] * 6 + [820] * 2 + [5000]))))
+    assert [cmd for cmd, args in second.commands()] == ["SSR"] + ["CUP"] * 10 + ["HNT"]
+
+def test_only_the_refed_cup_is_cached(monkeypatch):
+    # A short pass's unused cups and any extra reject cups aren't reloaded, so only cup 10 describes the next pass.
+    rejects = RangePlanner.RejectCache()
+    monkeypatch.setattr(ResistorSorter, "rejectCache", rejects)
+
+    for cup, value in [(1, "470"), (9, "5000"), (10, "820"), (10, "0.0")]:
+        ResistorSorter.cacheReject(ResistorSorter.Command("MES", [str(cup), value]))
+
+    assert rejects.values == [820.0]
+    assert rejects.unreadable == 1
+    assert rejects.count() == 2
+
+def test_parse_resistance():
+    assert RangePlanner.parseResistance("4k7") == 4700
+    assert RangePlanner.parseResistance("4.7k") == 4700
+    assert RangePlanner.parseResistance("1M") == 1e6
+    assert RangePlanner.parseResistance("220") == 220
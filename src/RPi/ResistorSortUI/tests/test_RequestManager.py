@@ -0,0 +1,189 @@
+import collections
+import types
+import pytest
+import RequestManager
+from SorterProtocol import Command
+
+class Link:
+    """Replies queued by the test, sends recorded, and a clock that only moves while fetch waits."""
+
+    def __init__(self, monkeypatch):
+        self.clock = 0.0
+        self.frames = collections.deque()
+        self.transmitted = []
+        self.unexpected = []
+        self.handled = []
+        monkeypatch.setattr(RequestManager, "time", types.SimpleNamespace(monotonic=lambda: self.clock))
+
+    def fetch(self, timeout):
+        if (len(self.frames) > 0):
+            return(self.frames.popleft())
+
+        assert timeout is not None, "would wait for ever"
+        self.clock += timeout + 1e-6
+        return(None)
+
+    def transmit(self, cmd, args):
+        self.transmitted.append((cmd, list(args)))
+
+    def manager(self, **kwargs):
+        handlers = {cmd: self.handled.append for cmd in ["MES", "ERR", "LOS"]}
+        return(RequestManager.RequestManager(self.fetch, self.transmit, handlers, self.unexpected.append, passThrough=["RCN"], **kwargs))
+
+    def reply(self, cmd, args=None):
+        self.frames.append(Command(cmd, args if args is not None else []))
+
+@pytest.fixture
+def link(monkeypatch):
+    return(Link(monkeypatch))
+
+def test_replies_match_by_sequence_number(link):
+    manager = link.manager()
+    first = manager.sent("NXT", ["1"])
+    second = manager.sent("NXT", ["2"])
+
+    link.reply("ACK", ["1"])
+    assert manager.poll().cmd == "ACK"
+    assert manager.matched is first
+    assert first.expect == ["RDY"]
+    assert second.expect == ["ACK", "RDY"]
+
+    link.reply("ACK", ["2"])
+    link.reply("RDY", ["1"])
+    manager.poll()
+    assert manager.matched is second
+    assert manager.poll().cmd == "RDY"
+    assert manager.matched is first
+    assert manager.pending == [second]
+    assert manager.latency["NXT", "RDY"][0] == 1
+
+def test_default_arguments(link):
+    manager = link.manager()
+    request = manager.sent("SRT")
+
+    assert request.args == []
+    assert request.expect == ["RDY"]
+    assert manager.sent("PPW", ["3"]) is None
+
+def test_rdy_overtakes_earlier_nxt(link):
+    manager = link.manager()
+    first = manager.sent("NXT", ["1"])
+    second = manager.sent("NXT", ["2"])
+    for seq in ["1", "2"]:
+        link.reply("ACK", [seq])
+    link.reply("RDY", ["2"])
+
+    for i in range(3):
+        manager.poll()
+
+    assert manager.matched is second
+    assert manager.pending == []
+    assert manager.counts["overtaken", "NXT"] == 1
+    assert manager.troubled()
+
+def test_refusal_answers_the_oldest_nxt(link):
+    manager = link.manager()
+    manager.sent("PIP", ["3"])
+    refused = manager.sent("NXT", ["1"])
+    link.reply("ERR", ["Pipeline Full"])
+
+    assert manager.poll().cmd == "ERR"
+    assert manager.matched is refused
+    assert [request.cmd for request in manager.pending] == ["PIP"]
+    assert manager.counts["error", "NXT"] == 1
+    assert len(link.handled) == 1
+
+def test_unsolicited_err_completes_nothing(link):
+    manager = link.manager(idempotent=["SSR"])
+    waiting = manager.sent("SSR", ["5", "100"])
+    nxt = manager.sent("NXT", ["1"])
+    link.reply("ERR", ["No Valid Cup Found"])
+
+    assert manager.poll().cmd == "ERR"
+    assert manager.matched is None
+    assert manager.pending == [waiting, nxt]
+    assert manager.total("error") == 0
+    assert [thisCmd.args for thisCmd in link.handled] == [["No Valid Cup Found"]]
+    assert link.unexpected == []
+
+    # The SSR is still retried when its ACK doesn't come.
+    assert manager.poll(limit=RequestManager.linkTime * manager.margin * 1.5) is None
+    assert link.transmitted == [("SSR", ["5", "100"])]
+
+def test_lost_frame_report_answers_nothing(link):
+    manager = link.manager()
+    waiting = manager.sent("PIP", ["3"])
+    link.reply("LOS", ["1"])
+
+    assert manager.poll().cmd == "LOS"
+    assert manager.matched is None
+    assert manager.pending == [waiting]
+    assert [thisCmd.cmd for thisCmd in link.handled] == ["LOS"]
+    assert link.unexpected == []
+
+def test_timeout_returns_tmo(link):
+    manager = link.manager()
+    request = manager.sent("NXT", ["7"])
+
+    thisCmd = manager.poll()
+    assert thisCmd.cmd == RequestManager.timeoutCmd
+    assert thisCmd.args == ["NXT", "ACK", "7"]
+    assert manager.matched is request
+    assert manager.pending == []
+    assert link.clock == pytest.approx(RequestManager.cycleTime * manager.margin, abs=1e-3)
+    assert link.transmitted == []
+
+def test_idempotent_commands_are_retried_then_time_out(link):
+    manager = link.manager(idempotent=["SSR"], maxRetries=2)
+    manager.sent("SSR", ["5", "100"])
+
+    assert manager.poll().cmd == RequestManager.timeoutCmd
+    assert link.transmitted == [("SSR", ["5", "100"])] * 2
+    assert manager.counts["retry", "SSR"] == 2
+    assert manager.counts["timeout", "SSR"] == 1
+
+def test_late_ack_after_a_retry_is_a_duplicate(link):
+    manager = link.manager(idempotent=["SSR"])
+    request = manager.sent("SSR", ["5", "100"])
+
+    assert manager.poll(limit=RequestManager.linkTime * manager.margin * 1.5) is None
+    assert request.attempts == 2
+
+    link.reply("ACK")
+    link.reply("ACK")
+    manager.poll()
+    assert manager.matched is request
+    manager.poll()
+    assert manager.matched is None
+    assert manager.counts["duplicate", "ACK"] == 1
+    assert link.unexpected == []
+
+def test_unsolicited_frames(link):
+    manager = link.manager()
+    link.reply("DON")
+
+    assert manager.poll().cmd == "DON"
+    assert manager.matched is None
+    assert [thisCmd.cmd for thisCmd in link.unexpected] == ["DON"]
+    assert manager.counts["unsolicited", "DON"] == 1
+
+def test_hold_stops_deadlines(link):
+    manager = link.manager()
+    request = manager.sent("NXT", ["1"])
+    manager.hold()
+
+    assert manager.poll(limit=60.0) is None
+    assert manager.pending == [request]
+
+    manager.release()
+    assert request.deadline > link.clock
+    assert manager.poll().cmd == RequestManager.timeoutCmd
+
+def test_reset_drops_everything_pending(link):
+    manager = link.manager()
+    manager.sent("NXT", ["1"])
+    manager.sent("PIP", ["3"])
+    link.reply("RCN")
+
+    assert manager.waitFor("ACK").cmd == "RCN"
+    assert manager.pending == []
@@ -0,0 +1,101 @@
+import pytest
+import MeasurementStore
+import ResistorSorter
+import SessionTrace
+import TeensySim
+
+@pytest.fixture
+def sorter(tmp_path, monkeypatch):
+    # ResistorSorter with all its module state put back afterwards, and its logs under tmp_path.
+    monkeypatch.chdir(tmp_path)
+    for name in ["session", "debugLog", "measureLog", "measureStore", "traceWriter", "traceDir", "port", "serialReader",
+                 "requestManager", "activeMode", "wheelScheduler", "driftMonitor", "qualityCheck", "rejectCache"]:
+        monkeypatch.setattr(ResistorSorter, name, None)
+    monkeypatch.setattr(ResistorSorter, "setupCommands", {})
+    monkeypatch.setattr(ResistorSorter, "getch", ResistorSorter.getch)
+
+    yield tmp_path
+
+    ResistorSorter.disconnect()
+    ResistorSorter.closeLogs()
+
+def sortKeys(count):
+    # sort() takes a key per resistor, then Escape.
+    keys = iter([" "] * count + ["\x1b"])
+    return(lambda: next(keys))
+
+def storedMeasurements(directory):
+    # (mode, cup, resistance, range, samples, seq) for every measurement stored under directory.
+    reader = MeasurementStore.MeasurementReader(str(directory / "measurements.db"))
+    rows = sorted(row[2:] for row in reader.query())
+    reader.close()
+    return(rows)
+
+def recordSession(directory):
+    # Sorts a few resistors stop-and-wait and a few pipelined against the simulator, recording the session.
+    # Returns the trace records.
+    fake = TeensySim.FakeTeensy(TeensySim.seriesPopulation([100, 470, 1000, 4700, 22000], 5, seed=3))
+    fake.start()
+
+    ResistorSorter.traceDir = str(directory / "traces")
+    ResistorSorter.connect(fake.path)
+    path = ResistorSorter.traceWriter.path
+
+    ResistorSorter.sendRdy()
+    ResistorSorter.waitFor("ACK")
+
+    ResistorSorter.Command("SGL", ["5", "1000"]).send()
+    ResistorSorter.waitFor("ACK")
+    ResistorSorter.getch = sortKeys(4)
+    ResistorSorter.sort()
+
+    ResistorSorter.Command("MAJ", ["5"]).send()
+    ResistorSorter.waitFor("ACK")
+    ResistorSorter.sortContinuous(6, 2)
+
+    ResistorSorter.disconnect()
+    ResistorSorter.closeLogs()
+    fake.close()
+    fake.join(5)
+
+    start, records = SessionTrace.readTrace(path)
+    return(records)
+
+def test_replay_matches_the_recording(sorter, monkeypatch):
+    (sorter / "record").mkdir()
+    monkeypatch.chdir(sorter / "record")
+    records = recordSession(sorter / "record")
+
+    decoded = SessionTrace.decodeRecords(records)
+    sent = [thisCmd.cmd for direction, ns, commands in decoded if direction == SessionTrace.dirOut for thisCmd in commands]
+    received = [thisCmd.cmd for direction, ns, commands in decoded if direction == SessionTrace.dirIn for thisCmd in commands]
+    assert sent.count("NXT") == 10
+    assert received.count("MES") == 10
+
+    (sorter / "replay").mkdir()
+    monkeypatch.chdir(sorter / "replay")
+    replayPort, elapsed = SessionTrace.replay(records, speed=None)
+
+    # The host wrote exactly what it wrote the first time, and every recorded reply was released in answer.
+    assert replayPort.done.wait(5)
+    assert replayPort.written == len(replayPort.expected)
+    assert replayPort.mismatches == 0
+    assert replayPort.stalls == 0
+
+    # The replies went through the host as they did the first time.
+    ResistorSorter.disconnect()
+    ResistorSorter.closeLogs()
+    assert storedMeasurements(sorter / "replay") == storedMeasurements(sorter / "record")
+    assert len(storedMeasurements(sorter / "record")) == 10
+
+def test_partial_record_is_dropped(tmp_path):
+    writer = SessionTrace.TraceWriter(str(tmp_path / "cut.trace"))
+    writer.record(SessionTrace.dirOut, b"RDY;")
+    writer.record(SessionTrace.dirIn, b"ACK;\n")
+    writer.close()
+
+    with open(str(tmp_path / "cut.trace"), "ab") as traceFile:
+        traceFile.write(SessionTrace.record.pack(SessionTrace.dirIn, 1, 10) + b"MES")
+
+    start, records = SessionTrace.readTrace(str(tmp_path / "cut.trace"))
+    assert [(direction, data) for direction, ns, data in records] == [(SessionTrace.dirOut, b"RDY;"), (SessionTrace.dirIn, b"ACK;\n")]
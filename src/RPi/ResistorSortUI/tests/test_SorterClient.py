@@ -0,0 +1,29 @@
+import asyncio
+import os
+import SorterClient
+import TeensySim
+
+def openDescriptors():
+    return(len(os.listdir("/proc/self/fd")))
+
+def test_close_releases_both_pipes():
+    fake = TeensySim.FakeTeensy([4700.0])
+    fake.start()
+
+    async def session():
+        before = openDescriptors()
+        client = await SorterClient.openSorter(fake.path)
+        assert (await client.request("RDY"))[0].cmd == "ACK"
+
+        client.close()
+        # Transports close on the next pass of the loop.
+        await asyncio.sleep(0.05)
+
+        assert client.readTransport.is_closing()
+        assert isinstance(client.lost, ConnectionError)
+        assert openDescriptors() == before
+
+    try:
+        asyncio.run(session())
+    finally:
+        fake.close()
@@ -0,0 +1,34 @@
+import os
+import SorterLog
+
+def rotateOnce(path, keep):
+    # Runs one rotation of a closed writer's file.
+    writer = SorterLog.LogWriter(path, "test", keep=keep)
+    writer.close()
+    writer.openLog()
+    writer.rotate()
+    writer.logFile.close()
+
+def test_rotation_keeps_the_newest_and_spares_other_files(tmp_path):
+    path = str(tmp_path / "measurements")
+    others = ["measurements.db", "measurements.db-wal", "measurements.db-shm", "measurements.txt"]
+    old = ["measurements.20170101-000000", "measurements.20170101-000001-2", "measurements.20170101-000001-10"]
+    for name in others + old:
+        (tmp_path / name).write_text("x")
+
+    rotateOnce(path, 2)
+
+    names = set(os.listdir(str(tmp_path)))
+    assert set(others) <= names
+    assert "measurements.20170101-000001-10" in names
+    assert "measurements.20170101-000000" not in names
+    assert "measurements.20170101-000001-2" not in names
+    assert len([name for name in names if name.startswith("measurements.2")]) == 2
+
+def test_keep_zero_removes_every_rotation(tmp_path):
+    path = str(tmp_path / "debug")
+    (tmp_path / "debug.20170101-000000").write_text("x")
+
+    rotateOnce(path, 0)
+
+    assert sorted(os.listdir(str(tmp_path))) == ["debug"]
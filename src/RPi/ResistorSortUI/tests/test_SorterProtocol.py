@@ -0,0 +1,81 @@
+import SorterProtocol
+import TeensySim
+
+def frames(*commands, terminate=False):
+    return(b"".join(SorterProtocol.encodeCmd(cmd, args, terminate) for cmd, args in commands))
+
+def test_encode_parse_round_trip():
+    frame = SorterProtocol.encodeCmd("MES", ["3", "4700.0000", "12"])
+    assert frame[0] == len(frame)
+
+    thisCmd = SorterProtocol.parseCmd(frame.decode("ascii"))
+    assert thisCmd.cmd == "MES"
+    assert thisCmd.args == ["3", "4700.0000", "12"]
+
+def test_plain_frames_match_encoding():
+    for cmd in ["RDY", "ACK", "NXT", "END"]:
+        assert SorterProtocol.plainFrames[cmd] == SorterProtocol.encodeCmd(cmd, [])
+
+def test_concatenated_terminated_frames():
+    decoder = SorterProtocol.FrameDecoder(terminated=True)
+    data = frames(("ACK", ["1"]), ("MES", ["2", "100.0000", "1"]), ("RDY", ["1"]), terminate=True)
+
+    commands = decoder.feed(data)
+    assert [thisCmd.cmd for thisCmd in commands] == ["ACK", "MES", "RDY"]
+    assert commands[1].args == ["2", "100.0000", "1"]
+    assert len(decoder.buffer) == 0
+
+def test_split_terminated_frames():
+    decoder = SorterProtocol.FrameDecoder(terminated=True)
+    data = frames(("ACK", ["1"]), ("RDY", ["1"]), terminate=True)
+
+    # One byte at a time, including a split between '\r' and '\n'.
+    commands = []
+    for i in range(len(data)):
+        commands.extend(decoder.feed(data[i:i + 1]))
+
+    assert [(thisCmd.cmd, thisCmd.args) for thisCmd in commands] == [("ACK", ["1"]), ("RDY", ["1"])]
+
+def test_verification_byte_may_be_a_newline():
+    # "ACK;" plus 5 characters makes a frame 10 bytes long, so its verification byte is '\n'.
+    decoder = SorterProtocol.FrameDecoder(terminated=True)
+    data = SorterProtocol.encodeCmd("ACK", ["12345"], terminate=True)
+    assert data[0] == ord("\n")
+
+    commands = decoder.feed(data)
+    assert [(thisCmd.cmd, thisCmd.args) for thisCmd in commands] == [("ACK", ["12345"])]
+
+def test_bad_verification_byte_is_dropped():
+    decoder = SorterProtocol.FrameDecoder(terminated=True)
+    bad = bytearray(SorterProtocol.encodeCmd("ACK", ["1"], terminate=True))
+    bad[0] += 1
+
+    commands = decoder.feed(bytes(bad) + SorterProtocol.encodeCmd("RDY", ["1"], terminate=True))
+    assert [thisCmd.cmd for thisCmd in commands] == ["RDY"]
+
+def test_unterminated_frames_concatenated_and_split():
+    decoder = SorterProtocol.FrameDecoder(terminated=False)
+    data = frames(("NXT", ["1"]), ("NXT", ["2"]), ("NXT", ["3"]))
+
+    commands = decoder.feed(data[:5])
+    commands += decoder.feed(data[5:])
+    assert [thisCmd.args for thisCmd in commands] == [["1"], ["2"], ["3"]]
+
+def test_firmware_reads_stacked_frames():
+    # A pipelined sort writes several NXTs back to back; the mainboard must read every one of them.
+    serial = TeensySim.FirmwareSerial()
+    data = frames(("NXT", ["1"]), ("NXT", ["2"]), ("NXT", ["3"]))
+
+    commands = serial.feed(data[:-2])
+    assert [thisCmd.args for thisCmd in commands] == [["1"], ["2"]]
+
+    commands = serial.feed(data[-2:])
+    assert [thisCmd.args for thisCmd in commands] == [["3"]]
+    assert serial.stacked == 2
+
+def test_legacy_firmware_stalls_on_stacked_frames():
+    serial = TeensySim.FirmwareSerial(legacy=True)
+
+    assert [thisCmd.cmd for thisCmd in serial.feed(frames(("NXT", ["1"])))] == ["NXT"]
+    assert serial.feed(frames(("NXT", ["2"]), ("NXT", ["3"]))) == []
+    assert serial.stalled
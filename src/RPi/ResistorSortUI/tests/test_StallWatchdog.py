@@ -0,0 +1,87 @@
+import pytest
+import ResistorSorter
+import StallWatchdog
+import TeensySim
+
+class Recorder:
+    def __init__(self):
+        self.sent = []
+
+    def __call__(self, cmd, args):
+        self.sent.append((cmd, list(args)))
+
+def test_recovery_commands_wait_for_their_answers():
+    send = Recorder()
+    watchdog = StallWatchdog.StallWatchdog(send, path=None)
+    watchdog.start("SGL", 2)
+    watchdog.lastCup = 4
+
+    assert "Trying recovery step 1 of 3" in watchdog.recover()
+    assert send.sent == [("MSW", ["1"])]
+
+    # Answers to anything else don't release the next command.
+    watchdog.answered("NXT")
+    assert send.sent == [("MSW", ["1"])]
+
+    watchdog.answered("MSW")
+    assert send.sent == [("MSW", ["1"]), ("MSW", ["4"])]
+
+    watchdog.answered("MSW")
+    assert len(send.sent) == 2
+
+    # A step that runs out drops whatever of the last one was left.
+    watchdog.recover()
+    assert send.sent[-1] == ("CFD", ["1"])
+    assert watchdog.queue == []
+
+def test_recovery_note_gives_the_limit():
+    watchdog = StallWatchdog.StallWatchdog(Recorder(), path=None, defaultLimit=2.5, minSamples=10)
+    watchdog.start("SGL", 2)
+    assert "(limit 2500 ms, not learned yet)" in watchdog.recover()
+
+    watchdog.start("MAJ", 2)
+    for i in range(20):
+        watchdog.model.add(0.4)
+    assert "(limit 600 ms)" in watchdog.recover()
+
+@pytest.fixture
+def sorter(tmp_path, monkeypatch):
+    # ResistorSorter connected to a simulator whose third wheel move jams, with a watchdog that learns nothing to disk.
+    monkeypatch.chdir(tmp_path)
+    for name in ["session", "debugLog", "measureLog", "measureStore", "traceWriter", "traceDir", "port", "serialReader",
+                 "requestManager", "activeMode", "wheelScheduler", "driftMonitor", "qualityCheck", "rejectCache"]:
+        monkeypatch.setattr(ResistorSorter, name, None)
+    monkeypatch.setattr(ResistorSorter, "setupCommands", {})
+    monkeypatch.setattr(ResistorSorter, "watchdogEnabled", True)
+    monkeypatch.setattr(ResistorSorter, "stallWatchdog", StallWatchdog.StallWatchdog(ResistorSorter.sendRecovery, path=None, defaultLimit=0.5, minLimit=0.2))
+
+    fake = TeensySim.FakeTeensy([1000.0], wheelJams=[3])
+    fake.start()
+    ResistorSorter.connect(fake.path)
+    yield fake
+
+    reader = ResistorSorter.serialReader
+    ResistorSorter.disconnect()
+    ResistorSorter.closeLogs()
+    fake.close()
+    fake.join(5)
+    assert not reader.is_alive()
+    assert not fake.is_alive()
+
+def test_sort_recovers_from_a_jammed_wheel(sorter):
+    fake = sorter
+    ResistorSorter.sendRdy()
+    assert ResistorSorter.waitFor("ACK").cmd == "ACK"
+    ResistorSorter.Command("SGL", ["5", "1000"]).send()
+    assert ResistorSorter.waitFor("ACK").cmd == "ACK"
+
+    measured = ResistorSorter.sortContinuous(8, 2)
+
+    watchdog = ResistorSorter.stallWatchdog
+    assert fake.jams == 1
+    assert watchdog.jams == 1
+    assert watchdog.cleared == 1
+    assert fake.received.count("MSW") == 2
+    assert fake.received.count("CFD") == 0
+    assert sorted(measured) == list(range(1, 9))
+    assert ResistorSorter.stopReason is None
@@ -0,0 +1,130 @@
+import os
+import select
+import subprocess
+import sys
+import time
+import pytest
+import ESeries
+import SorterProtocol
+import TeensySim
+
+hostDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+setups = [
+    [("MAJ", ["5"])],
+    [("MAJ", ["1"])],
+    [("SGL", ["5", "4700"])],
+    [("QCR", ["1", "100"])],
+    [("SSR", ["5", "100", "220", "470", "1000", "2200", "4700", "10000", "22000", "47000"])],
+    [("SSR", ["5", "100", "220", "", "", "", "", "", "", ""])],
+    [("OHM", [])],
+    [("SSR", ["5", "100", "220", "470", "1000", "2200", "4700", "10000", "22000", "47000"]),
+     ("CUP", ["3", "1", "0", "0"]), ("CUP", ["10", "0", "0", "1"])],
+]
+
+readings = [0.0, 1.0, 9.5, 100.0, 104.0, 230.0, 470.0, 4650.0, 4700.0, 33000.0, 47000.0, 900000.0, 5e6]
+
+@pytest.mark.parametrize("commands", setups)
+def test_plain_cup_table_matches_eseries(commands):
+    plain = TeensySim.PlainCupTable()
+    vectorized = ESeries.CupTable()
+    assert plain.assign(readings) is None
+
+    for cmd, args in commands:
+        assert plain.apply(cmd, args) == vectorized.apply(cmd, args)
+
+    assert plain.assign(readings) == [int(cup) for cup in vectorized.assign(readings)]
+
+def test_simulator_runs_without_numpy():
+    # numpy is blocked in a fresh interpreter, so ESeries can't be imported.
+    script = ("import sys; sys.modules['numpy'] = None; import TeensySim; "
+              "assert TeensySim.ESeries is None; fake = TeensySim.FakeTeensy(); "
+              "assert isinstance(fake.cupTable, TeensySim.PlainCupTable); fake.close()")
+    subprocess.run([sys.executable, "-c", script], cwd=hostDir, check=True)
+
+class Host:
+    """The host end of the simulator's pty, speaking plain ASCII frames."""
+
+    def __init__(self, fake):
+        self.fd = os.open(fake.path, os.O_RDWR | os.O_NOCTTY)
+        self.decoder = SorterProtocol.FrameDecoder(terminated=True)
+        self.received = []
+
+    def send(self, cmd, args=()):
+        os.write(self.fd, SorterProtocol.encodeCmd(cmd, list(args)))
+
+    def read(self, timeout):
+        # Everything received within timeout seconds of the last frame.
+        while True:
+            readable, _, _ = select.select([self.fd], [], [], timeout)
+            if (len(readable) == 0):
+                output = self.received
+                self.received = []
+                return(output)
+
+            self.received.extend(self.decoder.feed(os.read(self.fd, 4096)))
+
+    def waitFor(self, cmd, timeout=5.0):
+        # Returns the commands received up to and including cmd.
+        deadline = time.monotonic() + timeout
+        output = []
+
+        while (time.monotonic() < deadline):
+            while (len(self.received) > 0):
+                thisCmd = self.received.pop(0)
+                output.append(thisCmd)
+                if (thisCmd.cmd == cmd):
+                    return(output)
+
+            readable, _, _ = select.select([self.fd], [], [], max(0.0, deadline - time.monotonic()))
+            if (len(readable) > 0):
+                self.received.extend(self.decoder.feed(os.read(self.fd, 4096)))
+
+        raise TimeoutError("No {} from the simulator".format(cmd))
+
+    def close(self):
+        os.close(self.fd)
+
+@pytest.fixture
+def session():
+    # A simulator where the second wheel move (the first parking move) jams, and a host talking to it.
+    fake = TeensySim.FakeTeensy([1000.0], wheelJams=[2])
+    fake.start()
+    host = Host(fake)
+
+    host.send("RDY")
+    host.waitFor("ACK")
+    yield fake, host
+
+    host.close()
+    fake.close()
+
+def test_jammed_parking_move_still_reads_commands(session):
+    fake, host = session
+
+    host.send("SGL", ["5", "1000"])
+    host.waitFor("ACK")
+    host.send("PPW", ["5"])
+    host.send("SRT")
+    host.waitFor("RDY")
+
+    # Four parts fill the feed; the fifth load measures the first, which is sorted and then parked on a jam.
+    for i in range(5):
+        host.send("NXT")
+        host.waitFor("RDY")
+
+    # The sixth load measures the second part, but the wheel is stuck, so it can't be sorted.
+    host.send("NXT")
+    assert [thisCmd.cmd for thisCmd in host.read(0.3)] == ["ACK"]
+    assert fake.cState == 3
+    assert fake.held is not None
+
+    # The mainboard still reads commands while it waits, so MSW restarts the wheel and the sort carries on.
+    host.send("MSW", ["5"])
+    replies = host.waitFor("RDY")
+    assert [thisCmd.cmd for thisCmd in replies] == ["ACK", "MES", "RDY"]
+    assert fake.measured == 2
+
+    host.send("END")
+    host.waitFor("DON")
+    assert fake.measured == 6
@@ -70,10 +70,92 @@ int cState = 0;
 // Global rep of measurement data
 double measurement = 0.0;
 
+// Set once the resistor on the measurement platform has been measured, while state 3 waits for the wheel to be free.
+bool measurementHeld = false;
+int targetSortPos = 0;
+
 // Bool set when feeding out the remainder of the feed stack
 bool feedToEnd = false;
 bool isQCR = false;
 
+// Pipelined sorting. When pipeWindow > 0 (set by PIP), NXT carries a sequence number and may arrive during any sort state.
+// NXTs that arrive while the load platform is busy are held here and loaded as soon as it clears. This is latency hiding
+// only: it saves the host's round trip between RDY and the next NXT, and doesn't overlap the feed with the dispense.
+// The feed still cycles only after the swing arm has dispensed, because a feed cycle moves every position and would
+// carry the resistor waiting on the measurement platform off it. Throughput is the same at any window of 2 or more.
+const int pipeMax = 8;
+int pipeWindow = 0;
+long pendingSeq[pipeMax];
+int pendingHead = 0;
+int pendingCount = 0;
+
+// Sequence number of the last resistor loaded, and whether its RDY has been sent yet.
+long loadedSeq = 0;
+bool rdyOwed = false;
+
+// Measurement ranges in use (indexes into srState). 3 is the 100k divider, 7 the 100mA current source.
+const int minRange = 3;
+const int maxRange = 7;
+
+// Adaptive ranging (ARG). Starts at the range that won last time and stops as soon as a reading lands near mid-scale.
+bool adaptiveRanging = false;
+int rangeWindow = 10;			// Percent of full scale either side of mid-scale that is accepted outright.
+int lastRange = 0;			// Range used for the last measurement. 0 until something has been measured.
+int lastSamples = 0;			// ADC reads taken during the last measurement.
+double lastReading = 0.0;		// Averaged ADC counts behind the last measurement, reported in MES for calibration.
+
+// Range hint (HNT). On a re-pass the host already knows roughly what the parts measure, so it names the range to start
+// from. Ranging then walks from there as with ARG and stops as soon as a reading confirms it. Cleared at the end of a sort.
+int hintRange = 0;
+
+// Sequential sampling (SEQ). Rather than a fixed 31 good readings per range, readRange() keeps a running mean and
+// variance and stops once the standard error of the resistance is within seqTolerance percent, after at least
+// seqMinSamples readings. The host sets the tolerance from the sort's precision. 0 keeps the fixed count.
+double seqTolerance = 0.0;
+const int seqMinSamples = 5;
+const int goodTarget = 31;		// Good readings per range with sequential sampling off.
+const int maxAttempts = 101;		// Readings per range before giving up.
+
+// Continuous ADC (second SEQ argument). The ADC converts back to back while a range is read, so each reading is
+// waiting as soon as the last one has been used instead of being started and waited for.
+bool continuousAdc = false;
+
+// Calibration (CAL). RAM copies of internalTestResistances (ranges 1-6) and internalCurrentSources (7-9), plus a series
+// offset per range, so the host can recalibrate without a reflash. Set back to the compiled values at power on.
+const int rangeCount = 9;
+double calValues[rangeCount];
+double calOffsets[rangeCount];
+
+// Wheel pre-positioning (PPW). The host names a cup to park the wheel at once the current resistor is dispensed, so the
+// wheel can travel while the next resistor is being measured. 0 means stay put.
+int parkCup = 0;
+
+// Phase telemetry (TLM). When on, each dispense is followed by a PHS frame with the time spent in each phase, in micros.
+bool telemetry = false;
+volatile unsigned long feedStartedAt = 0;
+volatile unsigned long feedMicros = 0;		// Last feed motion, set by isrFeedClear
+volatile unsigned long wheelStartedAt = 0;
+volatile unsigned long wheelMicros = 0;		// Last wheel motion, set by isrWheelClear
+unsigned long contactMicros = 0;		// Contacts down
+unsigned long rangingMicros = 0;		// Range selection and ADC reads
+unsigned long releaseMicros = 0;		// Contacts up
+unsigned long swingMicros = 0;			// Swing arm open and home
+
+// Binary link mode (BIN). Frames are COBS encoded and zero terminated:
+// [seq][cmd x3][format][body][crc16 hi][crc16 lo]. Layouts must match BinaryProtocol.py on the host. Sequence numbers
+// go in 16 bits whenever they fit, and the ADC counts in MES as sixteenths of a count.
+const int binMax = 128;
+const uint8_t binEmpty = 0;
+const uint8_t binText = 1;
+const uint8_t binFixed = 2;
+const int adcScale = 16;
+bool binaryMode = false;
+uint8_t txSeq = 0;
+uint8_t rxSeq = 0;
+uint8_t binRx[binMax];
+int binRxLen = 0;
+bool binRxOverflow = false;
+
 void setup() {
 	// Init Servos
 	ContactArm.attach(SrvoA);
@@ -117,6 +199,8 @@ void setup() {
 	Wire.write(64);
 	Wire.endTransmission();
 	
+	resetCalibration();
+
 	// Set up ADC
 	adc->setReference(ADC_REF_EXT);
 	adc->setResolution(bitPrecision);
@@ -133,8 +217,7 @@ void setup() {
 		;
 	} while (!cmdReady());
 
-	String incCmd = Serial.readString();
-	Command handshake = parseCmd(incCmd);
+	Command handshake = parseCmd(readFrame());
 
 	if (handshake.cmd == "RDY") {
 		digitalWrite(ledPin, LOW);
@@ -149,9 +232,7 @@ void loop() {
 	Command thisCommand;
 
 	// At the start of every loop, check if a command is waiting.
-	if (cmdReady()) {
-		String incCmd = Serial.readString();
-		thisCommand = parseCmd(incCmd);
+	if (fetchCommand(thisCommand)) {
 
 		if (cState == 0) {
 			// Some command handling...
@@ -222,10 +303,14 @@ void loop() {
 				// "Sortable Range" -- we get a precision and 9 typical values. The 10th is reject.
 				int precision = thisCommand.args[0].toInt();
 
-				// Loop through the list of arguments setting up cups
-				for (int i = 1; i < thisCommand.numArgs; i++) {
-					Wheel.cups[i].setCupRange(thisCommand.args[i].toFloat(), precision);
-					Wheel.cups[i].setRejectState(false);
+				// Loop through the list of arguments setting up cups. Argument 1 is cup 1 (index 0); a blank nominal leaves that cup as a reject.
+				for (int i = 1; i < thisCommand.numArgs && i < cupCount; i++) {
+					if (thisCommand.args[i].length() == 0) {
+						Wheel.cups[i - 1].setRejectState(true);
+					} else {
+						Wheel.cups[i - 1].setCupRange(thisCommand.args[i].toFloat(), precision);
+						Wheel.cups[i - 1].setRejectState(false);
+					}
 				}
 
 				Wheel.cups[9].setRejectState(true);
@@ -269,6 +354,115 @@ void loop() {
 				sendAck();
 
 			}
+
+			if (thisCommand.cmd == "ARG") {
+				// "Adaptive Ranging" -- args are enable (0/1) and the acceptance window in percent of full scale.
+				adaptiveRanging = (thisCommand.args[0].toInt() != 0);
+
+				if (thisCommand.numArgs > 1) {
+					rangeWindow = constrain(thisCommand.args[1].toInt(), 1, 50);
+				}
+
+				lastRange = 0;
+
+				sendAck();
+
+			}
+
+			if (thisCommand.cmd == "HNT") {
+				// "Hint" -- HNT;value names the resistance most parts in this sort are expected near. Ranging starts on
+				// the range for it instead of trying every range. 0 or no arguments removes the hint.
+				double value = (thisCommand.numArgs > 0) ? strtod(thisCommand.args[0].c_str(), NULL) : 0.0;
+
+				hintRange = (value > 0.0) ? nearestRange(value) : 0;
+				lastRange = 0;
+
+				sendAck();
+
+			}
+
+			if (thisCommand.cmd == "SEQ") {
+				// "Sequential" -- SEQ;tolerance,continuous. tolerance is the standard error to stop at, in percent of the
+				// reading (0 for the fixed sample count); continuous 1 reads the ADC in continuous mode.
+				seqTolerance = (thisCommand.numArgs > 0) ? strtod(thisCommand.args[0].c_str(), NULL) : 0.0;
+				seqTolerance = (seqTolerance > 0.0) ? seqTolerance : 0.0;
+				continuousAdc = (thisCommand.numArgs > 1 && thisCommand.args[1].toInt() != 0);
+
+				sendAck();
+
+			}
+
+			if (thisCommand.cmd == "BIN") {
+				// "Binary link" -- acknowledge in ASCII, then switch framing for the rest of the session.
+				long baud = thisCommand.args[0].toInt();
+
+				sendAck();
+				Serial.flush();
+
+				// USB serial ignores the rate, but this keeps a hardware UART build in step with the host.
+				Serial.begin(baud);
+
+				binaryMode = true;
+				txSeq = 0;
+				rxSeq = 0;
+				binRxLen = 0;
+				binRxOverflow = false;
+			}
+
+			if (thisCommand.cmd == "CAL") {
+				// "Calibrate" -- CAL;range,value,offset replaces one range's divider resistance (ranges 1-6, ohms) or
+				// current source (7-9, amps), and the offset added to every reading on it. No arguments restores the
+				// compiled calibration.
+				if (thisCommand.numArgs >= 2) {
+					int range = thisCommand.args[0].toInt();
+					double value = strtod(thisCommand.args[1].c_str(), NULL);
+
+					if (range >= 1 && range <= rangeCount && value > 0.0) {
+						calValues[range - 1] = value;
+						calOffsets[range - 1] = (thisCommand.numArgs >= 3) ? strtod(thisCommand.args[2].c_str(), NULL) : 0.0;
+					}
+				} else {
+					resetCalibration();
+				}
+
+				sendAck();
+
+			}
+
+			if (thisCommand.cmd == "TLM") {
+				// "Telemetry" -- 1 sends a PHS frame with per-phase timings after every resistor, 0 stops them.
+				telemetry = (thisCommand.args[0].toInt() != 0);
+
+				sendAck();
+
+			}
+
+			if (thisCommand.cmd == "PIP") {
+				// "Pipeline" -- sets how many NXT commands the host may have in flight for the next sort. 0 is stop-and-wait.
+				int window = thisCommand.args[0].toInt();
+
+				pipeWindow = constrain(window, 0, pipeMax);
+				pendingHead = 0;
+				pendingCount = 0;
+
+				sendAck();
+
+			}
+		} else if (pipeWindow > 0) {
+			// In a pipelined sort, NXT and END are accepted in every state, not just while waiting in state 1.
+			if (thisCommand.cmd == "NXT") {
+				queueNext(thisCommand.args[0].toInt());
+				thisCommand.cmd = "";
+			}
+
+			if (thisCommand.cmd == "END") {
+				feedToEnd = true;
+				if (cState == 1) {
+					cState = 2;		// Feed Process
+				}
+				sendAck();
+				thisCommand.cmd = "";
+			}
 		}
 	}
 
@@ -281,6 +475,12 @@ void loop() {
 		}
 	} else if (cState == 1) {
 		// Sorting Mode (Waiting on NXT).
+		// In a pipelined sort the NXT may already be queued, in which case there is no need to wait.
+		if (loadPending()) {
+			cState = 2;		// Feed Process
+			return;
+		}
+
 		// NXT is the command that indicates the user has pressed the button saying they loaded a resistor.
 		if (thisCommand.cmd == "NXT") {
 
@@ -314,10 +514,24 @@ void loop() {
 				return;
 			}
 
+			if (pipeWindow > 0) {
+				// Tell the host which resistor has cleared the load platform, then keep going if another is queued.
+				if (rdyOwed) {
+					rdyOwed = false;
+					sendReady(loadedSeq);
+				}
+
+				if (loadPending()) {
+					return;
+				}
+			}
+
 			// If we're not feeding to the end after waiting, we're clear for a new command.
 			if (!feedToEnd) {
 				cState = 1;		// Ready for next command
-				sendReady();
+				if (pipeWindow == 0) {
+					sendReady();
+				}
 				return;
 			}
 		}
@@ -335,6 +549,10 @@ void loop() {
 					cState = 0;			// Finished.
 					isQCR = false;			// In case we were in QCR, reset it.
 					feedToEnd = false;
+					pipeWindow = 0;			// Pipelining is opted into per sort.
+					pendingCount = 0;
+					lastRange = 0;			// Next sort starts from its own nominal.
+					hintRange = 0;
 					sendDone();
 				} else {
 					cState = 1;			// Ready for next command
@@ -342,6 +560,7 @@ void loop() {
 				}
 			} else {
 				// Otherwise, cycle the feed and mark the motion in process.
+				feedStartedAt = micros();
 				Feed.cycleFeed(1);
 				feedInProcess = true;
 			}
@@ -352,26 +571,48 @@ void loop() {
 	} else if (cState == 3) {
 		// Measure Resistor
 		if (!Feed.measurePlatformEmpty()) {
-			// If the measurement platform isn't empty, measure the resistor
-			measurement = measureResistor();
+			// If the measurement platform isn't empty, measure the resistor (once; we may be back here waiting on the wheel)
+			if (!measurementHeld) {
+				measurement = measureResistor();
+
+				// Get the target cup and begin the sort motion
+				targetSortPos = getTargetCup(measurement);
+				measurementHeld = true;
+			}
 
-			// Get the target cup and begin the sort motion
-			int targetSortPos = getTargetCup(measurement);
+			// Move the sort wheel. This is started before the contacts lift so the two motions overlap.
+			// A parking move may still be finishing. Like state 4, come back round the loop until it has, so commands
+			// (MSW and CFD to clear a jam among them) are still read meanwhile.
+			if (sortMotionInProcess) {
+				return;
+			}
 
-			// Report the measurement
+			measurementHeld = false;
+			wheelStartedAt = micros();
+			Wheel.moveTo(targetSortPos);
+			sortMotionInProcess = true;
+
+			// Report the measurement, tagged with the sequence number of the resistor it belongs to.
 			Command measurementData;
 			measurementData.cmd = "MES";
-			measurementData.numArgs = 2;
+			measurementData.numArgs = 6;
 			measurementData.args[0] = String(targetSortPos);
 			measurementData.args[1] = String(measurement, 4);
+			measurementData.args[2] = String(Feed.measureSeq());
+			measurementData.args[3] = String(lastRange);
+			measurementData.args[4] = String(lastSamples);
+			measurementData.args[5] = String(lastReading, 2);
 			sendCommand(measurementData);
 
-			// Move the sort wheel.
-			Wheel.moveTo(targetSortPos);
-			sortMotionInProcess = true;
+			unsigned long releaseStart = micros();
+			releaseContacts();
+			releaseMicros = micros() - releaseStart;
 			cState = 4;				// Dispense Resistor
 		} else {
-			// If it's empty, we either need to go back to feeding or attempt dispense again.
+			// If it's empty, we either need to go back to feeding or attempt dispense again. A CFD while we waited on
+			// the wheel may have moved the measured resistor on, so its measurement no longer belongs to anything.
+			measurementHeld = false;
+
 			if (sortMotionInProcess) {
 				cState = 4;			// Dispense Resistor
 			} else {
@@ -385,26 +626,95 @@ void loop() {
 		// Dispense Resistor
 		if (!sortMotionInProcess) {
 			// A dispense state occurs after a sort motion has begun. Wait for the sort motion to complete and dispense. EZPZ.
+			long dispensedSeq = Feed.measureSeq();
+			unsigned long swingStart = micros();
 			SwingArm.write(swingOpen);
 			delay(swingTime);			// actual delay here, since we shouldn't move or process anything else until we're sure this is clear.
 			Feed.dispense();
 			SwingArm.write(swingHome);
 			delay(swingTime);
+			swingMicros = micros() - swingStart;
 			cState = 2;				// Feed Process
+
+			// Park the wheel where the host expects the next resistor to go, overlapping the move with the next measurement.
+			if (parkCup > 0 && parkCup != Wheel.getCurrentPosition()) {
+				wheelStartedAt = micros();
+				Wheel.moveTo(parkCup);
+				sortMotionInProcess = true;
+			}
+			parkCup = 0;
+
+			if (telemetry) {
+				sendPhases(dispensedSeq);
+			}
 		}
 	}
 }
 
 void isrFeedClear() {
+	feedMicros = micros() - feedStartedAt;
 	feedInProcess = false;
 	digitalWrite(ledPin, LOW);
 }
 
 void isrWheelClear() {
+	wheelMicros = micros() - wheelStartedAt;
 	sortMotionInProcess = false;
 	digitalWrite(ledPin, LOW);
 }
 
+void sendPhases(long seq) {
+	// Reports how long each phase of the last resistor's cycle took: seq, feed, contact, ranging, release, wheel, swing.
+
+	Command phaseCommand;
+	phaseCommand.cmd = "PHS";
+	phaseCommand.numArgs = 7;
+	phaseCommand.args[0] = String(seq);
+	phaseCommand.args[1] = String(feedMicros);
+	phaseCommand.args[2] = String(contactMicros);
+	phaseCommand.args[3] = String(rangingMicros);
+	phaseCommand.args[4] = String(releaseMicros);
+	phaseCommand.args[5] = String(wheelMicros);
+	phaseCommand.args[6] = String(swingMicros);
+
+	sendCommand(phaseCommand);
+}
+
+void queueNext(long seq) {
+	// Holds a pipelined NXT until the load platform is free. The ACK echoes the sequence number.
+
+	if (pendingCount >= pipeWindow) {
+		sendError("Pipeline Full");
+		return;
+	}
+
+	pendingSeq[(pendingHead + pendingCount) % pipeMax] = seq;
+	pendingCount++;
+
+	Command ackCommand;
+	ackCommand.cmd = "ACK";
+	ackCommand.numArgs = 1;
+	ackCommand.args[0] = String(seq);
+	sendCommand(ackCommand);
+}
+
+bool loadPending() {
+	// Loads the oldest held NXT if the load platform is clear. Returns true if a resistor was loaded.
+
+	if (pendingCount == 0 || feedInProcess || !Feed.loadPlatformEmpty()) {
+		return(false);
+	}
+
+	loadedSeq = pendingSeq[pendingHead];
+	pendingHead = (pendingHead + 1) % pipeMax;
+	pendingCount--;
+
+	Feed.load(loadedSeq);
+	rdyOwed = true;
+
+	return(true);
+}
+
 Command parseCmd(String incCmd) {
 	// parses a command string into the Command struct. Also handles certain vital commands, such as Halt.
 	
@@ -425,6 +735,7 @@ Command parseCmd(String incCmd) {
 		output.args[argIndex] = incCmd.substring(0, commaIndex);
 		incCmd.remove(0, commaIndex + 1);
 		argIndex++;
+		commaIndex = incCmd.indexOf(',');
 	}
 
 	// The rest of the string is the last arg.
@@ -460,6 +771,12 @@ Command parseCmd(String incCmd) {
 		sendAck();
 	}
 
+	// Wheel pre-position hint. Not acknowledged, so it can be sent at any point in a sort without disturbing the
+	// NXT/ACK/RDY exchange. The move itself happens after the next dispense, when the swing arm is clear.
+	if (output.cmd == "PPW") {
+		parkCup = constrain(output.args[0].toInt(), 0, cupCount);
+	}
+
 	// Debugging command: Cycle Dispense Arm
 	if (output.cmd == "CDA") {
 		digitalWrite(ledPin, HIGH);
@@ -477,14 +794,19 @@ Command parseCmd(String incCmd) {
 
 		// Get the current cup and attempt a measurement
 		double testMeasurement = measureResistor();
+		releaseContacts();
 		int thisCup = Wheel.getCurrentPosition();
 
 		// Construct a response
 		Command mesCmd;
 		mesCmd.cmd = "MES";
-		mesCmd.numArgs = 2;
+		mesCmd.numArgs = 6;
 		mesCmd.args[0] = String(thisCup);
 		mesCmd.args[1] = String(testMeasurement);
+		mesCmd.args[2] = String(0);
+		mesCmd.args[3] = String(lastRange);
+		mesCmd.args[4] = String(lastSamples);
+		mesCmd.args[5] = String(lastReading, 2);
 
 		// Send the measurement data
 		sendCommand(mesCmd);
@@ -524,13 +846,317 @@ String parseCmd(Command outCmd) {
 	return(output);
 }
 
+bool fetchCommand(Command &output) {
+	// Fetches the next complete command in whichever link mode is active. Returns false if none is waiting.
+
+	if (binaryMode) {
+		return(fetchBinary(output));
+	}
+
+	if (!cmdReady()) {
+		return(false);
+	}
+
+	output = parseCmd(readFrame());
+	return(true);
+}
+
+String readFrame() {
+	// Reads exactly the frame cmdReady() found waiting, leaving any frames behind it in the buffer for the next loop.
+	// (Serial.readString() would sit out its 1s timeout first.)
+	char frame[256];
+	int frameLen = max(Serial.peek(), 1);
+
+	frameLen = Serial.readBytes(frame, frameLen);
+	frame[frameLen] = 0;
+
+	return(String(frame));
+}
+
+bool fetchBinary(Command &output) {
+	// Collects bytes up to the next zero delimiter, then decodes and verifies the frame.
+
+	while (Serial.available() > 0) {
+		uint8_t thisByte = Serial.read();
+
+		if (thisByte != 0) {
+			if (binRxLen < binMax) {
+				binRx[binRxLen++] = thisByte;
+			} else {
+				binRxOverflow = true;
+			}
+			continue;
+		}
+
+		// End of frame.
+		uint8_t payload[binMax];
+		int payloadLen = cobsDecode(binRx, binRxLen, payload);
+		bool overflowed = binRxOverflow;
+
+		binRxLen = 0;
+		binRxOverflow = false;
+
+		if (overflowed || payloadLen < 7) {
+			sendError("Bad Frame");
+			continue;
+		}
+
+		uint16_t crc = crc16(payload, payloadLen - 2);
+		if (payload[payloadLen - 2] != (crc >> 8) || payload[payloadLen - 1] != (crc & 0xFF)) {
+			sendError("Bad CRC");
+			continue;
+		}
+
+		if (payload[0] != rxSeq) {
+			// Not an ERR: this frame is still carried out, and an ERR would read as the refusal of a request.
+			sendLost((uint8_t) (payload[0] - rxSeq));
+		}
+		rxSeq = payload[0] + 1;
+
+		output = parseCmd(unpackBinary(payload, payloadLen));
+		return(true);
+	}
+
+	return(false);
+}
+
+String unpackBinary(const uint8_t *payload, int payloadLen) {
+	// Rebuilds the ASCII form of a binary frame so it can go through parseCmd like any other command.
+
+	String output = " ";		// Stands in for the verification byte, which parseCmd discards.
+	String cmd = "";
+
+	for (int i = 1; i <= 3; i++) {
+		cmd += (char) payload[i];
+	}
+
+	output += cmd;
+	output += ";";
+
+	uint8_t format = payload[4];
+	const uint8_t *body = payload + 5;
+	int bodyLen = payloadLen - 7;
+
+	if (format == binText) {
+		for (int i = 0; i < bodyLen; i++) {
+			output += (char) body[i];
+		}
+	} else if (format == binFixed) {
+		if ((cmd == "NXT" || cmd == "RDY" || cmd == "ACK") && bodyLen == 2) {
+			output += String(readU16(body));
+		} else if ((cmd == "NXT" || cmd == "RDY" || cmd == "ACK") && bodyLen == 4) {
+			output += String(readU32(body));
+		} else if (cmd == "SSR" && bodyLen == 37) {
+			output += String(body[0]);
+			for (int i = 0; i < 9; i++) {
+				output += ",";
+				output += String(readF32(body + 1 + (4 * i)), 4);
+			}
+		} else if (cmd == "CUP" && bodyLen == 10) {
+			output += String(body[0]);
+			output += ",";
+			output += String(readF32(body + 1), 4);
+			output += ",";
+			output += String(readF32(body + 5), 4);
+			output += ",";
+			output += String(body[9]);
+		}
+	}
+
+	return(output);
+}
+
+void sendBinary(Command sendCmd) {
+	// Encodes a Command as a binary frame, using the fixed layout where one exists.
+
+	uint8_t payload[binMax];
+	int len = 0;
+
+	payload[len++] = txSeq++;
+	for (int i = 0; i < 3; i++) {
+		payload[len++] = sendCmd.cmd[i];
+	}
+
+	if (sendCmd.numArgs == 0) {
+		payload[len++] = binEmpty;
+	} else if (sendCmd.cmd == "MES" && sendCmd.numArgs == 6) {
+		long seq = sendCmd.args[2].toInt();
+		double counts = sendCmd.args[5].toFloat();
+
+		payload[len++] = binFixed;
+		payload[len++] = (uint8_t) sendCmd.args[0].toInt();
+		len += writeF32(payload + len, sendCmd.args[1].toFloat());
+
+		if (seq >= 0 && seq <= 0xFFFF && counts >= 0.0 && counts * adcScale < 65535.5) {
+			// Compact layout: 16 bit seq, ADC counts in sixteenths.
+			len += writeU16(payload + len, seq);
+			payload[len++] = (uint8_t) sendCmd.args[3].toInt();
+			len += writeU16(payload + len, sendCmd.args[4].toInt());
+			len += writeU16(payload + len, (uint16_t) (counts * adcScale + 0.5));
+		} else {
+			len += writeU32(payload + len, seq);
+			payload[len++] = (uint8_t) sendCmd.args[3].toInt();
+			len += writeU16(payload + len, sendCmd.args[4].toInt());
+			len += writeF32(payload + len, counts);
+		}
+	} else if ((sendCmd.cmd == "RDY" || sendCmd.cmd == "ACK") && sendCmd.numArgs == 1) {
+		long seq = sendCmd.args[0].toInt();
+
+		payload[len++] = binFixed;
+		if (seq >= 0 && seq <= 0xFFFF) {
+			len += writeU16(payload + len, seq);
+		} else {
+			len += writeU32(payload + len, seq);
+		}
+	} else if (sendCmd.cmd == "PHS" && sendCmd.numArgs == 7) {
+		payload[len++] = binFixed;
+		for (int i = 0; i < 7; i++) {
+			len += writeU32(payload + len, strtoul(sendCmd.args[i].c_str(), NULL, 10));
+		}
+	} else {
+		// Anything else goes as text, truncated if it would not fit.
+		payload[len++] = binText;
+		for (int i = 0; i < sendCmd.numArgs; i++) {
+			if (i > 0 && len < binMax - 2) {
+				payload[len++] = ',';
+			}
+			for (unsigned int c = 0; c < sendCmd.args[i].length() && len < binMax - 2; c++) {
+				payload[len++] = sendCmd.args[i][c];
+			}
+		}
+	}
+
+	uint16_t crc = crc16(payload, len);
+	payload[len++] = crc >> 8;
+	payload[len++] = crc & 0xFF;
+
+	uint8_t encoded[binMax + 4];
+	int encodedLen = cobsEncode(payload, len, encoded);
+
+	Serial.write(encoded, encodedLen);
+	Serial.write((uint8_t) 0);
+	Serial.flush();
+}
+
+uint16_t crc16(const uint8_t *data, int len) {
+	// CRC-16/CCITT-FALSE (poly 0x1021, init 0xFFFF).
+	uint16_t crc = 0xFFFF;
+
+	for (int i = 0; i < len; i++) {
+		crc ^= ((uint16_t) data[i]) << 8;
+		for (int b = 0; b < 8; b++) {
+			crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : (crc << 1);
+		}
+	}
+
+	return(crc);
+}
+
+int cobsEncode(const uint8_t *input, int len, uint8_t *output) {
+	// Consistent Overhead Byte Stuffing. Returns the encoded length; the output contains no zero bytes.
+	int outIndex = 1;
+	int codeIndex = 0;
+	uint8_t code = 1;
+
+	for (int i = 0; i < len; i++) {
+		if (input[i] == 0) {
+			output[codeIndex] = code;
+			codeIndex = outIndex++;
+			code = 1;
+		} else {
+			output[outIndex++] = input[i];
+			code++;
+			if (code == 0xFF) {
+				output[codeIndex] = code;
+				codeIndex = outIndex++;
+				code = 1;
+			}
+		}
+	}
+
+	output[codeIndex] = code;
+	return(outIndex);
+}
+
+int cobsDecode(const uint8_t *input, int len, uint8_t *output) {
+	// Reverses cobsEncode. Returns the decoded length, or -1 if the block structure is invalid.
+	int index = 0;
+	int outIndex = 0;
+
+	while (index < len) {
+		uint8_t code = input[index];
+
+		if (code == 0 || index + code > len) {
+			return(-1);
+		}
+
+		for (int i = 1; i < code; i++) {
+			output[outIndex++] = input[index + i];
+		}
+		index += code;
+
+		if (code < 0xFF && index < len) {
+			output[outIndex++] = 0;
+		}
+	}
+
+	return(outIndex);
+}
+
+int writeU16(uint8_t *dest, uint16_t value) {
+	// Little-endian, to match the host's struct layouts.
+	dest[0] = value & 0xFF;
+	dest[1] = value >> 8;
+	return(2);
+}
+
+uint16_t readU16(const uint8_t *src) {
+	return(src[0] | (((uint16_t) src[1]) << 8));
+}
+
+int writeU32(uint8_t *dest, uint32_t value) {
+	// Little-endian, to match the host's struct layouts.
+	for (int i = 0; i < 4; i++) {
+		dest[i] = (value >> (8 * i)) & 0xFF;
+	}
+	return(4);
+}
+
+uint32_t readU32(const uint8_t *src) {
+	uint32_t value = 0;
+	for (int i = 0; i < 4; i++) {
+		value |= ((uint32_t) src[i]) << (8 * i);
+	}
+	return(value);
+}
+
+int writeF32(uint8_t *dest, float value) {
+	// The Teensy is little-endian, so the float's bytes can be copied straight out.
+	memcpy(dest, &value, 4);
+	return(4);
+}
+
+float readF32(const uint8_t *src) {
+	float value;
+	memcpy(&value, src, 4);
+	return(value);
+}
+
 bool cmdReady() {
-	// The first byte of a command will be the number of bytes in the command.
-	bool result = ((int) Serial.peek() == (int)Serial.available());
+	// The first byte of a command will be the number of bytes in the command. In a pipelined sort the host writes
+	// several frames back to back, so more than one may be waiting; the first is ready once all of it has arrived.
+	// A zero length byte can't start a real frame; it counts as a one byte frame so it gets read and thrown away.
+	int waiting = Serial.available();
+	bool result = (waiting > 0 && waiting >= max(Serial.peek(), 1));
 	return(result);
 }
 
 void sendCommand(Command sendCmd) {
+	if (binaryMode) {
+		sendBinary(sendCmd);
+		return;
+	}
+
 	String output = parseCmd(sendCmd);
 
 	Serial.println(output);
@@ -549,6 +1175,18 @@ void sendError(String err) {
 	sendCommand(errCommand);
 }
 
+void sendLost(uint8_t missed) {
+	// Tells the RPi that missed binary frames never arrived. Answers no request; the RPi retries whatever was lost.
+
+	Command lostCommand;
+
+	lostCommand.cmd = "LOS";
+	lostCommand.numArgs = 1;
+	lostCommand.args[0] = String(missed);
+
+	sendCommand(lostCommand);
+}
+
 void sendDat(String dat) {
 	// Sends misc data to the RPi
 
@@ -570,6 +1208,17 @@ void sendReady() {
 	sendCommand(readyCommand);
 }
 
+void sendReady(long seq) {
+	// Pipelined RDY, naming the resistor that has just cleared the load platform.
+	Command readyCommand;
+
+	readyCommand.cmd = "RDY";
+	readyCommand.numArgs = 1;
+	readyCommand.args[0] = String(seq);
+
+	sendCommand(readyCommand);
+}
+
 void sendDone() {
 	Command doneCommand;
 
@@ -605,10 +1254,14 @@ void clearRegisters() {
 
 double measureResistor() {
 	// This function completes a full measurement cycle and returns a resistance in Ohms.
-	// 0.0 represents a rejected resistor.
+	// 0.0 represents a rejected resistor. The contacts are left down; call releaseContacts() once the result is used.
+	// The range used and the number of ADC reads taken are left in lastRange and lastSamples.
 	
+	unsigned long phaseStart = micros();
 	ContactArm.write(contactTouch);
 	delay(contactTime);
+	contactMicros = micros() - phaseStart;
+	phaseStart = micros();
 	
 	int medianReading = maxAnalog / 2;
 	int cDifference = 99999;
@@ -616,68 +1269,224 @@ double measureResistor() {
 	int bestRange = 0;							// Range 0 is with outputs turned off, a safe fallback in case of failure.
 	double bestReading = 0.0;
 	double reading = 0.0;
-	long readingSums = 0;
-		
-	// For each range...
-	for (int i = 3; i <= 7; i++) {
-		
-		// Enable the outputs for testing this range and take a measurement.
-		ShiftReg.setAll(srState[i]);
-		delay(50);							// 5ms maximum operating time for relays, x10 for safety.
-
-		int goodCount = 0;
-		int count = 0;
-		bool testComplete = false;
-
-		// Try to get 30 good measurements, but give up after 100 attempts.
-		while (!testComplete) {
-			count++;
-			int thisReading = adc->analogRead(RMeas);
-			double thisResistance = getResistance(thisReading, i);
-
-			// If the resistance is in an acceptable range, it's good
-			if (thisResistance < maxAccepted && thisResistance > 0.5) {
-				readingSums = readingSums + thisReading;
-				goodCount++;
-			}
-
-			if (count > 100) {
-				testComplete = true;
+	double rawReading = 0.0;
+
+	lastSamples = 0;
+
+	if (adaptiveRanging || hintRange != 0) {
+		// Start where the last resistor landed (or the hinted range, or where the expected nominal should land) and
+		// walk toward mid-scale.
+		int windowCounts = (maxAnalog * rangeWindow) / 100;
+		int i = (lastRange != 0) ? lastRange : (hintRange != 0) ? hintRange : expectedRange();
+		bool tried[maxRange + 1] = { false };
+
+		while (i >= minRange && i <= maxRange && !tried[i]) {
+			tried[i] = true;
+			reading = readRange(i, rawReading);
+
+			cDifference = reading - medianReading;
+			cDifference = (cDifference < 0) ? -cDifference : cDifference;	// Absolute value
+
+			if (cDifference < bestDifference) {
+				bestRange = i;
+				bestDifference = cDifference;
+				bestReading = reading;
+			}
+
+			// Close enough to mid-scale, no need to look any further.
+			if (cDifference <= windowCounts) {
+				break;
+			}
+
+			// A high reading means the part is larger than this range is built for, so step to the next larger range
+			// (lower index). The raw average is used since an over-range reading has no good samples.
+			i = (rawReading > medianReading) ? i - 1 : i + 1;
+		}
+	} else {
+		// For each range...
+		for (int i = minRange; i <= maxRange; i++) {
+			reading = readRange(i, rawReading);
+
+			cDifference = reading - medianReading;
+			cDifference = (cDifference < 0) ? -cDifference : cDifference;	// Absolute value
+
+			// If this is better than the current best, make this the best.
+			if (cDifference < bestDifference) {
+				bestRange = i;
+				bestDifference = cDifference;
+				bestReading = reading;
 			}
+		}
+	}
+
+	if (bestRange != 0) {
+		lastRange = bestRange;
+	}
+
+	lastReading = bestReading;
+
+	// Convert the final result to a resistance.
+	double result = getResistance(bestReading, bestRange);
+	rangingMicros = micros() - phaseStart;
+
+	// Return the Ohms value.
+	return(result);
+}
 
-			if (goodCount > 30) {
+double readRange(int range, double &rawAverage) {
+	// Switches to the given range and returns the average of the good ADC readings (0.0 if there were none).
+	// rawAverage receives the average of every reading, good or not, which shows which way to step when out of range.
+
+	// Enable the outputs for testing this range and take a measurement.
+	ShiftReg.setAll(srState[range]);
+	delay(50);							// 5ms maximum operating time for relays, x10 for safety.
+
+	int goodCount = 0;
+	int count = 0;
+	long rawSums = 0;
+	double mean = 0.0;
+	double m2 = 0.0;
+	bool testComplete = false;
+
+	if (continuousAdc) {
+		adc->startContinuous(RMeas);
+	}
+
+	// Try to get enough good measurements, but give up after maxAttempts.
+	while (!testComplete) {
+		count++;
+		int thisReading = readSample();
+		double thisResistance = getResistance(thisReading, range);
+
+		rawSums = rawSums + thisReading;
+
+		// If the resistance is in an acceptable range, it's good. Mean and variance are kept as we go (Welford).
+		if (thisResistance < maxAccepted && thisResistance > 0.5) {
+			goodCount++;
+			double delta = thisReading - mean;
+			mean += delta / goodCount;
+			m2 += delta * (thisReading - mean);
+		}
+
+		if (count >= maxAttempts) {
+			testComplete = true;
+		}
+
+		if (seqTolerance > 0.0) {
+			// Stop once the mean is known well enough for the precision being sorted to, or once it is clear this
+			// range can't measure the part at all.
+			if (goodCount == 0 && count >= seqMinSamples) {
 				testComplete = true;
+			} else if (goodCount >= seqMinSamples) {
+				double stdErr = sqrt(m2 / (goodCount - 1) / goodCount);
+				if (relativeError(mean, stdErr, range) * 100.0 <= seqTolerance) {
+					testComplete = true;
+				}
 			}
+		} else if (goodCount >= goodTarget) {
+			testComplete = true;
 		}
+	}
 
-		if (goodCount == 0) {
-			reading = 0.0;
-		} else {
-			// Average the measurements
-			reading = (double) readingSums / (double) goodCount;
+	if (continuousAdc) {
+		adc->stopContinuous();
+	}
+
+	lastSamples += count;
+	rawAverage = (double) rawSums / (double) count;
+
+	if (goodCount == 0) {
+		return(0.0);
+	}
+
+	// The average of the good measurements
+	return(mean);
+}
+
+int readSample() {
+	// One reading of the measurement pin. In continuous mode, waits for the conversion already running to finish.
+	if (continuousAdc) {
+		while (!adc->isComplete()) {
+			;
 		}
+		return(adc->analogReadContinuous());
+	}
+
+	return(adc->analogRead(RMeas));
+}
 
-		cDifference = reading - medianReading;
-		cDifference = (cDifference < 0) ? -cDifference : cDifference;	// Absolute value
+double relativeError(double counts, double stdErr, int range) {
+	// The relative error in resistance caused by stdErr counts of error in a reading of counts on a range.
+	if (counts <= 0.0 || counts >= maxAnalog) {
+		return(1.0);
+	}
 
-		// If this is better than the current best, make this the best.
-		if (cDifference < bestDifference) {
-			bestRange = i;
-			bestDifference = cDifference;
-			bestReading = reading;
+	if (range <= 6) {
+		// R = Rd * m / (max - m), so dR / R = dm * max / (m * (max - m)).
+		return(stdErr * maxAnalog / (counts * (maxAnalog - counts)));
+	}
+
+	// R is proportional to m.
+	return(stdErr / counts);
+}
+
+double rangeMidpoint(int range) {
+	// Returns the resistance that reads at mid-scale on the given range.
+
+	if (range <= 6) {
+		// Voltage divider ranges read mid-scale when the part matches the internal resistor.
+		return(calValues[range - 1]);
+	}
+
+	// Current source ranges read mid-scale at half the low reference voltage.
+	return((avLow / 2.0) / calValues[range - 1]);
+}
+
+int expectedRange() {
+	// Picks the range for the nominal of the first accepting cup.
+
+	for (int c = 0; c < cupCount; c++) {
+		if (!Wheel.cups[c].isReject()) {
+			return(nearestRange((Wheel.cups[c].getMin() + Wheel.cups[c].getMax()) / 2.0));
 		}
 	}
 
-	// Convert the final result to a resistance.
-	double result = getResistance(bestReading, bestRange);
+	return(minRange);
+}
+
+int nearestRange(double value) {
+	// Picks the range whose mid-scale is closest (by ratio) to the given resistance.
+	int result = minRange;
+	double bestRatio = 99999.0;
+
+	if (value <= 0.0) {
+		return(minRange);
+	}
+
+	for (int i = minRange; i <= maxRange; i++) {
+		double ratio = fabs(log10(value / rangeMidpoint(i)));
+		if (ratio < bestRatio) {
+			bestRatio = ratio;
+			result = i;
+		}
+	}
+
+	return(result);
+}
 
+void releaseContacts() {
 	// Return to home position after measurement made.
 	ContactArm.write(contactHome);
 	delay(contactTime);
 	ShiftReg.setAll(srState[0]);
-	
-	// Return the Ohms value.
-	return(result);
+}
+
+void resetCalibration() {
+	// Loads the compiled calibration into the RAM copies CAL can change.
+	for (int i = 0; i < rangeCount; i++) {
+		calValues[i] = (i < 6) ? internalTestResistances[i] : internalCurrentSources[i - 6];
+		calOffsets[i] = 0.0;
+	}
 }
 
 double getResistance(double measurement, int range) {
@@ -699,20 +1508,18 @@ double getResistance(double measurement, int range) {
 		double vReading = measurement * (avHigh / maxAnalog);
 
 		// Voltage divider formula solved for R2...
-		result = (internalTestResistances[range] * vReading) / (avHigh - vReading);
+		result = (calValues[range] * vReading) / (avHigh - vReading);
 
 	} else {
-		// Bring the range down to 0 index from 6-8 index
-		range = range - 6;
-
 		//Convert the reading to volts. (Low voltage for current sources)
 		double vReading = measurement * (avLow / maxAnalog);
 
 		// Current source measurement is simple, V=IR, solving for R gives R=V/I
-		result = vReading / internalCurrentSources[range];
+		result = vReading / calValues[range];
 	}
 
-	return(result);
+	// Lead and contact resistance, as fitted by the host.
+	return(result + calOffsets[range]);
 }
 
 double getMin(double nominal, double precision) {
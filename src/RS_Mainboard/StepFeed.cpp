@@ -18,6 +18,10 @@ Westcott (shawn.westcott@8tinybits.com).
 StepFeed::StepFeed(int wireChannel) {
 	_wireChannel = wireChannel;
 	_queue = {B00000000};
+
+	for (int i = 0; i < 8; i++) {
+		_seq[i] = 0;
+	}
 }
 
 int StepFeed::cycleFeed(int count) {
@@ -33,6 +37,11 @@ int StepFeed::cycleFeed(int count) {
 	// Left shift the queue (This mimics the physical action where resistors are shifted forward)
 	_queue = _queue << count;
 
+	// Sequence numbers shift along with their resistors.
+	for (int i = 7; i >= 0; i--) {
+		_seq[i] = (i >= count) ? _seq[i - count] : 0;
+	}
+
 	return(0);
 }
 
@@ -65,6 +74,17 @@ bool StepFeed::feedEmpty() {
 void StepFeed::load() {
 	// Force a 1 into the Load Platform bit.
 	_queue = _queue | B00000001;
+	_seq[0] = 0;
+}
+
+void StepFeed::load(long seq) {
+	this->load();
+	_seq[0] = seq;
+}
+
+long StepFeed::measureSeq() {
+	// Position 4 is the measurement platform.
+	return(_seq[4]);
 }
 
 void StepFeed::dispense() {
@@ -35,6 +35,12 @@ class StepFeed {
 
 		// Loads a new resistor into the system at the load platform
 		void load();
+
+		// Loads a new resistor and tags it with a host sequence number, which travels with it through the feed.
+		void load(long seq);
+
+		// Returns the sequence number of the resistor on the measurement platform.
+		long measureSeq();
 		
 		// "Dispenses" a resistor from the system at the measurement platform (Actuation still needed)
 		void dispense();
@@ -42,6 +48,7 @@ class StepFeed {
 	private:
 		int _wireChannel;
 		uint8_t _queue;			// The resistor queue is represented internally by a collection of bits. The LSB = feed platform, bit 4 = test platform. Bits 5-7 are ignored.
+		long _seq[8];			// Sequence number of the resistor in each position of _queue.
 
 };
 